@@ -4,18 +4,18 @@ from .models import StaticCamera, DDNSCamera, TempFace,  CameraStream
 
 @admin.register(StaticCamera)
 class StaticCameraAdmin(admin.ModelAdmin):
-    list_display = ('user', 'ip_address', 'name')
+    list_display = ('user', 'ip_address', 'name', 'detection_channel')
 
 @admin.register(DDNSCamera)
 class DDNSCameraAdmin(admin.ModelAdmin):
-    list_display = ('user', 'ddns_hostname', 'name')
+    list_display = ('user', 'ddns_hostname', 'name', 'detection_channel')
 
 @admin.register(TempFace)
 class TempFaceAdmin(admin.ModelAdmin):
-    list_display = ('user', 'face_id','last_seen','image_data')
+    list_display = ('user', 'camera_name', 'face_id','last_seen','image_data')
 
 
 
 @admin.register(CameraStream)
 class CameraStreamAdmin(admin.ModelAdmin):
-    list_display = ('user', 'stream_url', 'created_at')
+    list_display = ('user', 'stream_url', 'tracker_type', 'created_at')
@@ -0,0 +1,397 @@
+# camera/ann_index.py
+import os
+import time
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class _VectorBlock:
+    """
+    Growable dense block of (id, vector) rows with O(1) swap-removal.
+    Squared norms are cached so distances need a single matrix product.
+    """
+
+    def __init__(self, dim, capacity=16):
+        self.dim = dim
+        self.count = 0
+        self.ids = np.empty(capacity, dtype=np.int64)
+        self.vectors = np.empty((capacity, dim), dtype=np.float32)
+        self.sq_norms = np.empty(capacity, dtype=np.float32)
+
+    @classmethod
+    def from_arrays(cls, dim, ids, vectors):
+        block = cls(dim, capacity=max(len(ids), 16))
+        block.count = len(ids)
+        block.ids[:block.count] = ids
+        block.vectors[:block.count] = vectors
+        block.sq_norms[:block.count] = np.einsum('ij,ij->i', vectors, vectors)
+        return block
+
+    def append(self, vector_id, vector):
+        if self.count == self.ids.shape[0]:
+            capacity = self.ids.shape[0] * 2
+            self.ids = np.resize(self.ids, capacity)
+            vectors = np.empty((capacity, self.dim), dtype=np.float32)
+            vectors[:self.count] = self.vectors[:self.count]
+            self.vectors = vectors
+            self.sq_norms = np.resize(self.sq_norms, capacity)
+        row = self.count
+        self.ids[row] = vector_id
+        self.vectors[row] = vector
+        self.sq_norms[row] = vector @ vector
+        self.count += 1
+        return row
+
+    def remove(self, row):
+        """
+        Remove a row by moving the last one into it. Returns the id that was
+        moved into `row`, or None if `row` was the last row.
+        """
+        last = self.count - 1
+        moved_id = None
+        if row != last:
+            self.ids[row] = self.ids[last]
+            self.vectors[row] = self.vectors[last]
+            self.sq_norms[row] = self.sq_norms[last]
+            moved_id = int(self.ids[row])
+        self.count -= 1
+        return moved_id
+
+    def sq_distances(self, probe):
+        count = self.count
+        return self.sq_norms[:count] - 2.0 * (self.vectors[:count] @ probe) + probe @ probe
+
+
+def _top_k(sq_distances, ids, k):
+    k = min(k, sq_distances.shape[0])
+    if k == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    nearest = np.argpartition(sq_distances, k - 1)[:k]
+    nearest = nearest[np.argsort(sq_distances[nearest])]
+    return ids[nearest], np.sqrt(np.maximum(sq_distances[nearest], 0.0))
+
+
+class ExactIndex:
+    """
+    Brute-force Euclidean search over every stored vector.
+    """
+
+    name = 'exact'
+
+    def __init__(self, dim):
+        self.dim = dim
+        self._block = _VectorBlock(dim)
+        self._rows = {}
+
+    def __len__(self):
+        return self._block.count
+
+    def __contains__(self, vector_id):
+        return vector_id in self._rows
+
+    def add(self, vector_id, vector):
+        vector = np.asarray(vector, dtype=np.float32).reshape(self.dim)
+        row = self._rows.get(vector_id)
+        if row is None:
+            self._rows[vector_id] = self._block.append(vector_id, vector)
+        else:
+            self._block.vectors[row] = vector
+            self._block.sq_norms[row] = vector @ vector
+
+    def add_batch(self, ids, vectors):
+        """
+        Add many vectors at once; into an empty index this is a single copy.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        if len(self):
+            for vector_id, vector in zip(ids, vectors):
+                self.add(vector_id, vector)
+            return
+        ids = np.asarray(ids, dtype=np.int64)
+        self._block = _VectorBlock.from_arrays(self.dim, ids, vectors)
+        self._rows = {vector_id: row for row, vector_id in enumerate(ids.tolist())}
+
+    def remove(self, vector_id):
+        row = self._rows.pop(vector_id, None)
+        if row is None:
+            return
+        moved_id = self._block.remove(row)
+        if moved_id is not None:
+            self._rows[moved_id] = row
+
+    def vectors(self):
+        return self._block.ids[:len(self)].copy(), self._block.vectors[:len(self)].copy()
+
+    def search(self, probe, k=1):
+        """
+        Return (ids, distances) of the k nearest vectors, nearest first.
+        """
+        probe = np.asarray(probe, dtype=np.float32).reshape(self.dim)
+        return _top_k(self._block.sq_distances(probe), self._block.ids[:len(self)], k)
+
+
+
+def kmeans(vectors, k, iterations=20, seed=0):
+    """
+    Plain Lloyd's k-means with k-means++ seeding, used to train the IVF
+    coarse quantizer.
+    """
+    rng = np.random.default_rng(seed)
+    n = vectors.shape[0]
+    sq_norms = np.einsum('ij,ij->i', vectors, vectors)
+
+    centroids = np.empty((k, vectors.shape[1]), dtype=np.float32)
+    centroids[0] = vectors[rng.integers(n)]
+    closest = np.full(n, np.inf, dtype=np.float32)
+    for i in range(1, k):
+        d = sq_norms - 2.0 * (vectors @ centroids[i - 1]) + centroids[i - 1] @ centroids[i - 1]
+        closest = np.minimum(closest, np.maximum(d, 0.0))
+        weights = closest.astype(np.float64)
+        total = weights.sum()
+        choice = rng.choice(n, p=weights / total) if total > 0 else rng.integers(n)
+        centroids[i] = vectors[choice]
+
+    for _ in range(iterations):
+        d = sq_norms[:, None] - 2.0 * (vectors @ centroids.T) + np.einsum('ij,ij->i', centroids, centroids)[None, :]
+        assignment = np.argmin(d, axis=1)
+        counts = np.bincount(assignment, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        moved = counts > 0
+        new_centroids = centroids.copy()
+        new_centroids[moved] = sums[moved] / counts[moved, None]
+        if np.allclose(new_centroids, centroids, atol=1e-5):
+            break
+        centroids = new_centroids
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted-file index: vectors are partitioned by their nearest k-means
+    centroid and a query only scans the `nprobe` closest partitions.
+
+    Until `min_train_size` vectors are present the index stays untrained and
+    scans everything exactly. It needs retraining once the collection has
+    grown `retrain_factor` times past the size it was trained on; with
+    `auto_train` add() does so itself, otherwise the owner trains it (see
+    FaceGallery, which fits the centroids on a background thread). New
+    vectors are inserted incrementally into their nearest partition.
+    """
+
+    name = 'ivf'
+
+    def __init__(self, dim, nprobe=8, min_train_size=2048, retrain_factor=4.0, centroids=None, trained_size=0, auto_train=True):
+        self.dim = dim
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.retrain_factor = retrain_factor
+        self.auto_train = auto_train
+        self.trained_size = 0
+        self.centroids = None
+        self._centroid_sq_norms = None
+        self._lists = [_VectorBlock(dim)]
+        self._location = {}
+        if centroids is not None:
+            self._set_centroids(np.asarray(centroids, dtype=np.float32))
+            self._lists = [_VectorBlock(dim) for _ in range(self.centroids.shape[0])]
+            self.trained_size = trained_size
+
+    def __len__(self):
+        return len(self._location)
+
+    def __contains__(self, vector_id):
+        return vector_id in self._location
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    @property
+    def needs_training(self):
+        return len(self) >= self.min_train_size and len(self) >= self.trained_size * self.retrain_factor
+
+    def _set_centroids(self, centroids):
+        self.centroids = centroids
+        self._centroid_sq_norms = np.einsum('ij,ij->i', centroids, centroids)
+
+    def _nearest_lists(self, vector, count):
+        d = self._centroid_sq_norms - 2.0 * (self.centroids @ vector)
+        count = min(count, d.shape[0])
+        return np.argpartition(d, count - 1)[:count] if count < d.shape[0] else np.arange(d.shape[0])
+
+    def _insert(self, vector_id, vector):
+        list_no = int(self._nearest_lists(vector, 1)[0]) if self.is_trained else 0
+        self._location[vector_id] = (list_no, self._lists[list_no].append(vector_id, vector))
+
+    def add(self, vector_id, vector):
+        vector = np.asarray(vector, dtype=np.float32).reshape(self.dim)
+        if vector_id in self._location:
+            self.remove(vector_id)
+        self._insert(vector_id, vector)
+
+        if self.auto_train and self.needs_training:
+            self.train()
+
+    def add_batch(self, ids, vectors):
+        """
+        Add many vectors at once: into an empty index they are partitioned in
+        one vectorised pass instead of one insert each.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        if len(self):
+            for vector_id, vector in zip(ids, vectors):
+                self.add(vector_id, vector)
+            return
+        ids = np.asarray(ids, dtype=np.int64)
+        if self.is_trained:
+            self._distribute(ids, vectors)
+        else:
+            self._lists = [_VectorBlock.from_arrays(self.dim, ids, vectors)]
+            self._location = {vector_id: (0, row) for row, vector_id in enumerate(ids.tolist())}
+
+        if self.auto_train and self.needs_training:
+            self.train()
+
+    def remove(self, vector_id):
+        location = self._location.pop(vector_id, None)
+        if location is None:
+            return
+        list_no, row = location
+        moved_id = self._lists[list_no].remove(row)
+        if moved_id is not None:
+            self._location[moved_id] = (list_no, row)
+
+    def vectors(self):
+        ids = np.concatenate([block.ids[:block.count] for block in self._lists])
+        vectors = np.concatenate([block.vectors[:block.count] for block in self._lists])
+        return ids, vectors
+
+    @staticmethod
+    def fit(vectors):
+        """
+        Fit coarse quantizer centroids to `vectors`, sqrt(n) lists of them.
+        The slow part of training; it touches no index state.
+        """
+        n_lists = max(1, int(np.sqrt(len(vectors))))
+        start = time.perf_counter()
+        centroids = kmeans(vectors, n_lists)
+        logger.info(f"Trained IVF quantizer with {n_lists} lists on {len(vectors)} vectors in {time.perf_counter() - start:.2f}s")
+        return centroids
+
+    def train(self, centroids=None, trained_size=None):
+        """
+        (Re)build the coarse quantizer, from `centroids` if given (fitted on
+        `trained_size` vectors), and redistribute every vector.
+        """
+        ids, vectors = self.vectors()
+        if centroids is None:
+            centroids = self.fit(vectors)
+        self._set_centroids(np.asarray(centroids, dtype=np.float32))
+        self.trained_size = len(ids) if trained_size is None else trained_size
+        self._distribute(ids, vectors)
+
+    def _distribute(self, ids, vectors):
+        # Rebuild the partitions from scratch, assigning vectors to their
+        # nearest centroid in chunks to bound the size of the distance matrix
+        assignment = np.empty(len(ids), dtype=np.int64)
+        for start in range(0, len(ids), 4096):
+            chunk = vectors[start:start + 4096]
+            d = self._centroid_sq_norms[None, :] - 2.0 * (chunk @ self.centroids.T)
+            assignment[start:start + 4096] = np.argmin(d, axis=1)
+
+        self._lists, self._location = [], {}
+        for list_no in range(self.centroids.shape[0]):
+            rows = np.flatnonzero(assignment == list_no)
+            self._lists.append(_VectorBlock.from_arrays(self.dim, ids[rows], vectors[rows]))
+            for row, vector_id in enumerate(ids[rows].tolist()):
+                self._location[vector_id] = (list_no, row)
+
+    def search(self, probe, k=1):
+        """
+        Return (ids, distances) of the (approximately) k nearest vectors.
+        """
+        probe = np.asarray(probe, dtype=np.float32).reshape(self.dim)
+        list_nos = self._nearest_lists(probe, self.nprobe) if self.is_trained else [0]
+        blocks = [self._lists[list_no] for list_no in list_nos if self._lists[list_no].count]
+        if not blocks:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        sq_distances = np.concatenate([block.sq_distances(probe) for block in blocks])
+        ids = np.concatenate([block.ids[:block.count] for block in blocks])
+        return _top_k(sq_distances, ids, k)
+
+    def save_quantizer(self, path):
+        """
+        Save the trained centroids (not the vectors, which are reloaded from
+        the database) to `path`, replacing it atomically.
+        """
+        centroids = self.centroids if self.is_trained else np.empty((0, self.dim), dtype=np.float32)
+        temporary = f"{path}.tmp"
+        with open(temporary, 'wb') as f:
+            np.savez(f, backend=self.name, centroids=centroids, trained_size=self.trained_size)
+        os.replace(temporary, path)
+
+    @classmethod
+    def read_quantizer(cls, path):
+        """
+        Return (centroids, trained_size) from a saved quantizer, or (None, 0)
+        if it was saved untrained.
+        """
+        with np.load(path) as data:
+            if not data['centroids'].shape[0]:
+                return None, 0
+            return data['centroids'], int(data['trained_size'])
+
+
+INDEX_BACKENDS = {
+    ExactIndex.name: ExactIndex,
+    IVFIndex.name: IVFIndex,
+}
+
+
+def create_index(backend, dim, **options):
+    try:
+        index_class = INDEX_BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown face index backend: {backend}")
+    if index_class is ExactIndex:
+        return ExactIndex(dim)
+    return index_class(dim, **options)
+
+
+def benchmark(vectors, queries, backend='ivf', k=1, **options):
+    """
+    Compare an index backend against exact search on the same data and
+    report recall@k, average query latency and build time for both.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    queries = np.asarray(queries, dtype=np.float32)
+    results = {}
+    answers = {}
+    for name in (ExactIndex.name, backend):
+        start = time.perf_counter()
+        index = create_index(name, vectors.shape[1], **({} if name == ExactIndex.name else options))
+        for vector_id, vector in enumerate(vectors):
+            index.add(vector_id, vector)
+        build_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        answers[name] = [set(index.search(query, k)[0].tolist()) for query in queries]
+        query_seconds = time.perf_counter() - start
+
+        results[name] = {
+            'size': len(index),
+            'build_seconds': build_seconds,
+            'query_ms': query_seconds * 1000 / max(len(queries), 1),
+        }
+
+    hits = sum(len(found & truth) for found, truth in zip(answers[backend], answers[ExactIndex.name]))
+    results[backend]['recall'] = hits / max(sum(len(truth) for truth in answers[ExactIndex.name]), 1)
+    results[ExactIndex.name]['recall'] = 1.0
+    return results
+
+
+def index_path(directory, user_id):
+    return os.path.join(directory, f"user_{user_id}.npz")
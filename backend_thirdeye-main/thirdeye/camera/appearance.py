@@ -0,0 +1,59 @@
+# camera/appearance.py
+import cv2
+import numpy as np
+
+# Appearance descriptors fed to the DeepSORT tracker for association.
+# They only need to tell apart the few faces in view at the same time, so
+# a small float32 vector is plenty and keeps the tracker's sample gallery
+# (NN_BUDGET samples per track) and its cosine distance matrices cheap.
+
+POOL_SIZE = 8  # 8x8 pooled grey-level layout
+HIST_BINS = 4  # 4x4x4 colour histogram
+COMPACT_DIM = POOL_SIZE * POOL_SIZE + HIST_BINS ** 3
+
+PIXEL_SIZE = 96
+PIXEL_DIM = PIXEL_SIZE * PIXEL_SIZE * 3
+
+
+def _unit(vector):
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        return np.full(vector.shape, 1.0 / np.sqrt(vector.size), dtype=np.float32)
+    return (vector / norm).astype(np.float32)
+
+
+def compact_descriptor(face_roi):
+    """
+    128-d float32 descriptor of a BGR face crop: its 8x8 area-pooled grey
+    levels with the mean removed (the coarse layout of the face, robust to
+    exposure changes) next to the square root of its 4x4x4 colour
+    histogram (skin, hair and clothing colour). Each half is L2-normalised
+    before the whole is.
+    """
+    if face_roi.size == 0:
+        return _unit(np.zeros(COMPACT_DIM, dtype=np.float32))
+
+    gray = cv2.cvtColor(face_roi, cv2.COLOR_BGR2GRAY)
+    layout = cv2.resize(gray, (POOL_SIZE, POOL_SIZE), interpolation=cv2.INTER_AREA).astype(np.float32).reshape(-1)
+    layout -= layout.mean()
+
+    hist = cv2.calcHist([face_roi], [0, 1, 2], None, [HIST_BINS] * 3, [0, 256] * 3).reshape(-1)
+    hist = np.sqrt(hist / max(hist.sum(), 1.0))
+
+    return _unit(np.concatenate([_unit(layout), _unit(hist)]))
+
+
+def pixel_descriptor(face_roi):
+    """
+    The original descriptor: the crop resized to 96x96 and flattened, with
+    pixel values scaled to [0, 1]. Kept for benchmarking.
+    """
+    if face_roi.size == 0:
+        return _unit(np.zeros(PIXEL_DIM, dtype=np.float32))
+    return (cv2.resize(face_roi, (PIXEL_SIZE, PIXEL_SIZE)).reshape(-1) / 255.0).astype(np.float32)
+
+
+DESCRIPTORS = {
+    'compact': compact_descriptor,
+    'pixels': pixel_descriptor,
+}
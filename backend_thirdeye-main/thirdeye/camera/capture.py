@@ -0,0 +1,217 @@
+# camera/capture.py
+import time
+import asyncio
+import logging
+import threading
+from collections import namedtuple
+import cv2
+
+logger = logging.getLogger(__name__)
+
+MAX_RETRIES = 10  # Attempts to (re)open a stream before giving up
+RETRY_DELAY = 2.0
+MAX_READ_FAILURES = 50  # Consecutive failed reads before reconnecting
+READ_FAILURE_DELAY = 0.1
+STOP_TIMEOUT = 5.0  # Longest stop() waits for the capture thread to exit
+EWMA_ALPHA = 0.1
+
+Frame = namedtuple('Frame', ['image', 'index', 'captured_at'])
+
+
+class FrameGrabber:
+    """
+    Reads one video stream on a dedicated thread and keeps only the newest
+    decoded frame in a single slot, so a slow consumer always gets the
+    freshest frame instead of draining a backlog of stale ones.
+
+    Frames overwritten before anyone took them are counted as dropped.
+    The thread reconnects on its own when the stream stalls and gives up
+    after MAX_RETRIES failed attempts to open it.
+
+    An `on_demand` grabber keeps reading the stream so it stays current,
+    but only retrieves (converts and copies out) a frame when one is asked
+    for with request(): used for a full-resolution main stream when faces
+    are detected on a camera's substream.
+    """
+
+    def __init__(self, url, name=None, max_retries=MAX_RETRIES, retry_delay=RETRY_DELAY, on_demand=False):
+        self.url = url
+        self.on_demand = on_demand
+        self.name = name or 'frame-grabber'
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.error = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wanted = threading.Event()
+        self._thread = None
+        self._loop = None
+        self._event = asyncio.Event()
+        self._frame = None
+        self._consumed = True
+        self.frames_captured = 0
+        self.frames_delivered = 0
+        self.frames_dropped = 0
+        self.frames_skipped = 0
+        self.reconnects = 0
+        self.capture_fps = 0.0
+        self.decode_seconds = 0.0
+        self._last_capture = None
+
+    def start(self):
+        try:
+            self._loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._loop = None
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """
+        Ask the capture thread to exit and wait at most `timeout` seconds for
+        it. The thread releases the VideoCapture itself on its way out, so a
+        thread stuck opening or reading a dead stream is left to finish on
+        its own (it is a daemon). This blocks, so call it off the event loop.
+        """
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                logger.warning(f"Capture of {self.url} did not stop within {timeout}s, leaving it to exit on its own")
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def latest(self):
+        """
+        Take the newest frame if it has not been returned before, else None.
+        """
+        with self._lock:
+            if self._consumed:
+                return None
+            self._consumed = True
+            self.frames_delivered += 1
+            return self._frame
+
+    async def next_frame(self, timeout=None):
+        """
+        Wait for a frame newer than the last one returned. Returns None on
+        timeout and raises RuntimeError once the stream cannot be reopened.
+        """
+        while True:
+            self._event.clear()
+            frame = self.latest()
+            if frame is not None:
+                return frame
+            if self.error is not None:
+                raise self.error
+            if not self.is_alive():
+                raise RuntimeError(f"Capture of {self.url} has stopped")
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+
+    async def request(self, timeout=None):
+        """
+        Ask an on-demand grabber for the next frame it reads. Returns None on
+        timeout.
+        """
+        with self._lock:
+            self._consumed = True
+        self._wanted.set()
+        return await self.next_frame(timeout)
+
+    def stats(self):
+        return {
+            'frames_captured': self.frames_captured,
+            'frames_delivered': self.frames_delivered,
+            'frames_dropped': self.frames_dropped,
+            'frames_skipped': self.frames_skipped,
+            'reconnects': self.reconnects,
+            'capture_fps': self.capture_fps,
+            'decode_ms': self.decode_seconds * 1000,
+        }
+
+    def _notify(self):
+        if self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._event.set)
+            except RuntimeError:
+                # The event loop has already been closed
+                pass
+
+    def _publish(self, image, decode_seconds):
+        now = time.monotonic()
+        with self._lock:
+            if not self._consumed:
+                self.frames_dropped += 1
+            self.frames_captured += 1
+            self._frame = Frame(image, self.frames_captured, now)
+            self._consumed = False
+
+        self.decode_seconds += EWMA_ALPHA * (decode_seconds - self.decode_seconds)
+        if self._last_capture is not None and now > self._last_capture:
+            self.capture_fps += EWMA_ALPHA * (1.0 / (now - self._last_capture) - self.capture_fps)
+        self._last_capture = now
+        self._notify()
+
+    def _open(self):
+        cap = cv2.VideoCapture(self.url)
+        if not cap.isOpened():
+            cap.release()
+            return None
+        # Keep OpenCV from queueing frames behind our back
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return cap
+
+    def _run(self):
+        attempts = 0
+        while not self._stop.is_set():
+            cap = self._open()
+            if cap is None:
+                attempts += 1
+                logger.error(f"Failed to open video capture for {self.url} (attempt {attempts}/{self.max_retries})")
+                if attempts >= self.max_retries:
+                    self.error = RuntimeError(f"Failed to open video capture for {self.url}")
+                    self._notify()
+                    return
+                self._stop.wait(self.retry_delay)
+                continue
+
+            logger.info(f"Opened video capture for URL: {self.url}")
+            attempts = 0
+            try:
+                self._read_until_stalled(cap)
+            finally:
+                cap.release()
+                logger.info('Video capture released')
+
+            if not self._stop.is_set():
+                self.reconnects += 1
+                logger.warning(f"Stream {self.url} stalled, reconnecting")
+
+    def _read_until_stalled(self, cap):
+        failures = 0
+        while not self._stop.is_set():
+            start = time.perf_counter()
+            if self.on_demand:
+                ret, image = cap.grab(), None
+                if ret and self._wanted.is_set():
+                    ret, image = cap.retrieve()
+            else:
+                ret, image = cap.read()
+            if not ret:
+                failures += 1
+                if failures >= MAX_READ_FAILURES:
+                    return
+                logger.warning('Failed to capture frame')
+                self._stop.wait(READ_FAILURE_DELAY)
+                continue
+            failures = 0
+            if image is None:
+                # Read but nobody asked for it
+                self.frames_skipped += 1
+                continue
+            self._wanted.clear()
+            self._publish(image, time.perf_counter() - start)
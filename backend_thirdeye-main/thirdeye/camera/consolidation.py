@@ -0,0 +1,162 @@
+# camera/consolidation.py
+import time
+import asyncio
+import logging
+from collections import defaultdict, namedtuple
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from asgiref.sync import sync_to_async
+from .models import TempFace
+from .face_index import face_galleries
+from .persistence import write_behind
+from .pipeline import collect_batch
+
+logger = logging.getLogger(__name__)
+
+ConsolidationJob = namedtuple('ConsolidationJob', ['processor', 'candidates', 'future', 'submitted_at'])
+
+# Queue marker asking the worker to pick up TempFace rows left by a crash
+RECOVER = object()
+
+
+class ConsolidationService:
+    """
+    Consolidates finished tracks for every stream served by this worker.
+
+    FaceRecognitionProcessor submits a track's staged crops when the track
+    is flushed. The service sleeps until a job arrives, collects more for at
+    most `max_latency` seconds (or until `max_batch_size` jobs) and then
+    works through the batch grouped by (user, camera), so each user's
+    gallery is loaded once per batch. Nothing polls the database while the
+    queue is empty.
+    """
+
+    def __init__(self, max_latency, max_batch_size):
+        self.max_latency = max_latency
+        self.max_batch_size = max_batch_size
+        self._queue = None
+        self._task = None
+        self.jobs_done = 0
+        self.batches_run = 0
+        self.last_batch_seconds = 0.0
+        self.total_wait_seconds = 0.0
+
+    def start(self):
+        if self._task is not None and not self._task.done():
+            return
+        loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._task = loop.create_task(self._run())
+        logger.info(f"Consolidation service started (latency={self.max_latency * 1000:.0f}ms, batch={self.max_batch_size})")
+
+        if settings.FACE_TRACK_BUFFER_DURABLE:
+            # Recover now, and again once rows orphaned just before this
+            # start are old enough that no live track can still own them
+            self._queue.put_nowait(RECOVER)
+            loop.call_later(2 * settings.FACE_TRACK_BUFFER_MAX_AGE, self._queue.put_nowait, RECOVER)
+
+    def submit(self, processor, candidates):
+        """
+        Queue a flushed track's candidates (best first) for consolidation and
+        return an asyncio Future that resolves to the SelectedFaceKey the
+        track was consolidated into, or None.
+        """
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(ConsolidationJob(processor, candidates, future, time.monotonic()))
+        return future
+
+    def pending(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def drain(self):
+        """
+        Wait until every submitted job has been consolidated.
+        """
+        if self._queue is not None and self._task is not None and not self._task.done():
+            await self._queue.join()
+
+    def stats(self):
+        return {
+            'pending': self.pending(),
+            'jobs_done': self.jobs_done,
+            'batches_run': self.batches_run,
+            'average_batch_size': self.jobs_done / self.batches_run if self.batches_run else 0.0,
+            'average_wait_ms': self.total_wait_seconds * 1000 / self.jobs_done if self.jobs_done else 0.0,
+            'last_batch_seconds': self.last_batch_seconds,
+        }
+
+    async def _run(self):
+        while True:
+            batch = await collect_batch(self._queue, self.max_batch_size, self.max_latency)
+            start = time.perf_counter()
+            try:
+                await self._process(batch)
+            except Exception as e:
+                logger.error(f"Error in face consolidation: {str(e)}", exc_info=True)
+            finally:
+                self.last_batch_seconds = time.perf_counter() - start
+                self.batches_run += 1
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _process(self, batch):
+        if any(job is RECOVER for job in batch):
+            await self.recover()
+
+        groups = defaultdict(list)
+        for job in batch:
+            if job is not RECOVER:
+                groups[(job.processor.user.id, job.processor.camera_name)].append(job)
+
+        for (user_id, camera_name), jobs in groups.items():
+            # Load (or refresh) the user's gallery once for the whole group
+            await sync_to_async(face_galleries.get)(user_id)
+            logger.debug(f"Consolidating {len(jobs)} tracks for user {user_id} on {camera_name}")
+
+            for job in jobs:
+                self.total_wait_seconds += time.monotonic() - job.submitted_at
+                try:
+                    result = await job.processor.consolidate_candidates(job.candidates)
+                except Exception as e:
+                    logger.error(f"Error consolidating track for user {user_id}: {str(e)}", exc_info=True)
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                else:
+                    if not job.future.done():
+                        job.future.set_result(result)
+                self.jobs_done += 1
+
+    async def recover(self):
+        """
+        Consolidate durable TempFace rows that no live track can own any more,
+        each on behalf of the user and camera that captured it.
+        """
+        from .face_recognition_module import FaceRecognitionProcessor
+
+        stale_before = timezone.now() - timedelta(seconds=2 * settings.FACE_TRACK_BUFFER_MAX_AGE)
+        stale = TempFace.objects.filter(processed=False, last_seen__lt=stale_before)
+
+        orphans = await sync_to_async(stale.filter(user__isnull=True).delete)()
+        if orphans[0]:
+            logger.warning(f"Dropped {orphans[0]} TempFaces without a user")
+
+        owners = await sync_to_async(list)(stale.values_list('user_id', 'camera_name').distinct())
+        User = get_user_model()
+        for user_id, camera_name in owners:
+            user = await sync_to_async(User.objects.get)(id=user_id)
+            processor = FaceRecognitionProcessor(user=user, camera_name=camera_name)
+            await processor.process_temp_faces(stale_before)
+        if owners:
+            # Make sure a later recovery does not find the same rows again
+            await write_behind.drain()
+            logger.info(f"Recovered TempFaces for {len(owners)} user/camera pairs")
+
+
+# Tracks flushed by any stream are batched together and grouped by user
+consolidation_service = ConsolidationService(
+    max_latency=settings.FACE_CONSOLIDATION_LATENCY_MS / 1000,
+    max_batch_size=settings.FACE_CONSOLIDATION_BATCH_SIZE,
+)
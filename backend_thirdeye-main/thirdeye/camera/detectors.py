@@ -0,0 +1,223 @@
+# camera/detectors.py
+import os
+import logging
+from collections import namedtuple
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+NMS_IOU = 0.45
+PAD_VALUE = 114
+NUM_LANDMARKS = 5
+
+
+class Detections(namedtuple('Detections', ['boxes', 'scores', 'landmarks'])):
+    """
+    Faces found in one frame: (N, 4) float32 (x1, y1, x2, y2) boxes, (N,)
+    scores and (N, 5, 2) facial keypoints, or None when the model has none.
+    """
+
+    def faces(self):
+        """
+        The [x, y, w, h, confidence] rows DeepSORT Detection objects are built from.
+        """
+        boxes = self.boxes.reshape(-1, 4)
+        return np.column_stack([boxes[:, :2], boxes[:, 2:] - boxes[:, :2], self.scores]).astype(np.float32)
+
+
+def empty_detections():
+    return Detections(np.zeros((0, 4), np.float32), np.zeros(0, np.float32), None)
+
+
+def letterbox(frame, size):
+    """
+    Resize a frame to fit a size x size square, padding the rest, and return
+    it with the scale and (x, y) padding needed to map boxes back.
+    """
+    h, w = frame.shape[:2]
+    scale = min(size / h, size / w)
+    new_w, new_h = round(w * scale), round(h * scale)
+    pad_x, pad_y = (size - new_w) // 2, (size - new_h) // 2
+    canvas = np.full((size, size, 3), PAD_VALUE, dtype=np.uint8)
+    canvas[pad_y:pad_y + new_h, pad_x:pad_x + new_w] = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    return canvas, scale, (pad_x, pad_y)
+
+
+def decode_yolo(output, confidence, scale, pad, nms_iou=NMS_IOU):
+    """
+    Decode one image's raw output of an exported YOLOv8 face model, shaped
+    (4 + 1 [+ 15], anchors): centre-size boxes, the face score and
+    optionally 5 (x, y, visibility) keypoints, all in letterboxed pixels.
+    """
+    output = np.asarray(output, dtype=np.float32)
+    if output.shape[0] > output.shape[1]:
+        output = output.T  # Some exports put the anchors first
+    scores = output[4]
+    keep = scores >= confidence
+    if not keep.any():
+        return empty_detections()
+
+    rows = output[:, keep]
+    scores = rows[4]
+    centres, sizes = rows[0:2].T, rows[2:4].T
+    boxes = np.hstack([centres - sizes / 2, centres + sizes / 2])
+
+    indices = cv2.dnn.NMSBoxes(
+        np.hstack([boxes[:, :2], sizes]).tolist(), scores.tolist(), confidence, nms_iou
+    )
+    indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+    offset = np.array(pad * 2, dtype=np.float32)
+    boxes = (boxes[indices] - offset) / scale
+
+    landmarks = None
+    if rows.shape[0] >= 5 + NUM_LANDMARKS * 3:
+        points = rows[5:5 + NUM_LANDMARKS * 3].T[indices].reshape(-1, NUM_LANDMARKS, 3)[:, :, :2]
+        landmarks = ((points - np.array(pad, dtype=np.float32)) / scale).astype(np.float32)
+    return Detections(boxes.astype(np.float32), scores[indices].astype(np.float32), landmarks)
+
+
+class FaceDetector:
+    """
+    A face detection backend. detect() takes a list of BGR frames and
+    returns one Detections per frame; memory_bytes is the approximate size
+    of the loaded model.
+    """
+
+    name = None
+    memory_bytes = 0
+
+    def detect(self, frames, confidence):
+        raise NotImplementedError
+
+
+class UltralyticsDetector(FaceDetector):
+    """
+    The YOLO model through Ultralytics/torch, on GPU when there is one.
+    Boxes, scores and keypoints come out of each result tensor in one
+    transfer each.
+    """
+
+    name = 'ultralytics'
+
+    def __init__(self, weights, device):
+        from ultralytics import YOLO
+
+        self.model = YOLO(weights).to(device)
+        self.memory_bytes = sum(
+            tensor.numel() * tensor.element_size()
+            for tensor in list(self.model.model.parameters()) + list(self.model.model.buffers())
+        )
+
+    def detect(self, frames, confidence):
+        # Ultralytics takes numpy frames in BGR order
+        results = self.model(list(frames), conf=confidence, verbose=False)
+        return [self.parse(result) for result in results]
+
+    @staticmethod
+    def parse(result):
+        boxes = result.boxes.xyxy.cpu().numpy().astype(np.float32)
+        scores = result.boxes.conf.cpu().numpy().astype(np.float32)
+        landmarks = None
+        keypoints = getattr(result, 'keypoints', None)
+        if keypoints is not None and len(boxes):
+            points = keypoints.xy.cpu().numpy()
+            if points.shape[1:] == (NUM_LANDMARKS, 2):
+                landmarks = points.astype(np.float32)
+        return Detections(boxes, scores, landmarks)
+
+
+class OnnxDetector(FaceDetector):
+    """
+    An exported YOLO face model on ONNX Runtime's CPU provider. `threads`
+    bounds the intra-op thread pool (0 leaves it to the runtime) so several
+    workers can share a node. With int8, the model's weights are quantised
+    to 8 bits next to it on first use and that copy is loaded instead.
+    """
+
+    name = 'onnx'
+
+    def __init__(self, model_path, input_size=640, threads=0, int8=False):
+        import onnxruntime
+
+        if int8:
+            model_path = quantize_model(model_path)
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        self.input = self.session.get_inputs()[0]
+        self.input_size = input_size
+        # Models exported without a dynamic batch axis take one frame per run
+        self.batched = not isinstance(self.input.shape[0], int)
+        self.memory_bytes = os.path.getsize(model_path)
+
+    def detect(self, frames, confidence):
+        prepared = [letterbox(frame, self.input_size) for frame in frames]
+        blob = cv2.dnn.blobFromImages([image for image, _, _ in prepared], 1 / 255.0, swapRB=True)
+        if self.batched:
+            outputs = self.session.run(None, {self.input.name: blob})[0]
+        else:
+            outputs = np.concatenate([self.session.run(None, {self.input.name: blob[i:i + 1]})[0] for i in range(len(frames))])
+        return [
+            decode_yolo(output, confidence, scale, pad)
+            for output, (_, scale, pad) in zip(outputs, prepared)
+        ]
+
+
+class OpenCVDetector(FaceDetector):
+    """
+    The same exported ONNX model on OpenCV's DNN module, for nodes without
+    ONNX Runtime. Runs one frame at a time on the CPU.
+    """
+
+    name = 'opencv'
+
+    def __init__(self, model_path, input_size=640):
+        self.net = cv2.dnn.readNetFromONNX(model_path)
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        self.input_size = input_size
+        self.memory_bytes = os.path.getsize(model_path)
+
+    def detect(self, frames, confidence):
+        detections = []
+        for frame in frames:
+            image, scale, pad = letterbox(frame, self.input_size)
+            self.net.setInput(cv2.dnn.blobFromImage(image, 1 / 255.0, swapRB=True))
+            detections.append(decode_yolo(self.net.forward()[0], confidence, scale, pad))
+        return detections
+
+
+def quantize_model(model_path):
+    """
+    Return the path of an INT8 (dynamically quantised) copy of an ONNX
+    model, creating it next to the original if it does not exist yet.
+    """
+    root, ext = os.path.splitext(model_path)
+    int8_path = f"{root}.int8{ext}"
+    if not os.path.exists(int8_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        logger.info(f"Quantising {model_path} to {int8_path}")
+        quantize_dynamic(model_path, int8_path, weight_type=QuantType.QUInt8)
+    return int8_path
+
+
+DETECTORS = {
+    'ultralytics': UltralyticsDetector,
+    'onnx': OnnxDetector,
+    'opencv': OpenCVDetector,
+}
+
+
+def create_detector(backend, weights=None, onnx_path=None, device='cpu', input_size=640, threads=0, int8=False):
+    if backend == 'ultralytics':
+        return UltralyticsDetector(weights, device)
+    if backend == 'onnx':
+        return OnnxDetector(onnx_path, input_size=input_size, threads=threads, int8=int8)
+    if backend == 'opencv':
+        return OpenCVDetector(onnx_path, input_size=input_size)
+    raise ValueError(f"Unknown face detector backend: {backend}")
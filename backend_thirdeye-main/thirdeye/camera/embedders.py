@@ -0,0 +1,167 @@
+# camera/embedders.py
+import os
+import logging
+from collections import namedtuple
+import cv2
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# What a stored embedding was produced by: rows are only compared with
+# embeddings of the same model_id, at that model's distance threshold.
+EmbedderSpec = namedtuple('EmbedderSpec', ['model_id', 'dim', 'threshold'])
+
+# Where the five detector keypoints (eyes, nose, mouth corners) sit in the
+# 112x112 aligned crops ArcFace-style recognition networks are trained on
+ALIGNED_SIZE = 112
+ALIGNED_LANDMARKS = np.array([
+    [38.2946, 51.6963],
+    [73.5318, 51.5014],
+    [56.0252, 71.7366],
+    [41.5493, 92.3655],
+    [70.7299, 92.2041],
+], dtype=np.float32)
+
+
+class FaceEmbedder:
+    """
+    A face embedding backend. embed_batch() takes (BGR frame, boxes,
+    landmarks) items, the boxes in (x1, y1, x2, y2) frame pixels and the
+    landmarks an (N, 5, 2) array or None, and returns for each item one
+    float32 vector (or None) per box. `spec` says which model made them,
+    their dimension and the Euclidean distance under which two faces are
+    the same person.
+    """
+
+    spec = None
+    memory_bytes = 0
+
+    def embed_batch(self, items):
+        raise NotImplementedError
+
+
+class DlibEmbedder(FaceEmbedder):
+    """
+    dlib's ResNet through face_recognition: 128-d, compared at 0.6. The
+    boxes are passed as known face locations, so dlib only aligns and
+    encodes them; it takes one image per call.
+    """
+
+    spec = EmbedderSpec('dlib', 128, 0.6)
+
+    def __init__(self, face_encodings):
+        self.face_encodings = face_encodings
+
+    def embed_batch(self, items):
+        results = []
+        for frame, boxes, _ in items:
+            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            locations = [face_location(box, frame.shape) for box in boxes]
+            results.append(list(self.face_encodings(rgb, known_face_locations=locations)))
+        return results
+
+
+class OnnxEmbedder(FaceEmbedder):
+    """
+    An ArcFace-style recognition network exported to ONNX (112x112 RGB
+    input, one L2-normalised embedding per face) on ONNX Runtime's CPU
+    provider. Faces are aligned to the network's template by their five
+    keypoints when the detector gives them, else cropped square around
+    their box; every face of every frame in a batch then goes through a
+    single inference.
+    """
+
+    def __init__(self, model_path, dim, threshold, threads=0):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        self.input = self.session.get_inputs()[0]
+        # Models exported without a dynamic batch axis take one face per run
+        self.batched = not isinstance(self.input.shape[0], int)
+
+        output_dim = self.session.get_outputs()[0].shape[-1]
+        if isinstance(output_dim, int) and output_dim != dim:
+            raise ValueError(f"{model_path} produces {output_dim}-d embeddings, FACE_EMBEDDER_DIM is {dim}")
+        self.spec = onnx_spec(model_path, dim, threshold)
+        self.memory_bytes = os.path.getsize(model_path)
+
+    def embed_batch(self, items):
+        crops, owners = [], []
+        for item_index, (frame, boxes, landmarks) in enumerate(items):
+            for i, box in enumerate(boxes):
+                crops.append(align_face(frame, box, None if landmarks is None else landmarks[i]))
+                owners.append(item_index)
+
+        results = [[] for _ in items]
+        if not crops:
+            return results
+
+        blob = cv2.dnn.blobFromImages(crops, 1 / 127.5, (ALIGNED_SIZE, ALIGNED_SIZE), (127.5, 127.5, 127.5), swapRB=True)
+        if self.batched:
+            vectors = self.session.run(None, {self.input.name: blob})[0]
+        else:
+            vectors = np.concatenate([self.session.run(None, {self.input.name: blob[i:i + 1]})[0] for i in range(len(crops))])
+        vectors = vectors.reshape(len(crops), -1).astype(np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+        for owner, vector in zip(owners, vectors):
+            results[owner].append(vector)
+        return results
+
+
+def face_location(box, shape):
+    """
+    Convert an (x1, y1, x2, y2) box into the (top, right, bottom, left)
+    location face_recognition expects, clipped to an image of `shape`.
+    """
+    h, w = shape[:2]
+    x1, y1, x2, y2 = box
+    return (max(0, int(y1)), min(w, int(x2)), min(h, int(y2)), max(0, int(x1)))
+
+
+def align_face(frame, box, landmarks=None):
+    """
+    A 112x112 BGR crop of a face: warped onto the ArcFace keypoint template
+    when landmarks are given, else the square around its box.
+    """
+    if landmarks is not None:
+        matrix, _ = cv2.estimateAffinePartial2D(np.asarray(landmarks, dtype=np.float32), ALIGNED_LANDMARKS)
+        if matrix is not None:
+            return cv2.warpAffine(frame, matrix, (ALIGNED_SIZE, ALIGNED_SIZE), borderMode=cv2.BORDER_REPLICATE)
+
+    x1, y1, x2, y2 = box
+    side = max(x2 - x1, y2 - y1)
+    cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+    scale = ALIGNED_SIZE / max(side, 1.0)
+    matrix = np.float32([[scale, 0, ALIGNED_SIZE / 2 - scale * cx], [0, scale, ALIGNED_SIZE / 2 - scale * cy]])
+    return cv2.warpAffine(frame, matrix, (ALIGNED_SIZE, ALIGNED_SIZE), borderMode=cv2.BORDER_REPLICATE)
+
+
+def onnx_spec(model_path, dim, threshold):
+    return EmbedderSpec(f"onnx:{os.path.splitext(os.path.basename(model_path))[0]}", dim, threshold)
+
+
+def embedder_spec(backend=None):
+    """
+    The spec of the configured embedder (or of `backend`), known from the
+    settings alone so galleries can be built without loading the model.
+    """
+    backend = backend or settings.FACE_EMBEDDER_BACKEND
+    if backend == 'dlib':
+        return DlibEmbedder.spec
+    if backend == 'onnx':
+        return onnx_spec(settings.FACE_EMBEDDER_ONNX, settings.FACE_EMBEDDER_DIM, settings.FACE_EMBEDDER_THRESHOLD)
+    raise ValueError(f"Unknown face embedder backend: {backend}")
+
+
+def create_embedder(backend, face_encodings=None, onnx_path=None, dim=None, threshold=None, threads=0):
+    if backend == 'dlib':
+        return DlibEmbedder(face_encodings)
+    if backend == 'onnx':
+        return OnnxEmbedder(onnx_path, dim, threshold, threads=threads)
+    raise ValueError(f"Unknown face embedder backend: {backend}")
@@ -0,0 +1,89 @@
+# camera/embeddings.py
+import json
+import struct
+import numpy as np
+
+# Packed layout: 4-byte header (magic, dtype code, uint16 dimension), an
+# optional float32 scale for int8, then the little-endian vector itself.
+MAGIC = 0x45
+HEADER = struct.Struct('<BBH')
+SCALE = struct.Struct('<f')
+
+STORAGE_DTYPES = {
+    'float32': (1, np.dtype('<f4')),
+    'float16': (2, np.dtype('<f2')),
+    'int8': (3, np.dtype('i1')),
+}
+_DTYPES_BY_CODE = {code: (name, dtype) for name, (code, dtype) in STORAGE_DTYPES.items()}
+
+
+def pack_embedding(vector, storage='float32'):
+    """
+    Pack an embedding into compact bytes. float16 halves the size and int8
+    quarters it (symmetric per-vector scale) at a small precision cost.
+    """
+    try:
+        code, dtype = STORAGE_DTYPES[storage]
+    except KeyError:
+        raise ValueError(f"Unknown embedding storage type: {storage}")
+
+    vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+    header = HEADER.pack(MAGIC, code, vector.shape[0])
+    if storage == 'int8':
+        scale = float(np.abs(vector).max()) / 127.0 or 1.0
+        quantised = np.clip(np.round(vector / scale), -127, 127).astype(dtype)
+        return header + SCALE.pack(scale) + quantised.tobytes()
+    return header + vector.astype(dtype).tobytes()
+
+
+def is_packed(data):
+    return isinstance(data, (bytes, bytearray, memoryview)) and len(data) >= HEADER.size and data[0] == MAGIC
+
+
+def unpack_embedding(data):
+    """
+    Return a float32 vector from packed bytes. float32 payloads are returned
+    as a read-only zero-copy view over the buffer. Legacy JSON lists (either
+    already decoded or as raw text) are accepted too. Returns None for None.
+    """
+    if data is None:
+        return None
+    if isinstance(data, np.ndarray):
+        return data.astype(np.float32, copy=False).reshape(-1)
+    if isinstance(data, (list, tuple)):
+        return np.asarray(data, dtype=np.float32)
+    if isinstance(data, str):
+        return np.asarray(json.loads(data), dtype=np.float32)
+    if not is_packed(data):
+        # Rows written before embeddings were packed hold JSON text
+        return np.asarray(json.loads(bytes(data)), dtype=np.float32)
+
+    _, code, dim = HEADER.unpack_from(data)
+    name, dtype = _DTYPES_BY_CODE[code]
+    if name == 'int8':
+        (scale,) = SCALE.unpack_from(data, HEADER.size)
+        quantised = np.frombuffer(data, dtype=dtype, count=dim, offset=HEADER.size + SCALE.size)
+        return quantised.astype(np.float32) * np.float32(scale)
+
+    vector = np.frombuffer(data, dtype=dtype, count=dim, offset=HEADER.size)
+    if name == 'float32':
+        return vector
+    return vector.astype(np.float32)
+
+
+def unpack_embeddings(rows, dim):
+    """
+    Decode many packed embeddings into one (N x dim) float32 matrix. When
+    every row is a float32 payload the buffers are joined and decoded with
+    a single np.frombuffer call.
+    """
+    rows = [row for row in rows if row is not None]
+    if not rows:
+        return np.empty((0, dim), dtype=np.float32)
+
+    float32_size = HEADER.size + dim * 4
+    float32_header = HEADER.pack(MAGIC, STORAGE_DTYPES['float32'][0], dim)
+    if all(len(row) == float32_size and bytes(row[:HEADER.size]) == float32_header for row in rows):
+        matrix = np.frombuffer(b''.join(rows), dtype='<f4').reshape(len(rows), -1)
+        return matrix[:, HEADER.size // 4:]
+    return np.stack([unpack_embedding(row) for row in rows])
@@ -0,0 +1,251 @@
+# camera/face_index.py
+import os
+import time
+import logging
+import threading
+from collections import namedtuple
+from django.conf import settings
+from .models import SelectedFace
+from .ann_index import IVFIndex, create_index, index_path
+from .embeddings import unpack_embedding, unpack_embeddings
+from .embedders import embedder_spec
+
+logger = logging.getLogger(__name__)
+
+FaceMatch = namedtuple('FaceMatch', ['face_id', 'distance'])
+
+
+class FaceGallery:
+    """
+    In-memory copy of one user's SelectedFace embeddings, searched through a
+    pluggable vector index (exact scan or IVF, see camera.ann_index).
+
+    Rows are keyed by (face_id, date_seen), the same key SelectedFace is
+    unique on, so create/update/rename can be mirrored without primary keys.
+
+    An IVF index that needs (re)training has its centroids fitted on a
+    background thread from a snapshot of the vectors, then swapped in under
+    the lock; until then searches keep using the previous partitions.
+    `on_trained(gallery)` is called after each retrain.
+    """
+
+    def __init__(self, user_id, index, on_trained=None):
+        self.user_id = user_id
+        self.index = index
+        self.dim = index.dim
+        self.on_trained = on_trained
+        self.loaded_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._ids = {}
+        self._keys = {}
+        self._next_id = 0
+        self._training = None
+
+    def __len__(self):
+        return len(self._ids)
+
+    def upsert(self, face_id, date_seen, embedding):
+        vector = unpack_embedding(embedding)
+        if vector is None:
+            return
+        if vector.shape[0] != self.dim:
+            logger.warning(f"Ignoring {vector.shape[0]}-d embedding for {face_id}, gallery expects {self.dim}-d")
+            return
+
+        key = (face_id, date_seen)
+        with self._lock:
+            vector_id = self._ids.get(key)
+            if vector_id is None:
+                vector_id = self._next_id
+                self._next_id += 1
+                self._ids[key] = vector_id
+                self._keys[vector_id] = key
+            self.index.add(vector_id, vector)
+            self._start_training()
+
+    def add_many(self, keys, vectors):
+        """
+        Add (face_id, date_seen) keys and their (N, dim) float32 vectors in
+        one batch, e.g. a whole gallery decoded by unpack_embeddings.
+        """
+        # Later rows win, like consecutive upserts would
+        rows = {key: row for row, key in enumerate(keys)}
+        with self._lock:
+            ids = []
+            for key in rows:
+                vector_id = self._ids.get(key)
+                if vector_id is None:
+                    vector_id = self._next_id
+                    self._next_id += 1
+                    self._ids[key] = vector_id
+                    self._keys[vector_id] = key
+                ids.append(vector_id)
+            self.index.add_batch(ids, vectors[list(rows.values())])
+            self._start_training()
+
+    def _start_training(self):
+        # Called with the lock held
+        if getattr(self.index, 'needs_training', False) and self._training is None:
+            self._training = threading.Thread(target=self._train, name=f'face-index-{self.user_id}', daemon=True)
+            self._training.start()
+
+    def _train(self):
+        try:
+            with self._lock:
+                _, vectors = self.index.vectors()
+            centroids = self.index.fit(vectors)
+            with self._lock:
+                self.index.train(centroids, trained_size=len(vectors))
+            if self.on_trained is not None:
+                self.on_trained(self)
+        except Exception as e:
+            logger.error(f"Error training the face index of user {self.user_id}: {str(e)}", exc_info=True)
+        finally:
+            self._training = None
+
+    def remove(self, face_id, date_seen):
+        with self._lock:
+            vector_id = self._ids.pop((face_id, date_seen), None)
+            if vector_id is not None:
+                del self._keys[vector_id]
+                self.index.remove(vector_id)
+
+    def rename(self, old_face_id, new_face_id):
+        """
+        Re-key an identity's rows. A row the new identity already had for
+        the same day is replaced by the renamed one.
+        """
+        with self._lock:
+            for face_id, date_seen in [key for key in self._ids if key[0] == old_face_id]:
+                vector_id = self._ids.pop((face_id, date_seen))
+                replaced_id = self._ids.get((new_face_id, date_seen))
+                if replaced_id is not None:
+                    del self._keys[replaced_id]
+                    self.index.remove(replaced_id)
+                self._ids[(new_face_id, date_seen)] = vector_id
+                self._keys[vector_id] = (new_face_id, date_seen)
+
+    def match(self, embedding):
+        """
+        Return the FaceMatch of the nearest stored face (Euclidean distance),
+        or None when the gallery is empty.
+        """
+        with self._lock:
+            ids, distances = self.index.search(embedding, k=1)
+            if len(ids) == 0:
+                return None
+            face_id = self._keys[int(ids[0])][0]
+        return FaceMatch(face_id, float(distances[0]))
+
+
+class FaceGalleryRegistry:
+    """
+    Per-worker cache of FaceGallery objects, loaded from the database on
+    first use and reloaded after FACE_GALLERY_TTL seconds so changes made
+    by other workers are eventually picked up. The index backend is chosen
+    by FACE_INDEX_BACKEND; an IVF quantizer's centroids are persisted under
+    FACE_INDEX_DIR after every retrain. Galleries only hold embeddings of
+    the configured embedder (see camera.embedders).
+    """
+
+    def __init__(self, ttl, backend):
+        self.ttl = ttl
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._galleries = {}
+
+    def get(self, user_id):
+        gallery = self._galleries.get(user_id)
+        if gallery is not None and time.monotonic() - gallery.loaded_at < self.ttl:
+            return gallery
+
+        gallery = self.load(user_id)
+        with self._lock:
+            self._galleries[user_id] = gallery
+        return gallery
+
+    def create_index(self, user_id):
+        options = {}
+        if self.backend == IVFIndex.name:
+            # The gallery retrains it off the caller's thread (see FaceGallery)
+            options['nprobe'] = settings.FACE_INDEX_NPROBE
+            options['auto_train'] = False
+            path = self.index_path(user_id)
+            # Reuse the persisted coarse quantizer so restarts skip k-means
+            if path and os.path.exists(path):
+                try:
+                    centroids, trained_size = IVFIndex.read_quantizer(path)
+                    if centroids is None or centroids.shape[1] == embedder_spec().dim:
+                        options['centroids'], options['trained_size'] = centroids, trained_size
+                    else:
+                        logger.warning(f"Ignoring face index {path} built for {centroids.shape[1]}-d embeddings")
+                except Exception as e:
+                    logger.warning(f"Ignoring unreadable face index {path}: {str(e)}")
+        return create_index(self.backend, embedder_spec().dim, **options)
+
+    def index_path(self, user_id):
+        if not settings.FACE_INDEX_DIR:
+            return None
+        return index_path(settings.FACE_INDEX_DIR, user_id)
+
+    def save(self, gallery):
+        path = self.index_path(gallery.user_id)
+        if path is None or not getattr(gallery.index, 'is_trained', False):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with gallery._lock:
+            gallery.index.save_quantizer(path)
+
+    def load(self, user_id):
+        start = time.perf_counter()
+        gallery = FaceGallery(user_id, self.create_index(user_id), on_trained=self.save)
+        rows = SelectedFace.objects.filter(
+            user_id=user_id, embedding__isnull=False, embedding_model=embedder_spec().model_id
+        ).values_list(
+            'face_id', 'date_seen', 'embedding'
+        )
+        keys, embeddings = [], []
+        for face_id, date_seen, embedding in rows.iterator():
+            keys.append((face_id, date_seen))
+            embeddings.append(embedding)
+
+        # One column scan: packed float32 rows are joined and decoded with a
+        # single np.frombuffer call, then added to the index in one batch
+        try:
+            vectors = unpack_embeddings(embeddings, gallery.dim)
+        except ValueError:
+            vectors = None
+        if vectors is not None and vectors.shape[1:] == (gallery.dim,):
+            gallery.add_many(keys, vectors)
+        else:
+            # Rows of another dimension: decode one at a time, skipping those
+            for (face_id, date_seen), embedding in zip(keys, embeddings):
+                gallery.upsert(face_id, date_seen, embedding)
+        logger.info(f"Loaded {gallery.index.name} face gallery for user {user_id}: {len(gallery)} faces in {time.perf_counter() - start:.3f}s")
+        return gallery
+
+    def loaded(self, user_id):
+        """
+        Return the cached gallery without loading it, or None.
+        """
+        return self._galleries.get(user_id)
+
+    def upsert(self, user_id, face_id, date_seen, embedding):
+        gallery = self.loaded(user_id)
+        if gallery is not None:
+            gallery.upsert(face_id, date_seen, embedding)
+
+    def rename(self, user_id, old_face_id, new_face_id):
+        gallery = self.loaded(user_id)
+        if gallery is not None:
+            gallery.rename(old_face_id, new_face_id)
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._galleries.clear()
+            else:
+                self._galleries.pop(user_id, None)
+
+
+face_galleries = FaceGalleryRegistry(ttl=settings.FACE_GALLERY_TTL, backend=settings.FACE_INDEX_BACKEND)
@@ -0,0 +1,169 @@
+# camera/face_quality.py
+import cv2
+import numpy as np
+from .model_registry import model_registry
+
+# Canonical landmark layout used throughout the pipeline, shape (N, 5, 2):
+# left eye, right eye, nose, left mouth corner, right mouth corner.
+# Missing points (e.g. mouth corners from the dlib 5-point model) are NaN.
+LEFT_EYE, RIGHT_EYE, NOSE, MOUTH_LEFT, MOUTH_RIGHT = range(5)
+
+# Geometry of a frontal face, used as the zero point of the pose estimate
+FRONTAL_NOSE_MOUTH_RATIO = 0.55  # nose height between the eye and mouth lines
+FRONTAL_NOSE_EYE_DROP = 0.85  # nose base drop below the eyes, in inter-ocular distances
+
+SHARPNESS_SIZE = 64
+
+
+def _laplacian_variance(stack):
+    # 4-neighbour Laplacian over a (N, H, W) stack in one shot
+    centre = stack[:, 1:-1, 1:-1]
+    laplacian = (
+        stack[:, :-2, 1:-1] + stack[:, 2:, 1:-1] + stack[:, 1:-1, :-2] + stack[:, 1:-1, 2:] - 4.0 * centre
+    )
+    return laplacian.reshape(len(stack), -1).var(axis=1)
+
+
+class FaceQualityEngine:
+    """
+    Scores face crops by sharpness, head pose and resolution.
+
+    Pose (yaw and pitch) is derived from five facial landmarks, taken from
+    the YOLO-face keypoints when the detector provides them or from dlib's
+    5-point shape predictor otherwise. Models come from the shared registry
+    and every score is computed for a whole batch of crops at once.
+    """
+
+    def __init__(self, target_size=112, sharpness_scale=150.0, weights=(0.4, 0.4, 0.2)):
+        self.target_size = target_size
+        self.sharpness_scale = sharpness_scale
+        self.sharpness_weight, self.pose_weight, self.resolution_weight = weights
+
+    def sharpness(self, crops):
+        """
+        Laplacian variance of each crop after resampling to a fixed size, so
+        scores are comparable between small and large faces.
+        """
+        stack = np.stack([
+            cv2.resize(cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY), (SHARPNESS_SIZE, SHARPNESS_SIZE), interpolation=cv2.INTER_AREA)
+            for crop in crops
+        ]).astype(np.float32)
+        return _laplacian_variance(stack)
+
+    def predict_landmarks(self, crop, box=None):
+        """
+        Run the dlib 5-point predictor on a crop and return its landmarks in
+        the canonical layout. `box` is the face (x1, y1, x2, y2) inside the
+        crop; the whole crop is used when it is not given.
+        """
+        import dlib
+
+        h, w = crop.shape[:2]
+        x1, y1, x2, y2 = box if box is not None else (0, 0, w, h)
+        rgb = cv2.cvtColor(crop, cv2.COLOR_BGR2RGB)
+        shape = model_registry.landmark_predictor(rgb, dlib.rectangle(int(x1), int(y1), int(x2), int(y2)))
+        points = np.array([(shape.part(i).x, shape.part(i).y) for i in range(5)], dtype=np.float32)
+
+        # dlib order: right eye corners (0, 1), left eye corners (2, 3), nose base (4)
+        landmarks = np.full((5, 2), np.nan, dtype=np.float32)
+        landmarks[LEFT_EYE] = points[2:4].mean(axis=0)
+        landmarks[RIGHT_EYE] = points[0:2].mean(axis=0)
+        landmarks[NOSE] = points[4]
+        return landmarks
+
+    def estimate_pose(self, landmarks):
+        """
+        Estimate yaw and pitch in degrees for (N, 5, 2) landmarks. Roll is
+        removed first by rotating every face so its eyes are level.
+        """
+        landmarks = np.asarray(landmarks, dtype=np.float32).reshape(-1, 5, 2)
+        left_eye, right_eye = landmarks[:, LEFT_EYE], landmarks[:, RIGHT_EYE]
+        eye_mid = (left_eye + right_eye) / 2
+        eye_vector = right_eye - left_eye
+        interocular = np.maximum(np.linalg.norm(eye_vector, axis=1), 1e-6)
+
+        # Express every point in an eye-aligned frame centred between the eyes
+        cos, sin = eye_vector[:, 0] / interocular, eye_vector[:, 1] / interocular
+        rotation = np.stack([np.stack([cos, sin], axis=1), np.stack([-sin, cos], axis=1)], axis=1)
+        aligned = np.einsum('nij,nkj->nki', rotation, landmarks - eye_mid[:, None, :])
+
+        nose = aligned[:, NOSE]
+        yaw = np.degrees(np.arcsin(np.clip(2.0 * nose[:, 0] / interocular, -1.0, 1.0)))
+
+        mouth_y = aligned[:, MOUTH_LEFT:MOUTH_RIGHT + 1, 1].mean(axis=1)
+        has_mouth = np.isfinite(mouth_y) & (np.nan_to_num(mouth_y) > 0)
+        # Pitch from where the nose sits between the eye and mouth lines, or
+        # from its drop below the eyes when only the 5-point dlib model ran
+        pitch = np.where(
+            has_mouth,
+            (nose[:, 1] / np.where(has_mouth, mouth_y, 1.0) - FRONTAL_NOSE_MOUTH_RATIO) / (1.0 - FRONTAL_NOSE_MOUTH_RATIO),
+            (nose[:, 1] / interocular - FRONTAL_NOSE_EYE_DROP) / FRONTAL_NOSE_EYE_DROP,
+        )
+        pitch = np.degrees(np.arcsin(np.clip(np.nan_to_num(pitch, nan=1.0), -1.0, 1.0)))
+        return yaw, pitch
+
+    def score_batch(self, crops, landmarks=None, boxes=None):
+        """
+        Score many BGR crops in one call. `landmarks` is an optional (N, 5, 2)
+        array in crop coordinates (rows of NaN are filled in with the dlib
+        predictor) and `boxes` the optional face boxes inside each crop.
+        Returns a dict of (N,) arrays.
+        """
+        count = len(crops)
+        if landmarks is None:
+            landmarks = np.full((count, 5, 2), np.nan, dtype=np.float32)
+        else:
+            landmarks = np.array(landmarks, dtype=np.float32).reshape(count, 5, 2)
+
+        for i in range(count):
+            if not np.isfinite(landmarks[i, [LEFT_EYE, RIGHT_EYE, NOSE]]).all():
+                landmarks[i] = self.predict_landmarks(crops[i], None if boxes is None else boxes[i])
+
+        blur = self.sharpness(crops)
+        yaw, pitch = self.estimate_pose(landmarks)
+        if boxes is not None:
+            boxes = np.asarray(boxes, dtype=np.float32).reshape(count, 4)
+            sizes = np.minimum(boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1])
+        else:
+            sizes = np.array([min(crop.shape[:2]) for crop in crops], dtype=np.float32)
+
+        sharpness_score = 1.0 - np.exp(-blur / self.sharpness_scale)
+        pose_score = np.clip(np.cos(np.radians(yaw)) * np.cos(np.radians(pitch)), 0.0, 1.0)
+        size_score = np.clip(sizes / self.target_size, 0.0, 1.0)
+        quality = (
+            self.sharpness_weight * sharpness_score
+            + self.pose_weight * pose_score
+            + self.resolution_weight * size_score
+        )
+        return {
+            'blur_score': blur,
+            'pose_score': pose_score,
+            'size_score': size_score,
+            'quality_score': quality,
+            'yaw': yaw,
+            'pitch': pitch,
+        }
+
+    def score(self, crop, landmarks=None, box=None):
+        scores = self.score_batch(
+            [crop],
+            None if landmarks is None else [landmarks],
+            None if box is None else [box],
+        )
+        return {name: float(values[0]) for name, values in scores.items()}
+
+
+face_quality_engine = FaceQualityEngine()
+
+
+def score_face_crops(images, landmarks, boxes):
+    """
+    Score a frame's in-memory BGR face crops at capture time in one batch.
+    `landmarks` holds each crop's (5, 2) landmarks or None and `boxes` its
+    face box. Returns, per crop, the blur, pose and size scores stored on
+    TempFace plus the combined quality score.
+    """
+    landmarks = [np.full((5, 2), np.nan, dtype=np.float32) if points is None else points for points in landmarks]
+    scores = face_quality_engine.score_batch(images, landmarks, boxes)
+    names = ('blur_score', 'pose_score', 'size_score', 'quality_score')
+    return [{name: float(scores[name][i]) for name in names} for i in range(len(images))]
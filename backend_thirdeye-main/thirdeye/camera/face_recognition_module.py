@@ -7,18 +7,25 @@ import numpy as np
 from deep_sort_realtime.deep_sort import nn_matching
 from deep_sort_realtime.deep_sort.detection import Detection
 from deep_sort_realtime.deep_sort.tracker import Tracker
-import os
 from datetime import date, timedelta,datetime
 import logging
 import asyncio
-import torch
-from ultralytics import YOLO
 from django.utils import timezone
 from django.conf import settings
 from asgiref.sync import sync_to_async
 from .models import TempFace, SelectedFace, NotificationLog,FaceVisit,FaceAnalytics
 from .serializers import FaceAnalyticsSerializer
-import face_recognition
+from .inference_scheduler import detection_scheduler, embedding_scheduler
+from .pipeline import pipeline_executor, encode_jpeg
+from .face_index import face_galleries
+from .embeddings import pack_embedding, unpack_embedding
+from .face_quality import score_face_crops
+from .appearance import compact_descriptor
+from .embedders import embedder_spec
+from .trackers import ByteTracker
+from .track_buffer import TrackBuffer, FaceCandidate, next_candidate_id
+from .consolidation import consolidation_service
+from .persistence import write_behind
 from django.db.models import Count, Q
 from channels.layers import get_channel_layer
 import pytz 
@@ -31,30 +38,43 @@ IST = pytz.timezone('Asia/Kolkata')  # Define Indian Standard Time
 # Configuration parameters
 MAX_FACES_PER_ID = 15
 FACE_SAVE_INTERVAL = 7
-PROCESSING_INTERVAL = 1
 MAX_COSINE_DISTANCE = 0.3
-NN_BUDGET = 300
+NN_BUDGET = 100
 TRACKER_MAX_AGE = 100
-FACE_MATCH_THRESHOLD = 0.6
 
-class FaceRecognitionProcessor:
-    def __init__(self, user=None, camera_name=None):
-        self.user = user
-        self.camera_name = camera_name
-        self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        logger.info(f"Using device: {self.device}")
+# Optical flow used to move track boxes between keyframes
+FLOW_WIDTH = 640
+MAX_FLOW_POINTS = 20
+MIN_FLOW_POINTS = 4
 
-        # Load YOLO model for face detection
-        model_path = os.path.join(settings.BASE_DIR, 'yolov8m-face.pt')
-        self.facemodel = YOLO(model_path).to(self.device)
-        logger.info(f"YOLO model loaded on device: {self.device}")
+# How far (in face sizes) around its substream box a face is looked for
+# again in the main stream's frame
+RELOCATE_PADDING = 0.5
 
-        # Initialize DeepSORT tracker
-        metric = nn_matching.NearestNeighborDistanceMetric("cosine", MAX_COSINE_DISTANCE, NN_BUDGET)
-        self.tracker = Tracker(metric, max_age=TRACKER_MAX_AGE)
-        logger.info("DeepSORT tracker initialized")
 
-        self.face_match_threshold = FACE_MATCH_THRESHOLD
+class FaceRecognitionProcessor:
+    def __init__(self, user=None, camera_name=None, tracker_type='deepsort', crop_source=None):
+        self.user = user
+        self.camera_name = camera_name
+        # Coroutine function returning the camera's full-resolution frame (or
+        # None) when frames are detected on its low-resolution substream
+        self.crop_source = crop_source
+
+        # DeepSORT associates every detection by appearance; ByteTrack by
+        # IoU alone, using appearance only to recover lost tracks
+        if tracker_type == 'bytetrack':
+            self.tracker = ByteTracker(max_age=TRACKER_MAX_AGE, max_cosine_distance=MAX_COSINE_DISTANCE)
+        elif tracker_type == 'deepsort':
+            metric = nn_matching.NearestNeighborDistanceMetric("cosine", MAX_COSINE_DISTANCE, NN_BUDGET)
+            self.tracker = Tracker(metric, max_age=TRACKER_MAX_AGE)
+        else:
+            raise ValueError(f"Unknown tracker type: {tracker_type}")
+        self.tracker_type = tracker_type
+        logger.info(f"{tracker_type} tracker initialized")
+
+        # Embeddings are stored and matched as the configured embedder defines them
+        self.embedder = embedder_spec()
+        self.face_match_threshold = self.embedder.threshold
         self.current_date = date.today()
         self.face_id_counter = 1
         self.face_id_mapping = {}
@@ -62,16 +82,18 @@ class FaceRecognitionProcessor:
         self.available_face_ids = []
         self.frame_buffer = asyncio.Queue(maxsize=10)
         self.in_frame_tracker = {}  # Track if a face is currently in the frame
+        self.track_buffer = TrackBuffer(MAX_FACES_PER_ID, settings.FACE_TRACK_BUFFER_MAX_AGE)
+        self.pending_consolidations = set()
+
+        # Display boxes of confirmed tracks, moved between keyframes without
+        # touching the tracker (see advance_tracks)
+        self.shadow_tracks = {}
+        self.shadow_velocity = {}
+        self.flow_gray = None
+        self.frames_since_keyframe = 0
+        self.frames_per_keyframe = 1.0
         logger.info("FaceRecognitionProcessor initialized")
 
-        # Initialize face encoder
-        self.face_encoder = face_recognition.face_encodings
-        logger.info("Face encoder initialized")
-
-    async def start_periodic_task(self):
-        self.periodic_task = asyncio.create_task(self.periodic_processing())
-        logger.info("Periodic processing task started")
-
     async def process_frame(self, frame):
         logger.debug("Processing new frame")
         await self.frame_buffer.put(frame)
@@ -81,46 +103,37 @@ class FaceRecognitionProcessor:
       frame = await self.frame_buffer.get()
 
       # Step 1: Detect multiple faces in the frame
-      faces = self.detect_faces(frame)
+      faces, landmarks = await self.detect_faces(frame)
       logger.debug(f"Detected {len(faces)} faces in the frame")
 
-      # Step 2: Create detection objects for each detected face
-      detections = [Detection(face[:4], face[4], self.generate_feature(face, frame)) for face in faces]
-      logger.debug(f"Created {len(detections)} detections for the tracker")
+      # Step 2-3: Build detections and update the tracker off the event loop
+      active_tracks = await pipeline_executor.run('track', self.update_tracks, frame, faces, landmarks)
 
-      # Step 3: Use the tracker to update face positions
-      self.tracker.predict()
-      self.tracker.update(detections)
-      logger.debug(f"Tracker updated with {len(self.tracker.tracks)} tracks")
+      # Stage crops of these faces in the track buffer
+      candidates = await self.save_face_images(frame, active_tracks)
 
       detected_faces = []
-      for track in self.tracker.tracks:
-          if not track.is_confirmed() or track.time_since_update > 1:
-              continue
-
+      for track in active_tracks:
           bbox = track.to_tlbr()
           track_id = track.track_id
 
-          # Skip processing if the face is still in the frame and already processed
-          if track_id in self.in_frame_tracker:
-              logger.debug(f"Skipping already processed face with track_id: {track_id}")
+          candidate = candidates.get(track_id)
+          if candidate is None:
               continue
 
-          # Process and store this face as it's entering the frame
-          temp_face = await self.save_face_image(frame, track)
-          if temp_face is None:
+          # Announce the face only once, with the first crop staged as it enters the frame
+          if track_id in self.in_frame_tracker:
               continue
- 
           self.in_frame_tracker[track_id] = True  # Mark the face as processed
  
-          last_seen_ist = temp_face.last_seen.astimezone(IST)
+          last_seen_ist = candidate.last_seen.astimezone(IST)
           formatted_last_seen = last_seen_ist.strftime('%I:%M %p')
  
           detected_faces.append({
-              'id': temp_face.id,
-              'face_id': temp_face.face_id,
+              'id': candidate.id,
+              'face_id': candidate.face_id,
               'last_seen': formatted_last_seen,
-              'image_data': temp_face.image_data,
+              'image_data': candidate.image_data,
               'coordinates': {
                   'left': bbox[0],
                   'top': bbox[1],
@@ -128,97 +141,397 @@ class FaceRecognitionProcessor:
                   'bottom': bbox[3]
               }
           })
-          logger.debug(f"Stored new face: {temp_face.face_id}")
+          logger.debug(f"Staged new face: {candidate.face_id}")
 
-      # Remove faces that have left the frame
+      # Remove faces that have left the frame and flush their staged crops
       self.cleanup_exited_faces()
  
       return frame, detected_faces
 
 
+    def update_tracks(self, frame, faces, landmarks=None):
+        """
+        Feed one frame's detections to the tracker and return the confirmed
+        tracks that were matched in this frame. Runs on the pipeline executor.
+        Facial keypoints ride along on each track for pose scoring.
+        """
+        # Create detection objects for each detected face
+        detections = [
+            Detection(face[:4], face[4], self.generate_feature(face, frame), others=None if landmarks is None else landmarks[i])
+            for i, face in enumerate(faces)
+        ]
+        logger.debug(f"Created {len(detections)} detections for the tracker")
+
+        # Use the tracker to update face positions
+        self.tracker.predict()
+        self.tracker.update(detections)
+        logger.debug(f"Tracker updated with {len(self.tracker.tracks)} tracks")
+
+        active_tracks = [
+            track for track in self.tracker.tracks
+            if track.is_confirmed() and track.time_since_update <= 1
+        ]
+        self.reset_shadow_tracks(frame, active_tracks)
+        return active_tracks
+
+    def flow_image(self, frame):
+        scale = min(1.0, FLOW_WIDTH / frame.shape[1])
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if scale < 1.0:
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        return gray, scale
+
+    def reset_shadow_tracks(self, frame, tracks):
+        """
+        Start the display boxes afresh from the tracker on a keyframe.
+        """
+        self.frames_per_keyframe += 0.3 * (self.frames_since_keyframe + 1 - self.frames_per_keyframe)
+        self.frames_since_keyframe = 0
+        self.shadow_tracks = {track.track_id: track.to_tlbr().astype(np.float32) for track in tracks}
+        # Kalman velocity of the box centre, in pixels per tracker update
+        self.shadow_velocity = {track.track_id: np.asarray(track.mean[4:6], dtype=np.float32) for track in tracks}
+        self.flow_gray = self.flow_image(frame)[0] if tracks else None
+
+    def advance_tracks(self, frame):
+        """
+        Move the display boxes of tracks in view onto a frame that skipped
+        detection. Each box follows the median Lucas-Kanade flow of corner
+        points inside it, or its Kalman velocity when too few points could
+        be followed. The tracker itself is left untouched, so its ages and
+        miss counters only move on keyframes. Runs on the pipeline executor.
+        """
+        self.frames_since_keyframe += 1
+        if not self.shadow_tracks:
+            return self.visible_tracks()
+
+        gray, scale = self.flow_image(frame)
+        track_ids = list(self.shadow_tracks)
+        shifts = {}
+        if self.flow_gray is not None and self.flow_gray.shape == gray.shape:
+            points, owners = [], []
+            for i, track_id in enumerate(track_ids):
+                x1, y1, x2, y2 = np.clip(self.shadow_tracks[track_id] * scale, 0, None).astype(int)
+                corners = cv2.goodFeaturesToTrack(self.flow_gray[y1:y2, x1:x2], MAX_FLOW_POINTS, 0.01, 3) if x2 > x1 and y2 > y1 else None
+                if corners is not None:
+                    points.append(corners.reshape(-1, 2) + (x1, y1))
+                    owners.append(np.full(len(corners), i))
+
+            if points:
+                start_points = np.concatenate(points).astype(np.float32)
+                end_points, status, _ = cv2.calcOpticalFlowPyrLK(
+                    self.flow_gray, gray, start_points.reshape(-1, 1, 2), None, winSize=(15, 15), maxLevel=2
+                )
+                found = status.reshape(-1) == 1
+                flow = (end_points.reshape(-1, 2) - start_points) / scale
+                owners = np.concatenate(owners)
+                for i in np.unique(owners[found]):
+                    selected = found & (owners == i)
+                    if selected.sum() >= MIN_FLOW_POINTS:
+                        shifts[track_ids[i]] = np.median(flow[selected], axis=0)
+
+        # Spread the per-update Kalman velocity over the frames between keyframes
+        step = 1.0 / max(self.frames_per_keyframe, 1.0)
+        for track_id, box in self.shadow_tracks.items():
+            shift = shifts.get(track_id)
+            if shift is None:
+                shift = self.shadow_velocity[track_id] * step
+            box[[0, 2]] += shift[0]
+            box[[1, 3]] += shift[1]
+
+        self.flow_gray = gray
+        return self.visible_tracks()
+
+    async def track_frame(self, frame):
+        """
+        Process a frame between keyframes: no detection, only the display
+        boxes of the tracks in view are moved. Returns visible_tracks().
+        """
+        return await pipeline_executor.run('track', self.advance_tracks, frame)
+
+    def visible_tracks(self):
+        return [
+            {
+                'track_id': track_id,
+                'face_id': self.face_id_mapping.get(track_id),
+                'coordinates': {
+                    'left': float(box[0]),
+                    'top': float(box[1]),
+                    'right': float(box[2]),
+                    'bottom': float(box[3])
+                }
+            }
+            for track_id, box in self.shadow_tracks.items()
+        ]
+
+    def has_active_tracks(self):
+        """
+        Whether the tracker has faces in view (matched in the last frame or
+        awaiting confirmation) that the detector should keep refreshing.
+        """
+        return any(track.time_since_update <= 1 for track in self.tracker.tracks)
+
     def cleanup_exited_faces(self):
       # Remove tracks for faces that have left the frame
+      in_frame = set()
       for track in self.tracker.tracks:
-          if track.time_since_update > 1 and track.track_id in self.in_frame_tracker:
+          if track.time_since_update <= 1:
+              in_frame.add(track.track_id)
+          elif track.track_id in self.in_frame_tracker:
               logger.debug(f"Face {track.track_id} has exited the frame, removing from in_frame_tracker")
               del self.in_frame_tracker[track.track_id]
 
+      # Flush buffered tracks that left the frame or have been open too long
+      for track_id in set(self.track_buffer.track_ids()) - in_frame | set(self.track_buffer.expired()):
+          self.flush_track(track_id)
+
+      # Forget tracks the tracker has deleted
+      tracked = {track.track_id for track in self.tracker.tracks}
+      for track_id in [track_id for track_id in self.face_id_mapping if track_id not in tracked]:
+          del self.face_id_mapping[track_id]
+          self.frame_save_counter.pop(track_id, None)
+
+    def flush_track(self, track_id):
+        """
+        Take a track's staged crops out of the buffer and hand them to the
+        consolidation service, so the frame loop never waits on the database.
+        """
+        candidates = self.track_buffer.flush(track_id)
+        if not candidates:
+            return
+        logger.debug(f"Flushing track {track_id} with {len(candidates)} staged crops")
+        future = consolidation_service.submit(self, candidates)
+        self.pending_consolidations.add(future)
+        future.add_done_callback(self.pending_consolidations.discard)
+
+    async def flush(self):
+        """
+        Flush every buffered track and wait until they are consolidated and
+        written, e.g. when the stream closes.
+        """
+        for track_id in self.track_buffer.track_ids():
+            self.flush_track(track_id)
+        if self.pending_consolidations:
+            await asyncio.gather(*self.pending_consolidations, return_exceptions=True)
+        await write_behind.drain()
+
 
 
     def generate_feature(self, face, frame):
         """
         Generate a feature vector from the detected face region, used for tracking.
+        A compact 128-d float32 descriptor (see camera.appearance) keeps the
+        tracker's per-track samples and distance matrices small.
         """
         x, y, w, h, _ = face.astype(int)
-        face_roi = frame[y:y+h, x:x+w]
-        if face_roi.size == 0:
-            return np.zeros(128)
-
-        face_roi = cv2.resize(face_roi, (96, 96))  # Resize to fixed size
-        return face_roi.flatten() / 255.0  # Normalize the pixel values
+        face_roi = frame[max(y, 0):y+h, max(x, 0):x+w]
+        return compact_descriptor(face_roi)
 
     async def match_face(self, embedding):
         """
-        Match a face embedding against stored face embeddings.
+        Match a face embedding against the user's in-memory face gallery and
+        return the nearest FaceMatch if it is within the match threshold.
         """
-        selected_faces = await sync_to_async(list)(
-            SelectedFace.objects.filter(user=self.user)
-        )
-
-        for face in selected_faces:
-            if face.embedding:
-                distance = np.linalg.norm(np.array(embedding) - np.array(face.embedding))
-                if distance < self.face_match_threshold:
-                    return face  # Return the matched SelectedFace object
+        gallery = await sync_to_async(face_galleries.get)(self.user.id)
+        match = await pipeline_executor.run('gallery', gallery.match, embedding)
+        if match is not None and match.distance < self.face_match_threshold:
+            return match
         return None
 
-    async def save_face_image(self, frame, track):
-      track_id = int(track.track_id)
+    async def save_face_images(self, frame, tracks):
+      """
+      Stage crops of a frame's tracked faces in the track buffer. Returns a
+      {track_id: FaceCandidate} dict of the crops that were staged.
+      """
+      due = [track for track in tracks if self.crop_due(track)]
+      if not due:
+          return {}
+
+      crop_frame, scale = await self.crop_frame(frame)
+      if crop_frame is frame:
+          located = [(track, track.to_tlbr(), track.get_det_supplementary()) for track in due]
+      else:
+          located = await self.locate_faces(crop_frame, due, scale)
+      crops = [crop for crop in (self.cut_face_crop(crop_frame, *face) for face in located) if crop is not None]
+      selected = await self.select_face_crops(crops)
+      if not selected:
+          return {}
+
+      # One call embeds every selected face, located by its detector box
+      try:
+          async with pipeline_executor.stage('embed'):
+              embeddings = await embedding_scheduler.embed(crop_frame, [crop[1] for crop in selected], [crop[2] for crop in selected])
+      except Exception as e:
+          logger.error(f"Error embedding faces: {str(e)}", exc_info=True)
+          return {}
+
+      candidates = {}
+      for (track_id, _, _, face_img, scores), embedding in zip(selected, embeddings):
+          if embedding is None:
+              continue
+          candidate = await self.stage_face_crop(track_id, face_img, embedding, scores)
+          if candidate is not None:
+              candidates[track_id] = candidate
+      return candidates
 
-      # Only store face if it's not already in the frame
-      if track_id in self.in_frame_tracker:
-          return None  # Skip processing if the face is already in the frame
+    def crop_due(self, track):
+      """
+      Count a sighting of the track; a crop is due every FACE_SAVE_INTERVAL.
+      """
+      track_id = track.track_id
 
       if track_id not in self.face_id_mapping:
           self.face_id_mapping[track_id] = self.get_next_face_id()
           self.frame_save_counter[track_id] = 0
 
       self.frame_save_counter[track_id] += 1
+      return self.frame_save_counter[track_id] % FACE_SAVE_INTERVAL == 0
+
+    async def crop_frame(self, frame):
+      """
+      The frame to cut crops from, and the (x, y) scale from `frame`'s
+      coordinates to its: the main stream's frame when the processor has a
+      crop_source, else `frame` itself.
+      """
+      main_frame = None
+      if self.crop_source is not None:
+          try:
+              main_frame = await self.crop_source()
+          except Exception as e:
+              logger.error(f"Error reading the main stream of {self.camera_name}: {str(e)}")
+      if main_frame is None:
+          return frame, np.ones(2, dtype=np.float32)
+      return main_frame, np.array([main_frame.shape[1] / frame.shape[1], main_frame.shape[0] / frame.shape[0]], dtype=np.float32)
+
+    async def locate_faces(self, frame, tracks, scale):
+      """
+      Find tracks' faces again in the main stream's frame, which was read
+      after the substream frame they were detected on: the detector runs on
+      the region around each face's box mapped there by `scale`, and the
+      detection nearest its centre gives the face's box and keypoints.
+      Returns (track, box, keypoints) for the faces that were found.
+      """
+      h, w = frame.shape[:2]
+      regions = []
+      for track in tracks:
+          bbox = track.to_tlbr() * np.tile(scale, 2)
+          pad_w, pad_h = RELOCATE_PADDING * (bbox[2] - bbox[0]), RELOCATE_PADDING * (bbox[3] - bbox[1])
+          x1, y1 = max(0, int(bbox[0] - pad_w)), max(0, int(bbox[1] - pad_h))
+          x2, y2 = min(w, int(bbox[2] + pad_w)), min(h, int(bbox[3] + pad_h))
+          if x2 > x1 and y2 > y1:
+              regions.append((track, bbox, np.array([x1, y1], dtype=np.float32), frame[y1:y2, x1:x2]))
+      if not regions:
+          return []
+
+      try:
+          async with pipeline_executor.stage('detect'):
+              results = await asyncio.gather(*(detection_scheduler.detect(region) for *_, region in regions))
+      except Exception as e:
+          logger.error(f"Error locating faces in the main stream: {str(e)}", exc_info=True)
+          return []
 
-      if self.frame_save_counter[track_id] % FACE_SAVE_INTERVAL != 0:
+      located = []
+      for (track, bbox, offset, _), (faces, landmarks) in zip(regions, results):
+          if not len(faces):
+              logger.debug(f"Face of track {track.track_id} not found in the main stream")
+              continue
+          centres = faces[:, :2] + faces[:, 2:4] / 2 + offset
+          nearest = int(np.argmin(np.linalg.norm(centres - (bbox[:2] + bbox[2:]) / 2, axis=1)))
+          x, y, fw, fh = faces[nearest, :4]
+          box = np.array([x, y, x + fw, y + fh], dtype=np.float32) + np.tile(offset, 2)
+          keypoints = None if landmarks is None else landmarks[nearest] + offset
+          located.append((track, box, keypoints))
+      return located
+
+    def cut_face_crop(self, frame, track, bbox, keypoints):
+      """
+      Cut a track's face out of `frame` at `bbox`, with its detector
+      keypoints (or None). Returns (track_id, box, keypoints, crop,
+      landmarks, face_box), the last two in crop coordinates, or None if
+      the face is too small to embed.
+      """
+      if not embedding_scheduler.embeddable(bbox):
           return None
 
-      face_id = self.face_id_mapping[track_id]
-      bbox = track.to_tlbr()
       h, w = frame.shape[:2]
       pad_w, pad_h = 0.2 * (bbox[2] - bbox[0]), 0.2 * (bbox[3] - bbox[1])
       x1, y1 = max(0, int(bbox[0] - pad_w)), max(0, int(bbox[1] - pad_h))
       x2, y2 = min(w, int(bbox[2] + pad_w)), min(h, int(bbox[3] + pad_h))
 
       face_img = frame[y1:y2, x1:x2]
-      if face_img.size > 0:
-          embedding = self.generate_face_embedding(face_img)
-          if embedding is not None:
-              embedding = embedding.tolist()  # Convert numpy array to list for storage
-              try:
-                  # Encode the face image as a byte array
-                  face_img = cv2.imencode('.jpg', face_img)[1].tobytes()
-
-                  # Store face in TempFace model for later processing
-                  temp_face = await sync_to_async(TempFace.objects.create)(
-                      user=self.user,
-                      face_id=face_id,
-                      image_data=face_img,
-                      embedding=embedding,
-                      last_seen=timezone.now(),
-                      processed=False
-                  )
-                  logger.info(f"Temporary face {face_id} saved to TempFace model")
-                  return temp_face
-              except Exception as e:
-                  logger.error(f"Error saving TempFace {face_id}: {str(e)}", exc_info=True)
-                  return None
-      return None
+      if face_img.size == 0:
+          return None
+
+      landmarks = None
+      if keypoints is not None:
+          landmarks = keypoints - np.array([x1, y1], dtype=np.float32)
+      face_box = (bbox[0] - x1, bbox[1] - y1, bbox[2] - x1, bbox[3] - y1)
+      return track.track_id, bbox, keypoints, face_img, landmarks, face_box
+
+    async def select_face_crops(self, crops):
+      """
+      Score a frame's face crops in one batch while they are still decoded
+      in memory. Returns (track_id, box, keypoints, crop, scores) for the
+      crops that would make their track's top-K.
+      """
+      if not crops:
+          return []
+      try:
+          scores = await pipeline_executor.run(
+              'quality', score_face_crops,
+              [crop[3] for crop in crops], [crop[4] for crop in crops], [crop[5] for crop in crops],
+              stateless=True,
+          )
+      except Exception as e:
+          logger.error(f"Error scoring {len(crops)} face crops: {str(e)}", exc_info=True)
+          return []
+
+      # Crops that would not make the track's top-K are not worth embedding
+      return [
+          (track_id, bbox, keypoints, face_img, crop_scores)
+          for (track_id, bbox, keypoints, face_img, _, _), crop_scores in zip(crops, scores)
+          if self.track_buffer.accepts(track_id, crop_scores['quality_score'])
+      ]
+
+    async def stage_face_crop(self, track_id, face_img, embedding, scores):
+      """
+      Add an embedded face crop to its track's buffer and return the
+      staged FaceCandidate, or None.
+      """
+      face_id = self.face_id_mapping[track_id]
+      try:
+          embedding = pack_embedding(embedding, settings.FACE_EMBEDDING_STORAGE)  # Pack to compact bytes for storage
+
+          # Encode the face image as a byte array
+          face_img = await pipeline_executor.run('encode', encode_jpeg, face_img, stateless=True)
+          last_seen = timezone.now()
+
+          if settings.FACE_TRACK_BUFFER_DURABLE:
+              # Mirror the crop to TempFace so it can be recovered after a crash
+              temp_face = await sync_to_async(TempFace.objects.create)(
+                  user=self.user,
+                  camera_name=self.camera_name,
+                  face_id=face_id,
+                  image_data=face_img,
+                  embedding=embedding,
+                  embedding_model=self.embedder.model_id,
+                  last_seen=last_seen,
+                  processed=False,
+                  **scores
+              )
+              candidate_id = temp_face.id
+          else:
+              candidate_id = next_candidate_id()
+
+          candidate = FaceCandidate(candidate_id, face_id, face_img, embedding, last_seen, **scores)
+          evicted = self.track_buffer.add(track_id, candidate)
+          if evicted is not None and settings.FACE_TRACK_BUFFER_DURABLE:
+              await sync_to_async(TempFace.objects.filter(id=evicted.id).delete)()
+
+          logger.debug(f"Staged crop of face {face_id} (quality {candidate.quality_score:.2f})")
+          return candidate
+      except Exception as e:
+          logger.error(f"Error staging face {face_id}: {str(e)}", exc_info=True)
+          return None
 
 
     def get_next_face_id(self):
@@ -236,151 +549,94 @@ class FaceRecognitionProcessor:
         logger.info(f"Generated new face ID: {face_id}")
         return face_id
 
-    def generate_face_embedding(self, face_image):
-        # Convert to RGB as face_recognition works with RGB images
-        rgb_image = cv2.cvtColor(face_image, cv2.COLOR_BGR2RGB)
-        encodings = face_recognition.face_encodings(rgb_image)
-        if encodings:
-            return encodings[0]
-        return None
-
-    async def periodic_processing(self):
-        while True:
-            try:
-                logger.info("Starting periodic processing of temp faces...")
-                await self.process_temp_faces()
-                logger.info("Finished periodic processing of temp faces")
-            except Exception as e:
-                logger.error(f"Error in periodic processing: {str(e)}", exc_info=True)
-            finally:
-                await asyncio.sleep(PROCESSING_INTERVAL)  # Wait for the defined interval before running again
-
-    async def process_temp_faces(self):
+    async def process_temp_faces(self, stale_before=None):
+        """
+        Consolidate this user's and camera's faces staged in TempFace, i.e.
+        durable track buffer rows left behind by a crashed worker.
+        `stale_before` limits this to rows last seen before that time.
+        """
         logger.info("Retrieving unprocessed TempFaces")
-        unprocessed_faces = await sync_to_async(list)(
-            TempFace.objects.filter(processed=False).order_by('face_id', '-last_seen')
-        )
-        logger.info(f"Found {len(unprocessed_faces)} unprocessed TempFaces")
+        temp_faces = TempFace.objects.filter(user=self.user, camera_name=self.camera_name, processed=False)
+        if stale_before is not None:
+            temp_faces = temp_faces.filter(last_seen__lt=stale_before)
+        face_ids = await sync_to_async(list)(temp_faces.values_list('face_id', flat=True).distinct())
+        logger.info(f"Found {len(face_ids)} face IDs with unprocessed TempFaces")
 
-        current_face_id = None
-        face_group = []
+        for face_id in face_ids:
+            await self.process_face_group(face_id, stale_before)
 
-        for face in unprocessed_faces:
-            if current_face_id != face.face_id:
-                if face_group:
-                    await self.process_face_group(face_group)
-                current_face_id = face.face_id
-                face_group = []
-
-            face_group.append(face)
-
-            if len(face_group) == MAX_FACES_PER_ID:
-                await self.process_face_group(face_group)
-                face_group = []
-
-        if face_group:
-            await self.process_face_group(face_group)
-
-    async def process_face_group(self, face_group):
-      if not face_group:
-          return
-
-      face_id = face_group[0].face_id
+    async def process_face_group(self, face_id, stale_before=None):
       logger.info(f"Processing face group for face_id: {face_id}")
+      temp_faces = TempFace.objects.filter(user=self.user, camera_name=self.camera_name, face_id=face_id)
+      if stale_before is not None:
+          temp_faces = temp_faces.filter(last_seen__lt=stale_before)
 
-      best_image, best_quality_score, best_embedding = None, -float('inf'), None
-      last_seen = face_group[0].last_seen
-
-      # Find the best quality face in the group
-      for face in face_group:
-          image_data = await sync_to_async(lambda: face.image_data)()
-          embedding = await sync_to_async(lambda: face.embedding)()
-          if image_data and embedding:
-              image = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_COLOR)
-
-              if image is None:
-                  continue
-
-              # Compute the blur and angle scores
-              blur_score = self.detect_blur(image)
-              angle_score = self.calculate_face_angle(image)
-
-              # Calculate quality score
-              quality_score = blur_score - (angle_score / 10)
-
-              if quality_score > best_quality_score:
-                  best_quality_score = quality_score
-                  best_image = image_data
-                  best_embedding = embedding
-                  last_seen = face.last_seen
+      # Crops are scored when captured, so the best one is a single indexed lookup
+      best_face = await sync_to_async(
+          temp_faces.filter(processed=False, embedding__isnull=False, embedding_model=self.embedder.model_id)
+          .order_by('-quality_score', '-last_seen')
+          .first
+      )()
 
       # Once we have the best image and embedding, check if it matches an existing face
-      if best_image is not None and best_embedding is not None:
-          matched_face = await self.match_face(best_embedding)
-
-          if matched_face:
-              logger.info(f"Matched face_id: {matched_face.face_id}")
-
-              # Update the existing SelectedFace with the latest info
-              await self.create_update_selected_face(matched_face.face_id, best_image, best_embedding, best_quality_score,last_seen)
+      if best_face is not None and best_face.image_data:
+          await self.consolidate_face(
+              face_id, best_face.image_data, best_face.embedding, best_face.quality_score, best_face.last_seen
+          )
 
-              # Log the visit in FaceVisit model
-              await self.log_face_visit(matched_face, best_image, last_seen)
-
-          else:
-              # If no match is found, create a new SelectedFace entry
-              logger.info(f"No match found, creating new SelectedFace for face_id: {face_id}")
-              new_face = await self.create_update_selected_face(face_id,best_image, best_embedding, best_quality_score,last_seen)
-
-              # Log the first visit in FaceVisit model
-              await self.log_face_visit(new_face, best_image, last_seen)
-
-          # Store face details and image by date
-          #await self.store_face_by_date(face_id, best_image, last_seen)
-
-      # Delete all TempFace records after processing
-      await sync_to_async(TempFace.objects.filter(face_id=face_id).delete)()
-
-
-
-    def detect_blur(self, image):
-        # Convert image to grayscale
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        # Use Laplacian variance to measure blur
-        return cv2.Laplacian(gray, cv2.CV_64F).var()
-
-    def calculate_face_angle(self, image):
-        # Use Haar cascade to detect faces and calculate the face's angle
-        face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
-
-        if len(faces) > 0:
-            (x, y, w, h) = faces[0]
-            center_x = x + w // 2
-            center_y = y + h // 2
-            image_height, image_width, _ = image.shape
-            angle = np.arctan2(center_y - image_height // 2, center_x - image_width // 2) * 180 / np.pi
-            return abs(angle)
-        return 180  # If no face detected, return the worst possible angle
-
-    def detect_faces(self, frame):
-        # Convert BGR to RGB (YOLO works on RGB images)
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-
-        # Use YOLO model to detect faces
-        results = self.facemodel(frame_rgb, conf=0.3)  # Confidence threshold to detect faces
-
-        faces = []
-        for result in results:
-            boxes = result.boxes
-            for box in boxes:
-                x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                confidence = box.conf.item()
-                faces.append([x1, y1, x2 - x1, y2 - y1, confidence])  # Bounding box with confidence score
+      # Delete all TempFace records together with the consolidated face
+      temp_face_ids = await sync_to_async(list)(temp_faces.values_list('id', flat=True))
+      await write_behind.delete(TempFace, temp_face_ids)
 
+    async def consolidate_candidates(self, candidates):
+        """
+        Persist the best staged crop of a finished track and return its
+        SelectedFaceKey. In durable mode the TempFace copies are removed in
+        the same batched write, and kept if consolidation failed.
+        """
+        best = candidates[0]
+        try:
+            selected_face = await self.consolidate_face(best.face_id, best.image_data, best.embedding, best.quality_score, best.last_seen)
+        except Exception as e:
+            logger.error(f"Error consolidating face {best.face_id}: {str(e)}", exc_info=True)
+            return None
+
+        if selected_face is not None and settings.FACE_TRACK_BUFFER_DURABLE:
+            await write_behind.delete(TempFace, [candidate.id for candidate in candidates])
+        return selected_face
+
+    async def consolidate_face(self, face_id, best_image, best_embedding, best_quality_score, last_seen):
+      """
+      Match the best crop of a face against the user's gallery, update or
+      create its SelectedFace and log the visit.
+      """
+      matched_face = await self.match_face(unpack_embedding(best_embedding))
+
+      if matched_face:
+          logger.info(f"Matched face_id: {matched_face.face_id} (distance {matched_face.distance:.3f})")
+
+          # Update the existing SelectedFace with the latest info
+          selected_face = await self.create_update_selected_face(matched_face.face_id, best_image, best_embedding, best_quality_score,last_seen)
+
+      else:
+          # If no match is found, create a new SelectedFace entry
+          logger.info(f"No match found, creating new SelectedFace for face_id: {face_id}")
+          selected_face = await self.create_update_selected_face(face_id,best_image, best_embedding, best_quality_score,last_seen)
+
+      # Log the visit in FaceVisit model
+      if selected_face is not None:
+          await self.log_face_visit(selected_face, best_image, last_seen)
+
+      # Store face details and image by date
+      #await self.store_face_by_date(face_id, best_image, last_seen)
+      return selected_face
+
+    async def detect_faces(self, frame):
+        # Detection is batched with the frames of every other stream in this worker
+        async with pipeline_executor.stage('detect'):
+            faces, landmarks = await detection_scheduler.detect(frame)
         logger.info(f"Detected {len(faces)} faces")
-        return np.array(faces)
+        return faces, landmarks
 
     async def create_update_selected_face(self, face_id, image_data, embedding, quality_score, last_seen):
         try:
@@ -390,26 +646,19 @@ class FaceRecognitionProcessor:
             last_seen = last_seen.astimezone(IST)
             date_seen = last_seen.date()
 
-            # Fetch or create SelectedFace entry
-            selected_face, created = await sync_to_async(SelectedFace.objects.get_or_create)(
-                user=self.user,
-                face_id=face_id,
-                date_seen=date_seen,
-                defaults={
-                    'image_data': image_data,
-                    'embedding': embedding,
-                    'quality_score': quality_score,
-                    'last_seen': last_seen
-                }
+            # Create or update the SelectedFace entry in the next batched write;
+            # the returned key stands in for the row until then
+            selected_face = await write_behind.upsert_selected_face(
+                self.user.id, face_id, date_seen,
+                image_data=image_data,
+                embedding=embedding,
+                embedding_model=self.embedder.model_id,
+                quality_score=quality_score,
+                last_seen=last_seen,
             )
 
-            if not created:
-                # Update the existing face with the latest information
-                selected_face.image_data = image_data
-                selected_face.embedding = embedding
-                selected_face.last_seen = last_seen
-                selected_face.quality_score = quality_score
-                await sync_to_async(selected_face.save)()
+            # The gallery is keyed by (face_id, date_seen), so it can be updated right away
+            await pipeline_executor.run('gallery', face_galleries.upsert, self.user.id, face_id, date_seen, embedding)
 
             # Send notification for the face
             await self.send_notification(face_id, last_seen, image_data)
@@ -428,13 +677,8 @@ class FaceRecognitionProcessor:
             date_seen = detected_time.date()
 
             # Create a new FaceVisit entry for each detection
-            face_visit = await sync_to_async(FaceVisit.objects.create)(
-                selected_face=selected_face,
-                image_data=image_data,
-                detected_time=detected_time,
-                date_seen=date_seen
-            )
-            logger.info(f"Logged FaceVisit for face_id: {selected_face.face_id}, date_seen: {date_seen}")
+            await write_behind.create_visit(selected_face, image_data, detected_time)
+            logger.info(f"Queued FaceVisit for face_id: {selected_face.face_id}, date_seen: {date_seen}")
         except Exception as e:
             logger.error(f"Error logging FaceVisit for face_id {selected_face.face_id}: {str(e)}")
 
@@ -487,14 +731,14 @@ class FaceRecognitionProcessor:
             image_bytes = base64.b64decode(encoded_image_data)
 
             # Log notification in the database with binary image data
-            await sync_to_async(NotificationLog.objects.create)(
+            await write_behind.create(NotificationLog(
                 user=self.user,
                 face_id=face_id,
                 camera_name=self.camera_name,  # Replace with actual camera name
                 detected_time= last_seen_ist,
                 notification_sent=True,
                 image_data=image_bytes  # Store decoded binary image data
-            )
+            ))
 
             logger.info(f"Notification sent for face_id {face_id}")
         except Exception as e:
@@ -515,6 +759,7 @@ class FaceRecognitionProcessor:
                 face.is_known = True
                 await sync_to_async(face.save)()
 
+            await pipeline_executor.run('gallery', face_galleries.rename, self.user.id, old_face_id, new_face_id)
             self.available_face_ids.append(old_face_id)
 
             logger.info(f"Renamed face_id from {old_face_id} to {new_face_id} and marked as known")
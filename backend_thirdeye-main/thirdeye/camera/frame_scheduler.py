@@ -0,0 +1,108 @@
+# camera/frame_scheduler.py
+import time
+
+DETECT, TRACK, DISPLAY, SKIP = 'detect', 'track', 'display', 'skip'
+ACTIONS = (DETECT, TRACK, DISPLAY, SKIP)
+
+EWMA_ALPHA = 0.2
+BUSY_MOTION_AREA = 0.05  # Motion area at which keyframes are no longer stretched
+
+
+class FrameScheduler:
+    """
+    Decides for each captured frame of a stream whether to run the full
+    detection pipeline on it (a keyframe), only move the boxes of the
+    tracks in view, only display it, or skip it, so the stream keeps within
+    its end-to-end latency target whatever the camera frame rate or the
+    load on the machine.
+
+    Keyframes come every `keyframe_interval` frames, or adaptively when it
+    is 0: at most `detection_fps` times a second, stretched up to
+    `max_stretch` times when few tracks are in view on a calm scene. Either
+    way detection may occupy at most `detection_share` of the stream's wall
+    time, so an overloaded box lowers its detection rate instead of
+    building lag. Frames that could not be shown within `target_latency`
+    seconds of being captured are dropped.
+    """
+
+    def __init__(self, target_latency, detection_fps, detection_share=0.5, keyframe_interval=0, max_stretch=3.0):
+        self.target_latency = target_latency
+        self.detection_fps = detection_fps
+        self.detection_share = detection_share
+        self.keyframe_interval = keyframe_interval
+        self.max_stretch = max_stretch
+        self.cost = {DETECT: None, TRACK: None, DISPLAY: None}
+        self.counts = dict.fromkeys(ACTIONS, 0)
+        self.latency = None
+        self.interval = 0.0
+        self._next_detection = 0.0
+        self._frames_since_detection = 0
+
+    def detection_interval(self, tracks=0, motion=None):
+        """
+        Minimum time until the next keyframe. Fixed keyframe intervals are
+        paced by frame count instead, so only the cost bound applies.
+        """
+        interval = 0.0
+        if not self.keyframe_interval:
+            interval = 1.0 / self.detection_fps
+            if tracks:
+                # Few tracks on a calm scene can be followed by flow for longer
+                calm = (1.0 - min((motion or 0.0) / BUSY_MOTION_AREA, 1.0)) / tracks
+                interval *= 1.0 + (self.max_stretch - 1.0) * calm
+        if self.cost[DETECT] is not None:
+            interval = max(interval, self.cost[DETECT] / self.detection_share)
+        return interval
+
+    def decide(self, captured_at, now=None, tracks=0, motion=None):
+        """
+        Pick the action for a frame captured at `captured_at` (time.monotonic).
+        `tracks` is the number of tracks that can be moved without detection
+        and `motion` the latest motion area of the scene.
+        """
+        now = time.monotonic() if now is None else now
+        budget = self.target_latency - (now - captured_at)
+        display_cost = self.cost[DISPLAY] or 0.0
+
+        self._frames_since_detection += 1
+        due = now >= self._next_detection
+        if self.keyframe_interval:
+            due = due and self._frames_since_detection >= self.keyframe_interval
+
+        if due:
+            action = DETECT
+            self.interval = self.detection_interval(tracks, motion)
+            self._next_detection = now + self.interval
+            self._frames_since_detection = 0
+        elif tracks and (self.cost[TRACK] or 0.0) + display_cost <= budget:
+            action = TRACK
+        elif display_cost <= budget:
+            action = DISPLAY
+        else:
+            action = SKIP
+
+        self.counts[action] += 1
+        return action
+
+    def record(self, action, seconds):
+        """
+        Feed back how long an action took; DISPLAY is the encode-and-send
+        time every shown frame pays, DETECT and TRACK the work on top of it.
+        """
+        previous = self.cost[action]
+        self.cost[action] = seconds if previous is None else previous + EWMA_ALPHA * (seconds - previous)
+
+    def record_latency(self, captured_at, now=None):
+        now = time.monotonic() if now is None else now
+        latency = now - captured_at
+        self.latency = latency if self.latency is None else self.latency + EWMA_ALPHA * (latency - self.latency)
+
+    def stats(self):
+        return {
+            'counts': dict(self.counts),
+            'detect_ms': (self.cost[DETECT] or 0.0) * 1000,
+            'track_ms': (self.cost[TRACK] or 0.0) * 1000,
+            'display_ms': (self.cost[DISPLAY] or 0.0) * 1000,
+            'latency_ms': (self.latency or 0.0) * 1000,
+            'keyframe_interval_ms': self.interval * 1000,
+        }
@@ -0,0 +1,205 @@
+# camera/inference_scheduler.py
+import time
+import queue
+import asyncio
+import logging
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+from django.conf import settings
+from .model_registry import model_registry
+
+logger = logging.getLogger(__name__)
+
+DETECTION_CONFIDENCE = 0.3
+
+
+class BatchScheduler(ABC):
+    """
+    Collects frames submitted by every stream in the process and runs them
+    through a shared model as a single batch on a dedicated thread. A batch
+    is dispatched as soon as it holds max_batch_size frames or the oldest
+    frame has waited max_wait seconds, whichever comes first. Each caller
+    gets its own result back through a future, so results land in the
+    stream that submitted the frame. Subclasses run the model in
+    _run_batch().
+    """
+
+    name = 'batch'
+
+    def __init__(self, max_batch_size, max_wait):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.batches_run = 0
+        self.frames_run = 0
+        self.last_batch_seconds = 0.0
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=f'{self.name}-scheduler', daemon=True)
+                self._thread.start()
+                logger.info(f"{self.name.capitalize()} scheduler started (batch={self.max_batch_size}, wait={self.max_wait * 1000:.0f}ms)")
+
+    def submit(self, item):
+        """
+        Queue one item for the next batch and return a concurrent Future
+        that resolves to its result.
+        """
+        self.start()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        return {
+            'pending': self.pending(),
+            'batches_run': self.batches_run,
+            'frames_run': self.frames_run,
+            'average_batch_size': self.frames_run / self.batches_run if self.batches_run else 0.0,
+            'last_batch_seconds': self.last_batch_seconds,
+        }
+
+    def _collect_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            # Drop items whose caller has already given up on them
+            batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            try:
+                start = time.perf_counter()
+                results = self._run_batch([item for item, _ in batch])
+                self.last_batch_seconds = time.perf_counter() - start
+                self.batches_run += 1
+                self.frames_run += len(batch)
+                logger.debug(f"Ran {self.name} on a batch of {len(batch)} frames in {self.last_batch_seconds * 1000:.1f}ms")
+            except Exception as e:
+                logger.error(f"Error in batched {self.name}: {str(e)}", exc_info=True)
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    @abstractmethod
+    def _run_batch(self, items):
+        """
+        Run the model on a batch of submitted items and return one result
+        per item, in order. Called on the scheduler thread.
+        """
+
+
+class DetectionScheduler(BatchScheduler):
+    """
+    Batches face detection across streams. Each frame resolves to its
+    ([x, y, w, h, confidence] array, landmarks) pair.
+    """
+
+    name = 'detection'
+
+    def __init__(self, max_batch_size, max_wait, confidence=DETECTION_CONFIDENCE):
+        super().__init__(max_batch_size, max_wait)
+        self.confidence = confidence
+
+    async def detect(self, frame):
+        return await asyncio.wrap_future(self.submit(frame))
+
+    def _run_batch(self, frames):
+        results = model_registry.detector.detect(frames, self.confidence)
+        return [(detections.faces(), detections.landmarks) for detections in results]
+
+
+class EmbeddingScheduler(BatchScheduler):
+    """
+    Batches face embedding across streams through the configured embedder
+    (see camera.embedders). The detector's boxes, and keypoints when it has
+    them, locate the faces, so no face is detected twice. Boxes smaller
+    than min_size pixels on either side resolve to None without being
+    encoded.
+    """
+
+    name = 'embedding'
+
+    def __init__(self, max_batch_size, max_wait, min_size=0):
+        super().__init__(max_batch_size, max_wait)
+        self.min_size = min_size
+        self.faces_run = 0
+        self.faces_skipped = 0
+
+    def embeddable(self, box):
+        x1, y1, x2, y2 = box
+        return min(x2 - x1, y2 - y1) >= self.min_size
+
+    async def embed(self, frame, boxes, landmarks=None):
+        """
+        Embed the faces at `boxes` ((x1, y1, x2, y2) in frame pixels), with
+        their (5, 2) keypoints or None in `landmarks`, and return one
+        embedding, or None, per box.
+        """
+        if not len(boxes):
+            return []
+        return await asyncio.wrap_future(self.submit((frame, boxes, landmarks)))
+
+    def stats(self):
+        return {
+            **super().stats(),
+            'faces_run': self.faces_run,
+            'faces_skipped': self.faces_skipped,
+        }
+
+    def _run_batch(self, items):
+        kept, requests = [], []
+        for frame, boxes, landmarks in items:
+            keep = [i for i, box in enumerate(boxes) if self.embeddable(box)]
+            points = None
+            if landmarks is not None and all(landmarks[i] is not None for i in keep):
+                points = [landmarks[i] for i in keep]
+            kept.append(keep)
+            requests.append((frame, [boxes[i] for i in keep], points))
+            self.faces_run += len(keep)
+            self.faces_skipped += len(boxes) - len(keep)
+
+        # Every face of every frame goes to the embedder in one call
+        vectors = model_registry.face_embedder.embed_batch(requests)
+
+        results = []
+        for (_, boxes, _), keep, embeddings in zip(items, kept, vectors):
+            result = [None] * len(boxes)
+            for i, embedding in zip(keep, embeddings):
+                result[i] = embedding
+            results.append(result)
+        return results
+
+
+# Frames and crops from different cameras are batched into the same model calls
+detection_scheduler = DetectionScheduler(
+    max_batch_size=settings.FACE_DETECTION_BATCH_SIZE,
+    max_wait=settings.FACE_DETECTION_BATCH_WAIT_MS / 1000,
+)
+embedding_scheduler = EmbeddingScheduler(
+    max_batch_size=settings.FACE_EMBEDDING_BATCH_SIZE,
+    max_wait=settings.FACE_EMBEDDING_BATCH_WAIT_MS / 1000,
+    min_size=settings.FACE_EMBEDDING_MIN_SIZE,
+)
@@ -0,0 +1,72 @@
+# camera/lifecycle.py
+import sys
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+_shutdown = None
+
+
+async def shutdown():
+    """
+    Flush everything this worker still holds before it exits: close the
+    open stream sessions (consolidating the faces their tracks staged), wait
+    for the consolidation service and the write-behind queue to empty, then
+    stop the pipeline's worker pools.
+    Runs once, however many hooks ask for it.
+    """
+    global _shutdown
+    if _shutdown is None:
+        _shutdown = asyncio.ensure_future(_flush())
+    await asyncio.shield(_shutdown)
+
+
+async def _flush():
+    from .stream_hub import stream_hub
+    from .consolidation import consolidation_service
+    from .persistence import write_behind
+    from .pipeline import pipeline_executor
+
+    logger.info("Worker shutting down, flushing streams and queued writes")
+    try:
+        await stream_hub.close_all()
+        await consolidation_service.drain()
+        await write_behind.drain()
+    except Exception as e:
+        logger.error(f"Error flushing on shutdown: {str(e)}", exc_info=True)
+    # Nothing queued needs the pools any more; waiting for their last tasks
+    # blocks, so it happens on a thread of its own
+    await asyncio.to_thread(pipeline_executor.shutdown, wait=True)
+    logger.info(f"Shutdown flush done: {write_behind.stats()}")
+
+
+class LifespanApp:
+    """
+    ASGI lifespan handler, for servers that send lifespan events (uvicorn,
+    hypercorn): flushes the worker on shutdown.
+    """
+
+    async def __call__(self, scope, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def install_reactor_shutdown():
+    """
+    Daphne does not send lifespan events; when running under its Twisted
+    reactor, flush the worker from a 'before shutdown' trigger instead,
+    which the reactor waits on before stopping the event loop.
+    """
+    reactor = sys.modules.get('twisted.internet.reactor')
+    if reactor is None:
+        return
+    from twisted.internet.defer import Deferred
+
+    reactor.addSystemEventTrigger('before', 'shutdown', lambda: Deferred.fromFuture(asyncio.ensure_future(shutdown())))
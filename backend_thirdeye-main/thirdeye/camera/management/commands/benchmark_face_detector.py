@@ -0,0 +1,115 @@
+# camera/management/commands/benchmark_face_detector.py
+import os
+import time
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from camera.detectors import DETECTORS, create_detector
+from camera.inference_scheduler import DETECTION_CONFIDENCE
+from camera.trackers import iou_matrix, assign
+
+MATCH_IOU = 0.5
+
+
+def match(reference, detections):
+    """
+    Pair a backend's boxes with the reference backend's at IoU >= MATCH_IOU.
+    Returns (matched pairs, IoU of each pair).
+    """
+    iou = iou_matrix(reference.boxes, detections.boxes)
+    rows, cols = assign(1.0 - iou, 1.0 - MATCH_IOU)
+    return len(rows), iou[rows, cols]
+
+
+class Command(BaseCommand):
+    help = "Compare latency and agreement of face detector backends on frames from a video, stream or image folder"
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help="Video file, stream URL or directory of images")
+        parser.add_argument('--backends', nargs='+', default=sorted(DETECTORS), choices=sorted(DETECTORS))
+        parser.add_argument('--reference', default='ultralytics', choices=sorted(DETECTORS),
+                            help="Backend whose detections the others are scored against")
+        parser.add_argument('--frames', type=int, default=100)
+        parser.add_argument('--batch', type=int, default=1, help="Frames per detect() call")
+        parser.add_argument('--confidence', type=float, default=DETECTION_CONFIDENCE)
+        parser.add_argument('--threads', type=int, default=settings.FACE_DETECTOR_THREADS)
+        parser.add_argument('--int8', action='store_true', help="Also benchmark the INT8-quantised ONNX model")
+
+    def load_frames(self, source, limit):
+        if os.path.isdir(source):
+            paths = sorted(os.path.join(source, name) for name in os.listdir(source))
+            frames = [cv2.imread(path) for path in paths[:limit]]
+            frames = [frame for frame in frames if frame is not None]
+        else:
+            capture = cv2.VideoCapture(source)
+            frames = []
+            while len(frames) < limit:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                frames.append(frame)
+            capture.release()
+        if not frames:
+            raise CommandError(f"No frames could be read from {source}")
+        return frames
+
+    def run(self, detector, frames, batch, confidence):
+        detector.detect(frames[:1], confidence)  # Warm up
+        results, timings = [], []
+        for i in range(0, len(frames), batch):
+            start = time.perf_counter()
+            results += detector.detect(frames[i:i + batch], confidence)
+            timings.append((time.perf_counter() - start) / len(frames[i:i + batch]))
+        return results, np.array(timings) * 1000
+
+    def handle(self, *args, **options):
+        frames = self.load_frames(options['source'], options['frames'])
+        h, w = frames[0].shape[:2]
+        self.stdout.write(f"{len(frames)} frames of {w}x{h}, batch {options['batch']}")
+
+        variants = [(name, name, False) for name in options['backends']]
+        if options['int8']:
+            variants.append(('onnx-int8', 'onnx', True))
+        if options['reference'] not in options['backends']:
+            variants.insert(0, (options['reference'], options['reference'], False))
+
+        results = {}
+        for label, backend, int8 in variants:
+            start = time.perf_counter()
+            try:
+                detector = create_detector(
+                    backend,
+                    weights=settings.FACE_DETECTOR_WEIGHTS,
+                    onnx_path=settings.FACE_DETECTOR_ONNX,
+                    input_size=settings.FACE_DETECTOR_INPUT_SIZE,
+                    threads=options['threads'],
+                    int8=int8,
+                )
+            except (ImportError, OSError, cv2.error) as e:
+                self.stderr.write(f"{label:>11}: unavailable ({e})")
+                continue
+            load_seconds = time.perf_counter() - start
+            detections, timings = self.run(detector, frames, options['batch'], options['confidence'])
+            results[label] = detections
+
+            line = (
+                f"{label:>11}: mean={timings.mean():.1f}ms p95={np.percentile(timings, 95):.1f}ms "
+                f"fps={1000 / timings.mean():.1f} load={load_seconds:.2f}s size={detector.memory_bytes / 2**20:.1f}MB "
+                f"faces={sum(len(d.scores) for d in detections)}"
+            )
+            reference = results.get(options['reference'])
+            if reference is not None and label != options['reference']:
+                pairs = [match(ref, det) for ref, det in zip(reference, detections)]
+                matched = sum(count for count, _ in pairs)
+                ious = np.concatenate([iou for _, iou in pairs]) if matched else np.zeros(1)
+                expected = sum(len(d.scores) for d in reference)
+                found = sum(len(d.scores) for d in detections)
+                line += (
+                    f" recall={matched / expected if expected else 1.0:.3f}"
+                    f" precision={matched / found if found else 1.0:.3f} mean-iou={ious.mean():.3f}"
+                )
+            self.stdout.write(line)
+
+        if options['reference'] not in results:
+            self.stderr.write(f"Reference backend {options['reference']} is unavailable; agreement not scored")
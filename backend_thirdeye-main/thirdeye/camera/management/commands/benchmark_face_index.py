@@ -0,0 +1,50 @@
+# camera/management/commands/benchmark_face_index.py
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from camera.ann_index import benchmark, INDEX_BACKENDS
+from camera.embedders import embedder_spec
+from camera.embeddings import unpack_embeddings
+from camera.models import SelectedFace
+
+
+class Command(BaseCommand):
+    help = "Compare recall and latency of a face index backend against exact search"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backend', default='ivf', choices=sorted(INDEX_BACKENDS))
+        parser.add_argument('--user', type=int, help="Benchmark on this user's stored embeddings instead of synthetic data")
+        parser.add_argument('--size', type=int, default=50000, help="Number of synthetic embeddings")
+        parser.add_argument('--queries', type=int, default=500)
+        parser.add_argument('--nprobe', type=int, default=settings.FACE_INDEX_NPROBE)
+        parser.add_argument('--noise', type=float, default=0.05, help="Std-dev of the noise added to stored vectors to build queries")
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        dim = embedder_spec().dim
+
+        if options['user']:
+            rows = SelectedFace.objects.filter(
+                user_id=options['user'], embedding__isnull=False, embedding_model=embedder_spec().model_id
+            ).values_list('embedding', flat=True)
+            vectors = unpack_embeddings(list(rows), dim)
+            if not len(vectors):
+                raise CommandError(f"User {options['user']} has no stored embeddings")
+        else:
+            # Clustered data: a few thousand identities, several samples each
+            identities = rng.normal(0, 0.15, (max(options['size'] // 8, 1), dim)).astype(np.float32)
+            vectors = identities[rng.integers(len(identities), size=options['size'])]
+            vectors += rng.normal(0, 0.03, vectors.shape).astype(np.float32)
+
+        picks = rng.integers(len(vectors), size=options['queries'])
+        queries = vectors[picks] + rng.normal(0, options['noise'], (options['queries'], vectors.shape[1])).astype(np.float32)
+
+        backend_options = {'nprobe': options['nprobe']} if options['backend'] != 'exact' else {}
+        results = benchmark(vectors, queries, backend=options['backend'], **backend_options)
+
+        self.stdout.write(f"{len(vectors)} vectors, {len(queries)} queries")
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:>6}: recall@1={result['recall']:.3f} "
+                f"query={result['query_ms']:.3f}ms build={result['build_seconds']:.2f}s"
+            )
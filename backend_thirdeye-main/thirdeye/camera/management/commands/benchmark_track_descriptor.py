@@ -0,0 +1,86 @@
+# camera/management/commands/benchmark_track_descriptor.py
+import time
+import cv2
+import numpy as np
+from deep_sort_realtime.deep_sort import nn_matching
+from django.core.management.base import BaseCommand, CommandError
+from camera.appearance import DESCRIPTORS
+from camera.face_recognition_module import MAX_COSINE_DISTANCE, NN_BUDGET
+from camera.models import SelectedFace
+
+
+def jitter(crop, rng):
+    """
+    Another sighting of the same face: slightly shifted, rescaled and with
+    different exposure.
+    """
+    h, w = crop.shape[:2]
+    scale = rng.uniform(0.85, 1.15)
+    dx, dy = rng.integers(-max(w // 16, 1), max(w // 16, 1) + 1, size=2)
+    matrix = np.float32([[scale, 0, dx + (1 - scale) * w / 2], [0, scale, dy + (1 - scale) * h / 2]])
+    moved = cv2.warpAffine(crop, matrix, (w, h), borderMode=cv2.BORDER_REPLICATE)
+    return cv2.convertScaleAbs(moved, alpha=rng.uniform(0.8, 1.2), beta=rng.uniform(-15, 15))
+
+
+class Command(BaseCommand):
+    help = "Compare memory, speed and re-identification accuracy of tracker appearance descriptors"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help="Use this user's stored face crops instead of synthetic ones")
+        parser.add_argument('--faces', type=int, default=20, help="Number of synthetic faces (tracks)")
+        parser.add_argument('--budget', type=int, default=NN_BUDGET, help="Samples kept per track")
+        parser.add_argument('--queries', type=int, default=200)
+
+    def load_crops(self, options, rng):
+        if options['user']:
+            rows = SelectedFace.objects.filter(user_id=options['user'], image_data__isnull=False).values_list('image_data', flat=True)
+            crops = [cv2.imdecode(np.frombuffer(bytes(row), np.uint8), cv2.IMREAD_COLOR) for row in rows]
+            crops = [crop for crop in crops if crop is not None]
+            if len(crops) < 2:
+                raise CommandError(f"User {options['user']} has fewer than two stored face crops")
+            return crops
+
+        # Smooth random blobs with a distinct colour cast per face
+        crops = []
+        for _ in range(options['faces']):
+            base = rng.integers(0, 256, (12, 12, 3)).astype(np.uint8)
+            crop = cv2.resize(base, (112, 128), interpolation=cv2.INTER_CUBIC)
+            crops.append(cv2.add(crop, tuple(rng.integers(0, 60, 3).tolist()) + (0,)))
+        return crops
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        crops = self.load_crops(options, rng)
+        budget = options['budget']
+        self.stdout.write(f"{len(crops)} faces, budget {budget} samples per track")
+
+        for name, describe in DESCRIPTORS.items():
+            metric = nn_matching.NearestNeighborDistanceMetric("cosine", MAX_COSINE_DISTANCE, budget)
+
+            start = time.perf_counter()
+            samples = [[describe(jitter(crop, rng)) for _ in range(budget)] for crop in crops]
+            describe_ms = (time.perf_counter() - start) * 1000 / (len(crops) * budget)
+
+            targets = list(range(len(crops)))
+            metric.partial_fit(
+                np.array([feature for track in samples for feature in track]),
+                np.repeat(targets, budget),
+                targets,
+            )
+            dim = samples[0][0].shape[0]
+            track_bytes = budget * dim * np.dtype(np.float32).itemsize
+
+            truth = rng.integers(len(crops), size=options['queries'])
+            features = np.array([describe(jitter(crops[i], rng)) for i in truth])
+            start = time.perf_counter()
+            cost = metric.distance(features, targets).T  # (queries, tracks)
+            distance_ms = (time.perf_counter() - start) * 1000
+
+            accuracy = float(np.mean(cost.argmin(axis=1) == truth))
+            same = cost[np.arange(len(truth)), truth]
+            other = np.where(np.eye(len(crops), dtype=bool)[truth], np.inf, cost).min(axis=1)
+            self.stdout.write(
+                f"{name:>8}: dim={dim} track={track_bytes / 1024:.1f}KB describe={describe_ms:.3f}ms "
+                f"distance={distance_ms:.2f}ms ({len(truth)}x{len(crops)}) re-id={accuracy:.3f} "
+                f"same-face median={np.median(same):.3f} nearest-other median={np.median(other):.3f}"
+            )
@@ -0,0 +1,47 @@
+# camera/management/commands/pack_embeddings.py
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from camera.embeddings import STORAGE_DTYPES, is_packed
+from camera.models import TempFace, SelectedFace
+
+
+class Command(BaseCommand):
+    help = (
+        "Convert face embeddings stored as JSON lists into packed binary vectors. "
+        "Run after migrating the embedding columns from JSONField to BinaryField."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--storage', default=settings.FACE_EMBEDDING_STORAGE, choices=sorted(STORAGE_DTYPES))
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--repack', action='store_true',
+            help="Also rewrite rows that are already packed, e.g. to switch them to --storage",
+        )
+
+    def handle(self, *args, **options):
+        for model in (SelectedFace, TempFace):
+            converted = self.convert(model, options['storage'], options['batch_size'], options['repack'])
+            self.stdout.write(f"{model.__name__}: packed {converted} embeddings as {options['storage']}")
+
+    def convert(self, model, storage, batch_size, repack):
+        converted = 0
+        batch = []
+        rows = model.objects.filter(embedding__isnull=False).only('id', 'embedding').order_by('id')
+        for row in rows.iterator(chunk_size=batch_size):
+            if is_packed(row.embedding) and not repack:
+                continue
+            row.set_embedding(row.embedding_vector, storage)
+            batch.append(row)
+            if len(batch) >= batch_size:
+                converted += self.flush(model, batch)
+        return converted + self.flush(model, batch)
+
+    def flush(self, model, batch):
+        count = len(batch)
+        if count:
+            with transaction.atomic():
+                model.objects.bulk_update(batch, ['embedding'])
+            batch.clear()
+        return count
@@ -0,0 +1,96 @@
+# camera/management/commands/reembed_faces.py
+import os
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from camera.embedders import embedder_spec
+from camera.embeddings import STORAGE_DTYPES
+from camera.face_index import face_galleries
+from camera.model_registry import model_registry
+from camera.models import TempFace, SelectedFace
+
+# Stored crops are padded by 20% of the face box on each side (see
+# FaceRecognitionProcessor.cut_face_crop)
+CROP_PADDING = 0.2
+
+
+def face_box(crop):
+    """
+    The face's (x1, y1, x2, y2) box inside a stored, padded crop.
+    """
+    h, w = crop.shape[:2]
+    margin = CROP_PADDING / (1 + 2 * CROP_PADDING)
+    return (w * margin, h * margin, w * (1 - margin), h * (1 - margin))
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute stored face embeddings with the configured embedder (FACE_EMBEDDER_BACKEND) "
+        "from the saved face crops. Run after switching embedders, then restart the workers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help="Only re-embed this user's faces")
+        parser.add_argument('--storage', default=settings.FACE_EMBEDDING_STORAGE, choices=sorted(STORAGE_DTYPES))
+        parser.add_argument('--batch-size', type=int, default=64)
+        parser.add_argument('--force', action='store_true', help="Also re-embed rows already made by the configured embedder")
+
+    def handle(self, *args, **options):
+        spec = embedder_spec()
+        self.stdout.write(f"Re-embedding faces with {spec.model_id} ({spec.dim}-d, threshold {spec.threshold})")
+
+        users = set()
+        for model in (SelectedFace, TempFace):
+            rows = model.objects.filter(image_data__isnull=False)
+            if options['user']:
+                rows = rows.filter(user_id=options['user'])
+            if not options['force']:
+                rows = rows.exclude(embedding_model=spec.model_id)
+            converted, failed = self.convert(model, rows, spec, options['storage'], options['batch_size'], users)
+            self.stdout.write(f"{model.__name__}: re-embedded {converted}, could not embed {failed}")
+
+        # Galleries and their trained quantizers were built from the old vectors
+        for user_id in users:
+            path = face_galleries.index_path(user_id)
+            if path and os.path.exists(path):
+                os.remove(path)
+            face_galleries.invalidate(user_id)
+        self.stdout.write(f"Reset the face index of {len(users)} users")
+
+    def convert(self, model, rows, spec, storage, batch_size, users):
+        converted = failed = 0
+        batch = []
+        for row in rows.only('id', 'user_id', 'image_data').order_by('id').iterator(chunk_size=batch_size):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                done = self.embed(model, batch, spec, storage, users)
+                converted, failed = converted + done, failed + len(batch) - done
+                batch = []
+        if batch:
+            done = self.embed(model, batch, spec, storage, users)
+            converted, failed = converted + done, failed + len(batch) - done
+        return converted, failed
+
+    def embed(self, model, rows, spec, storage, users):
+        """
+        Embed a batch of rows' crops in one embedder call and save the ones
+        that succeeded. Returns how many did.
+        """
+        crops = [cv2.imdecode(np.frombuffer(bytes(row.image_data), np.uint8), cv2.IMREAD_COLOR) for row in rows]
+        pending = [(row, crop) for row, crop in zip(rows, crops) if crop is not None and crop.size]
+        vectors = model_registry.face_embedder.embed_batch([(crop, [face_box(crop)], None) for _, crop in pending])
+
+        updated = []
+        for (row, _), embeddings in zip(pending, vectors):
+            if not embeddings or embeddings[0] is None:
+                continue
+            row.set_embedding(embeddings[0], storage)
+            row.embedding_model = spec.model_id
+            updated.append(row)
+            users.add(row.user_id)
+
+        with transaction.atomic():
+            model.objects.bulk_update(updated, ['embedding', 'embedding_model'])
+        return len(updated)
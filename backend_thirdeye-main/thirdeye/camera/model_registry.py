@@ -0,0 +1,168 @@
+# camera/model_registry.py
+import os
+import time
+import logging
+import threading
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ModelRegistry:
+    """
+    Process-wide home of the face models (face detector, the dlib face
+    encoder and its 5-point landmark predictor, and the face embedder
+    backend). Every model is loaded lazily on first use, exactly once per
+    worker, and then borrowed by all FaceRecognitionProcessor instances.
+    """
+
+    MODEL_NAMES = ('detector', 'face_encoder', 'face_embedder', 'landmark_predictor')
+
+    def __init__(self):
+        # Reentrant: a loader may borrow another model (the dlib embedder
+        # wraps face_encoder)
+        self._lock = threading.RLock()
+        self._models = {}
+        self._stats = {}
+        self._device = None
+
+    @property
+    def device(self):
+        if self._device is None:
+            import torch
+            self._device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        return self._device
+
+    @property
+    def detector(self):
+        return self.get('detector')
+
+    @property
+    def face_encoder(self):
+        return self.get('face_encoder')
+
+    @property
+    def face_embedder(self):
+        return self.get('face_embedder')
+
+    @property
+    def landmark_predictor(self):
+        return self.get('landmark_predictor')
+
+    def get(self, name):
+        model = self._models.get(name)
+        if model is not None:
+            return model
+
+        with self._lock:
+            # Another thread may have finished loading while we were waiting
+            model = self._models.get(name)
+            if model is None:
+                loader = getattr(self, f'_load_{name}', None)
+                if loader is None:
+                    raise KeyError(f"Unknown model: {name}")
+
+                start = time.perf_counter()
+                model, memory_bytes = loader()
+                load_seconds = time.perf_counter() - start
+
+                self._models[name] = model
+                self._stats[name] = {
+                    'memory_bytes': memory_bytes,
+                    'load_seconds': load_seconds,
+                    'loaded_at': time.time(),
+                }
+                logger.info(f"Model '{name}' loaded in {load_seconds:.2f}s ({memory_bytes / 2**20:.1f} MB)")
+        return model
+
+    def warm_up(self, names=None):
+        """
+        Load the given models (all of them by default) and run a dummy
+        inference through the detector so the first real frame does not pay
+        for lazy initialisation inside the detector backend.
+        """
+        names = names or self.MODEL_NAMES
+        for name in names:
+            self.get(name)
+
+        if 'detector' in names:
+            start = time.perf_counter()
+            self.detector.detect([np.zeros((640, 640, 3), dtype=np.uint8)], 0.3)
+            logger.info(f"Detector warm-up inference took {time.perf_counter() - start:.2f}s")
+
+        logger.info(f"Model registry warmed up: {self.memory_usage()}")
+
+    def memory_usage(self):
+        """
+        Return the approximate memory held by each loaded model, in bytes,
+        together with a 'total' entry.
+        """
+        usage = {name: stats['memory_bytes'] for name, stats in self._stats.items()}
+        usage['total'] = sum(usage.values())
+        return usage
+
+    def stats(self):
+        return {
+            name: {**self._stats[name], 'loaded': True} if name in self._stats else {'loaded': False}
+            for name in self.MODEL_NAMES
+        }
+
+    def _load_detector(self):
+        from .detectors import create_detector
+
+        backend = settings.FACE_DETECTOR_BACKEND
+        detector = create_detector(
+            backend,
+            weights=settings.FACE_DETECTOR_WEIGHTS,
+            onnx_path=settings.FACE_DETECTOR_ONNX,
+            device=self.device if backend == 'ultralytics' else 'cpu',
+            input_size=settings.FACE_DETECTOR_INPUT_SIZE,
+            threads=settings.FACE_DETECTOR_THREADS,
+            int8=settings.FACE_DETECTOR_INT8,
+        )
+        logger.info(f"Face detector loaded with the {backend} backend")
+        return detector, detector.memory_bytes
+
+    def _load_face_encoder(self):
+        # Importing face_recognition loads the dlib detector, shape predictors
+        # and the ResNet encoder into module globals.
+        import face_recognition
+        import face_recognition_models
+
+        model_files = [
+            face_recognition_models.pose_predictor_model_location(),
+            face_recognition_models.face_recognition_model_location(),
+            face_recognition_models.cnn_face_detector_model_location(),
+        ]
+        memory_bytes = sum(os.path.getsize(path) for path in model_files if os.path.exists(path))
+        return face_recognition.face_encodings, memory_bytes
+
+    def _load_face_embedder(self):
+        from .embedders import create_embedder
+
+        backend = settings.FACE_EMBEDDER_BACKEND
+        embedder = create_embedder(
+            backend,
+            # dlib's models are accounted for under face_encoder
+            face_encodings=self.face_encoder if backend == 'dlib' else None,
+            onnx_path=settings.FACE_EMBEDDER_ONNX,
+            dim=settings.FACE_EMBEDDER_DIM,
+            threshold=settings.FACE_EMBEDDER_THRESHOLD,
+            threads=settings.FACE_EMBEDDER_THREADS,
+        )
+        logger.info(f"Face embedder loaded: {embedder.spec.model_id} ({embedder.spec.dim}-d)")
+        return embedder, embedder.memory_bytes
+
+    def _load_landmark_predictor(self):
+        # Already in memory once face_recognition is imported; only the
+        # 5-point model file is accounted for here.
+        import face_recognition.api
+        import face_recognition_models
+
+        model_path = face_recognition_models.pose_predictor_five_point_model_location()
+        return face_recognition.api.pose_predictor_5_point, os.path.getsize(model_path)
+
+
+# Models stay loaded until the worker exits; memory_usage() reports them
+model_registry = ModelRegistry()
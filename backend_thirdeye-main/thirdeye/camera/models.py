@@ -4,28 +4,56 @@ from django.conf import settings
 from django.utils import timezone
 from urllib.parse import quote
 import datetime
+from .embeddings import pack_embedding, unpack_embedding
+
+
+class EmbeddingMixin:
+    """
+    Accessors for the packed `embedding` column (see camera.embeddings).
+    """
+
+    @property
+    def embedding_vector(self):
+        # float32 payloads come back as a zero-copy np.frombuffer view over the column
+        return unpack_embedding(self.embedding)
+
+    def set_embedding(self, vector, storage=None):
+        self.embedding = pack_embedding(vector, storage or settings.FACE_EMBEDDING_STORAGE)
+
 
 # Model to temporarily store face data before processing
-class TempFace(models.Model):
+class TempFace(EmbeddingMixin, models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='temp_faces', null=True, blank=True)
+    camera_name = models.CharField(max_length=100, null=True, blank=True)  # Camera that captured the crop
     face_id = models.CharField(max_length=100)
     image_data = models.BinaryField(null=True, blank=True)
-    embedding = models.JSONField(null=True, blank=True)  # Store face embedding
+    embedding = models.BinaryField(null=True, blank=True)  # Packed face embedding
+    embedding_model = models.CharField(max_length=100, default='dlib')  # Embedder that produced it (camera.embedders)
     last_seen = models.DateTimeField(default=timezone.now)
     processed = models.BooleanField(default=False)
     date_seen = models.DateField(default=timezone.now)  # Store the date of the last seen
-    quality_score = models.FloatField(default=0.0)
+    quality_score = models.FloatField(default=0.0)  # Combined score, computed when the crop is captured
+    blur_score = models.FloatField(default=0.0)
+    pose_score = models.FloatField(default=0.0)
+    size_score = models.FloatField(default=0.0)
+
+    class Meta:
+        indexes = [
+            # Lets consolidation pick the best crop of a face without decoding any image
+            models.Index(fields=['face_id', 'processed', '-quality_score'], name='tempface_best_crop_idx'),
+        ]
 
     def __str__(self):
         return f"TempFace {self.face_id} (ID: {self.id})"
 
 
 # Model to store the processed, identified face
-class SelectedFace(models.Model):
+class SelectedFace(EmbeddingMixin, models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='selected_faces', null=True, blank=True)
     face_id = models.CharField(max_length=100)
     image_data = models.BinaryField(null=True, blank=True)
-    embedding = models.JSONField(null=True, blank=True)  # Store face embedding
+    embedding = models.BinaryField(null=True, blank=True)  # Packed face embedding
+    embedding_model = models.CharField(max_length=100, default='dlib')  # Embedder that produced it (camera.embedders)
     quality_score = models.FloatField(default=0.0)
     last_seen = models.DateTimeField(default=timezone.now)
     timestamp = models.DateTimeField(default=timezone.now)
@@ -55,6 +83,10 @@ class FaceVisit(models.Model):
             self.date_seen = self.detected_time.date()
         super().save(*args, **kwargs)
 
+# Channel of a camera's full-resolution main stream
+MAIN_CHANNEL = 101
+
+
 # Model to store static camera details
 class StaticCamera(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -62,11 +94,15 @@ class StaticCamera(models.Model):
     username = models.CharField(max_length=255)
     password = models.CharField(max_length=255)
     name = models.CharField(max_length=255, default="Static Camera")
+    detection_channel = models.PositiveIntegerField(null=True, blank=True)  # Low-resolution substream to detect faces on, e.g. 102
 
-    def rtsp_url(self):
+    def rtsp_url(self, channel=MAIN_CHANNEL):
         encoded_username = quote(self.username)
         encoded_password = quote(self.password)
-        return f"rtsp://{encoded_username}:{encoded_password}@{self.ip_address}:1024/Streaming/Channels/101"
+        return f"rtsp://{encoded_username}:{encoded_password}@{self.ip_address}:1024/Streaming/Channels/{channel}"
+
+    def detection_rtsp_url(self):
+        return self.rtsp_url(self.detection_channel) if self.detection_channel else None
 
     def __str__(self):
         return f"StaticCamera {self.name} (IP: {self.ip_address})"
@@ -79,11 +115,15 @@ class DDNSCamera(models.Model):
     username = models.CharField(max_length=255)
     password = models.CharField(max_length=255)
     name = models.CharField(max_length=255, default="DDNS Camera")
+    detection_channel = models.PositiveIntegerField(null=True, blank=True)  # Low-resolution substream to detect faces on, e.g. 102
 
-    def rtsp_url(self):
+    def rtsp_url(self, channel=MAIN_CHANNEL):
         encoded_username = quote(self.username)
         encoded_password = quote(self.password)
-        return f"rtsp://{encoded_username}:{encoded_password}@{self.ddns_hostname}:554/Streaming/Channels/101"
+        return f"rtsp://{encoded_username}:{encoded_password}@{self.ddns_hostname}:554/Streaming/Channels/{channel}"
+
+    def detection_rtsp_url(self):
+        return self.rtsp_url(self.detection_channel) if self.detection_channel else None
 
     def __str__(self):
         return f"DDNSCamera {self.name} (Hostname: {self.ddns_hostname})"
@@ -91,10 +131,16 @@ class DDNSCamera(models.Model):
 
 # Model to store the camera stream URL
 class CameraStream(models.Model):
+    TRACKER_CHOICES = [
+        ('deepsort', 'DeepSORT (appearance)'),
+        ('bytetrack', 'ByteTrack (motion only)'),
+    ]
+
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     camera = models.ForeignKey(StaticCamera, null=True, blank=True, on_delete=models.CASCADE)
     ddns_camera = models.ForeignKey(DDNSCamera, null=True, blank=True, on_delete=models.CASCADE)
     stream_url = models.CharField(max_length=255)
+    tracker_type = models.CharField(max_length=20, choices=TRACKER_CHOICES, default='deepsort')
     created_at = models.DateTimeField(default=timezone.now)
 
     def __str__(self):
@@ -0,0 +1,82 @@
+# camera/motion.py
+import time
+import cv2
+import numpy as np
+
+MOTION_WIDTH = 160  # Frames are compared at this width
+PIXEL_THRESHOLD = 25  # Grey-level change that counts a pixel as moving
+BACKGROUND_ALPHA = 0.05
+EWMA_ALPHA = 0.1
+
+
+class MotionGate:
+    """
+    Cheap motion pre-filter that lets a stream skip face detection on static
+    scenes. Each frame is shrunk to a small blurred greyscale image and
+    compared against a running-average background; the detector only runs
+    when enough of the picture changed or the tracker still has faces in
+    view that need refreshing.
+
+    Checking a frame costs around a millisecond even for HD frames. It
+    keeps per-stream state, so StreamSession runs it on the pipeline
+    executor's thread pool ('motion' stage), off the event loop.
+    """
+
+    def __init__(self, min_area=0.002, enabled=True):
+        self.min_area = min_area
+        self.enabled = enabled
+        self._background = None
+        self.frames_checked = 0
+        self.frames_gated = 0
+        self.motion_area = 0.0
+        self.check_seconds = 0.0
+        self.saved_seconds = 0.0
+
+    def motion(self, image):
+        """
+        Return the fraction of the frame that moved since the background
+        model was last updated, and update it.
+        """
+        h, w = image.shape[:2]
+        size = (MOTION_WIDTH, max(1, round(h * MOTION_WIDTH / w)))
+        small = cv2.cvtColor(cv2.resize(image, size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        small = cv2.GaussianBlur(small, (5, 5), 0).astype(np.float32)
+
+        if self._background is None or self._background.shape != small.shape:
+            self._background = small
+            return 1.0
+
+        moving = np.abs(small - self._background) > PIXEL_THRESHOLD
+        cv2.accumulateWeighted(small, self._background, BACKGROUND_ALPHA)
+        return float(moving.mean())
+
+    def should_detect(self, image, active_tracks=False, detect_seconds=None):
+        """
+        Whether to run the detector on this frame. `detect_seconds` is the
+        stream's current detection cost, credited as saved when gated.
+        """
+        if not self.enabled:
+            return True
+
+        start = time.perf_counter()
+        self.motion_area = self.motion(image)
+        elapsed = time.perf_counter() - start
+        self.check_seconds += EWMA_ALPHA * (elapsed - self.check_seconds)
+        self.frames_checked += 1
+
+        if active_tracks or self.motion_area >= self.min_area:
+            return True
+
+        self.frames_gated += 1
+        self.saved_seconds += max((detect_seconds or 0.0) - elapsed, 0.0)
+        return False
+
+    def stats(self):
+        return {
+            'frames_checked': self.frames_checked,
+            'frames_gated': self.frames_gated,
+            'gated_ratio': self.frames_gated / self.frames_checked if self.frames_checked else 0.0,
+            'motion_area': self.motion_area,
+            'check_ms': self.check_seconds * 1000,
+            'cpu_saved_seconds': self.saved_seconds,
+        }
@@ -0,0 +1,155 @@
+# camera/output_stage.py
+import time
+import asyncio
+from collections import namedtuple, deque
+import cv2
+from .pipeline import pipeline_executor, encode_jpeg
+
+# A resolution and JPEG quality frames are sent at. `width` is the largest
+# width frames are scaled down to, 0 for the camera's own resolution.
+EncodingProfile = namedtuple('EncodingProfile', ['name', 'width', 'quality'])
+
+
+def parse_profiles(spec):
+    """
+    Parse 'name:width:quality' entries separated by commas, best first,
+    e.g. 'full:0:80,medium:960:65,low:640:50'.
+    """
+    profiles = []
+    for entry in spec.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        try:
+            name, width, quality = entry.split(':')
+            profile = EncodingProfile(name, int(width), int(quality))
+        except ValueError:
+            raise ValueError(f"Invalid encoding profile {entry!r}, expected name:width:quality") from None
+        if profile.width < 0 or not 1 <= profile.quality <= 100:
+            raise ValueError(f"Invalid encoding profile {entry!r}")
+        profiles.append(profile)
+    if not profiles:
+        raise ValueError("At least one encoding profile is required")
+    return profiles
+
+
+def encode_profile(image, width, quality):
+    """
+    Scale a BGR image down to `width` (if it is wider) and JPEG-encode it.
+    Returns the bytes and the seconds it took.
+    """
+    start = time.perf_counter()
+    h, w = image.shape[:2]
+    if width and w > width:
+        image = cv2.resize(image, (width, round(h * width / w)), interpolation=cv2.INTER_AREA)
+    return encode_jpeg(image, quality), time.perf_counter() - start
+
+
+class AdaptiveQuality:
+    """
+    Which profile one viewer is sent. A viewer that falls behind is moved
+    one profile down (at most once per `downgrade_after` seconds), and one
+    back up after keeping up for `upgrade_after` seconds.
+    """
+
+    def __init__(self, levels, downgrade_after=1.0, upgrade_after=5.0):
+        self.levels = levels
+        self.downgrade_after = downgrade_after
+        self.upgrade_after = upgrade_after
+        self.level = 0
+        self.changes = 0
+        self._changed_at = time.monotonic()
+        self._backlog_at = None
+
+    def backlog(self, now=None):
+        now = time.monotonic() if now is None else now
+        self._backlog_at = now
+        if self.level < self.levels - 1 and now - self._changed_at >= self.downgrade_after:
+            self._change(self.level + 1, now)
+
+    def caught_up(self, now=None):
+        now = time.monotonic() if now is None else now
+        if self.level == 0:
+            return
+        since = max(self._changed_at, self._backlog_at or self._changed_at)
+        if now - since >= self.upgrade_after:
+            self._change(self.level - 1, now)
+
+    def _change(self, level, now):
+        self.level = level
+        self.changes += 1
+        self._changed_at = now
+
+
+class ProfileStats:
+    """
+    Frames, encode time and output bytes of one profile; bytes per second
+    over the last `window` seconds.
+    """
+
+    def __init__(self, window=5.0):
+        self.window = window
+        self.frames = 0
+        self.encode_seconds = 0.0
+        self.bytes = 0
+        self._recent = deque()
+
+    def record(self, size, seconds, now):
+        self.frames += 1
+        self.encode_seconds += seconds
+        self.bytes += size
+        self._recent.append((now, size))
+        while self._recent and now - self._recent[0][0] > self.window:
+            self._recent.popleft()
+
+    def bytes_per_second(self, now):
+        recent = [size for at, size in self._recent if now - at <= self.window]
+        return sum(recent) / self.window
+
+    def stats(self, now):
+        return {
+            'frames': self.frames,
+            'encode_ms': self.encode_seconds * 1000 / self.frames if self.frames else 0.0,
+            'average_bytes': self.bytes / self.frames if self.frames else 0.0,
+            'bytes_per_second': self.bytes_per_second(now),
+        }
+
+
+class OutputStage:
+    """
+    Encodes each frame of a stream once per profile some viewer is
+    currently sent, however many viewers share that profile, so the bytes
+    are shared between them.
+    """
+
+    def __init__(self, profiles):
+        self.profiles = list(profiles)
+        self._stats = [ProfileStats() for _ in self.profiles]
+
+    def adaptive_quality(self, downgrade_after=1.0, upgrade_after=5.0):
+        return AdaptiveQuality(len(self.profiles), downgrade_after=downgrade_after, upgrade_after=upgrade_after)
+
+    async def encode(self, image, levels):
+        """
+        Encode `image` at each of the profile `levels`. Returns a dict from
+        level to JPEG bytes.
+        """
+        levels = sorted(levels)
+        if not levels:
+            return {}
+        results = await asyncio.gather(*[
+            pipeline_executor.run(
+                'encode', encode_profile, image, self.profiles[level].width, self.profiles[level].quality, stateless=True,
+            )
+            for level in levels
+        ])
+        now = time.monotonic()
+        encoded = {}
+        for level, (jpeg, seconds) in zip(levels, results):
+            self._stats[level].record(len(jpeg), seconds, now)
+            encoded[level] = jpeg
+        return encoded
+
+    def stats(self):
+        now = time.monotonic()
+        return {profile.name: stats.stats(now) for profile, stats in zip(self.profiles, self._stats)}
@@ -0,0 +1,232 @@
+# camera/persistence.py
+import time
+import asyncio
+import logging
+from collections import defaultdict, namedtuple
+from functools import reduce
+from operator import or_
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from asgiref.sync import sync_to_async
+from .models import SelectedFace, FaceVisit
+from .pipeline import collect_batch
+
+logger = logging.getLogger(__name__)
+
+# SelectedFace is unique per (user, face_id, date_seen); queued writes refer
+# to rows by this key because new rows have no primary key until flushed.
+SelectedFaceKey = namedtuple('SelectedFaceKey', ['user_id', 'face_id', 'date_seen'])
+
+SELECTED_FACE_FIELDS = ('image_data', 'embedding', 'embedding_model', 'quality_score', 'last_seen')
+
+UPSERT_SELECTED_FACE, CREATE_VISIT, CREATE, DELETE = range(4)
+
+# A failing batch is retried this many times, RETRY_DELAY seconds apart
+# and doubling, before its writes are applied one by one
+WRITE_RETRIES = 3
+RETRY_DELAY = 0.5
+
+
+class WriteBehindQueue:
+    """
+    Collects the database writes of every stream in this worker and applies
+    them in batches: SelectedFace upserts become one bulk_update plus one
+    bulk_create, visits, notifications and TempFace deletes are bulk
+    operations too, all inside a single transaction.
+
+    A batch is written once it holds max_batch_size writes or its oldest
+    write has waited max_delay seconds. The queue holds at most max_pending
+    writes; producers wait when it is full. A batch that keeps failing is
+    written one write at a time, so a single bad row only loses itself.
+    """
+
+    def __init__(self, max_batch_size, max_delay, max_pending):
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self._queue = None
+        self._task = None
+        self.writes_done = 0
+        self.writes_failed = 0
+        self.batches_run = 0
+        self.batches_failed = 0
+        self.last_batch_seconds = 0.0
+
+    def start(self):
+        if self._task is not None and not self._task.done():
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        logger.info(f"Write-behind queue started (batch={self.max_batch_size}, delay={self.max_delay * 1000:.0f}ms)")
+
+    async def _put(self, kind, payload):
+        self.start()
+        await self._queue.put((kind, payload))
+
+    async def upsert_selected_face(self, user_id, face_id, date_seen, image_data, embedding, embedding_model, quality_score, last_seen):
+        """
+        Create the SelectedFace for this key or update its image, embedding,
+        quality score and last_seen. Returns the row's SelectedFaceKey.
+        """
+        key = SelectedFaceKey(user_id, face_id, date_seen)
+        fields = dict(zip(SELECTED_FACE_FIELDS, (image_data, embedding, embedding_model, quality_score, last_seen)))
+        await self._put(UPSERT_SELECTED_FACE, (key, fields))
+        return key
+
+    async def create_visit(self, key, image_data, detected_time):
+        await self._put(CREATE_VISIT, (key, image_data, detected_time))
+
+    async def create(self, instance):
+        await self._put(CREATE, instance)
+
+    async def delete(self, model, ids):
+        await self._put(DELETE, (model, list(ids)))
+
+    def pending(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def drain(self):
+        """
+        Wait until every queued write has been flushed.
+        """
+        if self._queue is not None and self._task is not None and not self._task.done():
+            await self._queue.join()
+
+    def stats(self):
+        return {
+            'pending': self.pending(),
+            'writes_done': self.writes_done,
+            'writes_failed': self.writes_failed,
+            'batches_run': self.batches_run,
+            'batches_failed': self.batches_failed,
+            'average_batch_size': self.writes_done / self.batches_run if self.batches_run else 0.0,
+            'last_batch_seconds': self.last_batch_seconds,
+        }
+
+    async def _run(self):
+        while True:
+            batch = await collect_batch(self._queue, self.max_batch_size, self.max_delay)
+            start = time.perf_counter()
+            try:
+                await self.flush(batch)
+                logger.debug(f"Flushed {len(batch)} queued writes in {(time.perf_counter() - start) * 1000:.1f}ms")
+            finally:
+                self.last_batch_seconds = time.perf_counter() - start
+                self.batches_run += 1
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def flush(self, batch):
+        for attempt in range(WRITE_RETRIES + 1):
+            if attempt:
+                await asyncio.sleep(RETRY_DELAY * 2 ** (attempt - 1))
+            try:
+                dropped = await sync_to_async(self.write)(batch)
+                self.writes_done += len(batch) - dropped
+                self.writes_failed += dropped
+                return
+            except Exception as e:
+                logger.warning(f"Error flushing {len(batch)} queued writes (attempt {attempt + 1}/{WRITE_RETRIES + 1}): {str(e)}")
+
+        # Queue order keeps upserts ahead of the visits that refer to them
+        self.batches_failed += 1
+        for write in batch:
+            try:
+                dropped = await sync_to_async(self.write)([write])
+                self.writes_done += 1 - dropped
+                self.writes_failed += dropped
+            except Exception as e:
+                self.writes_failed += 1
+                logger.error(f"Dropping queued write {write[0]} that cannot be applied: {str(e)}", exc_info=True)
+
+    def write(self, batch):
+        """
+        Apply a batch of queued writes in one transaction, in queue order
+        per kind: SelectedFace upserts first, since visits refer to them.
+        Returns the number of visits dropped because their SelectedFace
+        does not exist (its upsert failed).
+        """
+        upserts = {}
+        visits, creates, deletes = [], defaultdict(list), defaultdict(list)
+        for kind, payload in batch:
+            if kind == UPSERT_SELECTED_FACE:
+                key, fields = payload
+                # Later writes to the same face win
+                upserts[key] = fields
+            elif kind == CREATE_VISIT:
+                visits.append(payload)
+            elif kind == CREATE:
+                creates[type(payload)].append(payload)
+            elif kind == DELETE:
+                model, ids = payload
+                deletes[model].extend(ids)
+
+        with transaction.atomic():
+            face_ids = self.upsert_selected_faces(upserts)
+            missing = {key for key, _, _ in visits} - set(face_ids)
+            if missing:
+                face_ids.update(self.selected_face_ids(missing))
+
+            orphans = [key for key, _, _ in visits if key not in face_ids]
+            if orphans:
+                logger.error(f"Dropping {len(orphans)} queued visits whose SelectedFace was never written: {orphans}")
+
+            FaceVisit.objects.bulk_create([
+                FaceVisit(
+                    selected_face_id=face_ids[key],
+                    image_data=image_data,
+                    detected_time=detected_time,
+                    date_seen=key.date_seen,
+                )
+                for key, image_data, detected_time in visits
+                if key in face_ids
+            ])
+            for model, instances in creates.items():
+                model.objects.bulk_create(instances)
+            for model, ids in deletes.items():
+                model.objects.filter(id__in=ids).delete()
+        return len(orphans)
+
+    def selected_face_ids(self, keys):
+        """
+        Map SelectedFaceKeys to primary keys with one query. Where a key has
+        several rows the oldest one is used, like get_or_create would.
+        """
+        if not keys:
+            return {}
+        condition = reduce(or_, (Q(user_id=key.user_id, face_id=key.face_id, date_seen=key.date_seen) for key in keys))
+        ids = {}
+        rows = SelectedFace.objects.filter(condition).order_by('-id').values_list('id', 'user_id', 'face_id', 'date_seen')
+        for pk, user_id, face_id, date_seen in rows:
+            ids[SelectedFaceKey(user_id, face_id, date_seen)] = pk
+        return ids
+
+    def upsert_selected_faces(self, upserts):
+        existing = self.selected_face_ids(upserts.keys())
+        if existing:
+            SelectedFace.objects.bulk_update(
+                [SelectedFace(id=pk, **upserts[key]) for key, pk in existing.items()],
+                SELECTED_FACE_FIELDS,
+            )
+
+        created = [
+            SelectedFace(user_id=key.user_id, face_id=key.face_id, date_seen=key.date_seen, **fields)
+            for key, fields in upserts.items()
+            if key not in existing
+        ]
+        if created:
+            SelectedFace.objects.bulk_create(created)
+            # MySQL does not return primary keys from bulk_create, so look them up
+            existing.update(self.selected_face_ids([
+                SelectedFaceKey(face.user_id, face.face_id, face.date_seen) for face in created
+            ]))
+        return existing
+
+
+# Writes from every stream share the same batches and transactions
+write_behind = WriteBehindQueue(
+    max_batch_size=settings.FACE_WRITE_BATCH_SIZE,
+    max_delay=settings.FACE_WRITE_MAX_DELAY_MS / 1000,
+    max_pending=settings.FACE_WRITE_MAX_PENDING,
+)
@@ -0,0 +1,136 @@
+# camera/pipeline.py
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+import cv2
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+JPEG_QUALITY = 80
+
+
+def encode_jpeg(image, quality=JPEG_QUALITY):
+    """
+    JPEG-encode a BGR image and return the raw bytes. Module level so it can
+    be shipped to a process pool.
+    """
+    ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("Failed to JPEG-encode image")
+    return buffer.tobytes()
+
+
+async def collect_batch(queue, max_batch_size, max_wait):
+    """
+    Wait for an item of an asyncio queue, then keep taking items until the
+    batch holds `max_batch_size` of them or `max_wait` seconds have passed
+    since the first arrived.
+    """
+    batch = [await queue.get()]
+    deadline = time.monotonic() + max_wait
+    while len(batch) < max_batch_size:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(await asyncio.wait_for(queue.get(), remaining))
+        except asyncio.TimeoutError:
+            break
+    return batch
+
+
+class PipelineExecutor:
+    """
+    Runs the blocking stages of the per-frame pipeline (capture, motion,
+    detect, track, embed, quality, gallery search, encode) off the ASGI
+    event loop, so coroutines only hand frames and results between stages.
+
+    Stateful stages (capture, motion, track) always run on the thread pool
+    because they touch per-stream objects like the VideoCapture, the
+    background model and the tracker. Stateless stages may be sent to a
+    process pool by passing stateless=True when FACE_PIPELINE_EXECUTOR is
+    'process'.
+    """
+
+    STAGES = ('capture', 'motion', 'detect', 'track', 'embed', 'quality', 'gallery', 'encode')
+
+    def __init__(self, kind='thread', max_workers=4):
+        if kind not in ('thread', 'process'):
+            raise ValueError(f"Unknown pipeline executor: {kind}")
+        self.kind = kind
+        self.max_workers = max_workers
+        self._thread_pool = None
+        self._process_pool = None
+        self._depth = {stage: 0 for stage in self.STAGES}
+        self._completed = {stage: 0 for stage in self.STAGES}
+        self._busy_seconds = {stage: 0.0 for stage in self.STAGES}
+
+    @property
+    def thread_pool(self):
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix='face-pipeline')
+        return self._thread_pool
+
+    @property
+    def process_pool(self):
+        if self._process_pool is None:
+            self._process_pool = ProcessPoolExecutor(self.max_workers)
+        return self._process_pool
+
+    @asynccontextmanager
+    async def stage(self, name):
+        """
+        Account for time spent in a stage whose work is awaited elsewhere,
+        e.g. the shared detection scheduler.
+        """
+        self._depth[name] += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._depth[name] -= 1
+            self._completed[name] += 1
+            self._busy_seconds[name] += time.perf_counter() - start
+
+    async def run(self, stage, func, *args, stateless=False, **kwargs):
+        if stateless and self.kind == 'process':
+            executor = self.process_pool
+        else:
+            executor = self.thread_pool
+
+        loop = asyncio.get_running_loop()
+        async with self.stage(stage):
+            return await loop.run_in_executor(executor, partial(func, *args, **kwargs))
+
+    def queue_depths(self):
+        """
+        Number of items currently queued or running in each stage.
+        """
+        return dict(self._depth)
+
+    def stats(self):
+        return {
+            stage: {
+                'depth': self._depth[stage],
+                'completed': self._completed[stage],
+                'average_ms': self._busy_seconds[stage] * 1000 / self._completed[stage] if self._completed[stage] else 0.0,
+            }
+            for stage in self.STAGES
+        }
+
+    def shutdown(self, wait=False):
+        for pool in (self._thread_pool, self._process_pool):
+            if pool is not None:
+                pool.shutdown(wait=wait, cancel_futures=True)
+        self._thread_pool = self._process_pool = None
+
+
+# Stage pools are created on first use and shut down by camera.lifecycle
+pipeline_executor = PipelineExecutor(
+    kind=settings.FACE_PIPELINE_EXECUTOR,
+    max_workers=settings.FACE_PIPELINE_WORKERS,
+)
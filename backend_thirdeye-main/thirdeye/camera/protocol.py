@@ -0,0 +1,106 @@
+# camera/protocol.py
+import json
+import time
+import base64
+import struct
+
+try:
+    import msgpack
+except ImportError:  # Binary frames then carry JSON headers
+    msgpack = None
+
+# Wire formats of a camera WebSocket, picked by the client with
+# ?protocol=binary|text when connecting:
+#
+#   text    one JSON text message per frame, the JPEG and face crops
+#           base64-encoded in it (the original protocol, the default)
+#   binary  one binary message per frame:
+#             uint32 big-endian header length
+#             header (msgpack, or UTF-8 JSON without msgpack)
+#             frame JPEG, then each face crop's JPEG, back to back
+#           The header gives the frame sequence number, capture time
+#           (epoch milliseconds), the byte sizes of the frame and of each
+#           crop, the staged faces and the tracks in view.
+#
+# In both, `profile` names the encoding profile the frame was sent at
+# (FACE_STREAM_PROFILES); frames sent at a reduced resolution must be
+# scaled back up to the camera's for track boxes to line up.
+#
+# With ?mode=metadata (and optionally &rate=<updates per second>) no video
+# is sent: each message only carries the header fields above, without
+# frame or crops, as a JSON text message or a length-prefixed binary one.
+TEXT, BINARY = 'text', 'binary'
+PROTOCOLS = (TEXT, BINARY)
+VIDEO, METADATA = 'video', 'metadata'
+MODES = (VIDEO, METADATA)
+HEADER_LENGTH = struct.Struct('>I')
+
+
+def header_encoding():
+    return 'msgpack' if msgpack is not None else 'json'
+
+
+def pack_header(message):
+    if msgpack is not None:
+        return msgpack.packb(message, default=float)
+    return json.dumps(message, separators=(',', ':'), default=float).encode('utf-8')
+
+
+def epoch_ms(captured_at):
+    # captured_at is on the time.monotonic clock
+    return round((time.time() - (time.monotonic() - captured_at)) * 1000)
+
+
+def encode_text(update):
+    detected_faces = [
+        {**face, 'image_data': base64.b64encode(face['image_data']).decode('utf-8')}
+        if face.get('image_data') is not None else face
+        for face in update.detected_faces
+    ]
+    return json.dumps({
+        'frame': base64.b64encode(update.jpeg).decode('utf-8'),
+        'profile': update.profile,
+        'detected_faces': detected_faces,
+        'tracks': update.tracks,
+    })
+
+
+def encode_binary(update):
+    crops, faces = [], []
+    for face in update.detected_faces:
+        face = dict(face)
+        image = face.pop('image_data', None) or b''
+        face['image_size'] = len(image)
+        crops.append(image)
+        faces.append(face)
+
+    header = {
+        'seq': update.index,
+        'timestamp': epoch_ms(update.captured_at),
+        'frame_size': len(update.jpeg),
+        'profile': update.profile,
+        'detected_faces': faces,
+        'tracks': update.tracks,
+    }
+    header = pack_header(header)
+    return b''.join([HEADER_LENGTH.pack(len(header)), header, update.jpeg, *crops])
+
+
+def encode_metadata(update, binary=False):
+    """
+    The timestamped tracks and new-face events of an update, without any
+    image data.
+    """
+    message = {
+        'seq': update.index,
+        'timestamp': epoch_ms(update.captured_at),
+        'detected_faces': [
+            {key: value for key, value in face.items() if key != 'image_data'}
+            for face in update.detected_faces
+        ],
+        'tracks': update.tracks,
+    }
+    if not binary:
+        return json.dumps(message, default=float)
+    header = pack_header(message)
+    return HEADER_LENGTH.pack(len(header)) + header
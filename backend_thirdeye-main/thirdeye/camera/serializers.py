@@ -69,17 +69,17 @@ class SelectedFaceSerializer(serializers.ModelSerializer):
 class StaticCameraSerializer(serializers.ModelSerializer):
     class Meta:
         model = StaticCamera
-        fields = ['ip_address', 'username', 'password', 'name']
+        fields = ['ip_address', 'username', 'password', 'name', 'detection_channel']
 
 class DDNSCameraSerializer(serializers.ModelSerializer):
     class Meta:
         model = DDNSCamera
-        fields = ['ddns_hostname', 'username', 'password', 'name']
+        fields = ['ddns_hostname', 'username', 'password', 'name', 'detection_channel']
 
 class CameraStreamSerializer(serializers.ModelSerializer):
     class Meta:
         model = CameraStream
-        fields = ['stream_url']
+        fields = ['stream_url', 'tracker_type']
 
 class FaceAnalyticsSerializer(serializers.ModelSerializer):
     class Meta:
@@ -0,0 +1,374 @@
+# camera/stream_hub.py
+import time
+import asyncio
+import logging
+from collections import namedtuple
+from django.conf import settings
+from asgiref.sync import sync_to_async
+from .models import CameraStream
+from .face_recognition_module import FaceRecognitionProcessor
+from .pipeline import pipeline_executor
+from .output_stage import OutputStage, parse_profiles
+from .capture import FrameGrabber
+from .frame_scheduler import FrameScheduler, DETECT, TRACK, DISPLAY, SKIP
+from .motion import MotionGate
+
+logger = logging.getLogger(__name__)
+
+# How long to wait for the main stream's frame when cutting face crops
+MAIN_FRAME_TIMEOUT = 1.0
+
+# One processed frame of a stream: the scheduler's action for it, the
+# JPEG-encoded image and the name of the encoding profile it was encoded
+# at (None when the viewer does not want video), the faces first staged on
+# it and the boxes of every track in view
+StreamUpdate = namedtuple('StreamUpdate', ['index', 'captured_at', 'action', 'jpeg', 'profile', 'detected_faces', 'tracks'])
+
+
+class Subscription:
+    """
+    One viewer's queue of StreamUpdates. When a viewer falls behind, its
+    oldest queued updates are dropped so it catches up instead of lagging.
+    None is queued once the stream has ended; `session.error` says why.
+
+    Viewers that decode the camera's video themselves subscribe without
+    `frames`: they only get the updates of frames whose tracks were
+    refreshed (detected or moved), at most `rate` a second, except that
+    updates announcing new faces, or the first with no faces in view,
+    always go through.
+
+    Viewers of video are sent the frame at the profile their `quality`
+    picks: a viewer whose queue backs up is moved to a lower resolution or
+    quality until it keeps up again.
+    """
+
+    def __init__(self, session, max_pending, frames=True, rate=None, quality=None):
+        self.session = session
+        self.frames = frames
+        self.quality = quality
+        self.interval = 1.0 / rate if rate else 0.0
+        self.queue = asyncio.Queue(maxsize=max_pending)
+        self.updates_dropped = 0
+        self._last_put = None
+        self._had_tracks = False
+
+    def wants(self, update):
+        if update is None or self.frames or update.detected_faces:
+            return True
+        if update.action not in (DETECT, TRACK):
+            return False
+        if bool(update.tracks) != self._had_tracks:
+            return True
+        return self._last_put is None or update.captured_at - self._last_put >= self.interval
+
+    @property
+    def level(self):
+        return self.quality.level if self.quality is not None else 0
+
+    def put(self, update, encoded=None):
+        if not self.wants(update):
+            return
+        backlog = self.queue.full()
+        if self.quality is not None:
+            if backlog:
+                self.quality.backlog()
+            else:
+                self.quality.caught_up()
+        if update is not None:
+            self._last_put = update.captured_at
+            self._had_tracks = bool(update.tracks)
+            if self.frames and encoded:
+                # The level may have just changed: fall back to the closest one encoded
+                level = min(encoded, key=lambda level: abs(level - self.level))
+                update = update._replace(jpeg=encoded[level], profile=self.session.output.profiles[level].name)
+        if backlog:
+            self.queue.get_nowait()
+            self.updates_dropped += 1
+        self.queue.put_nowait(update)
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class StreamSession:
+    """
+    The capture, frame scheduler, motion gate and FaceRecognitionProcessor
+    of one CameraStream, run once however many viewers watch it. Each
+    processed frame is encoded once per encoding profile its viewers are
+    sent and published to every subscriber.
+
+    Cameras with a detection substream are captured twice: the substream
+    is detected, tracked and shown, and the main stream is only read into
+    a frame when face crops are cut from it. That frame is newer than the
+    substream one, so faces are detected again around their mapped boxes
+    before being cropped (see FaceRecognitionProcessor.locate_faces).
+
+    When the last viewer leaves, the session lingers for `grace` seconds so
+    a reconnecting viewer finds the tracker, its buffered faces and the
+    open capture as they were.
+    """
+
+    def __init__(self, hub, stream_id, grace, max_pending):
+        self.hub = hub
+        self.stream_id = stream_id
+        self.grace = grace
+        self.max_pending = max_pending
+        self.subscribers = set()
+        self.output = OutputStage(parse_profiles(settings.FACE_STREAM_PROFILES))
+        self.error = None
+        self.face_processor = None
+        self.grabber = None
+        self.main_grabber = None
+        self.frame_count = 0
+        self.updates_published = 0
+        self._task = None
+        self._linger = None
+        self._closed = False
+
+    @property
+    def closed(self):
+        return self._closed
+
+    async def open(self):
+        """
+        Look up the stream and build its processor. The processor belongs to
+        the stream's owner, whoever is watching.
+        """
+        stream = await sync_to_async(CameraStream.objects.select_related('user', 'camera', 'ddns_camera').get)(id=self.stream_id)
+        self.stream_url = stream.stream_url
+        # Read from the camera each time, so a changed detection channel applies on the next open
+        self.detection_url = detection_url(stream)
+        self.camera_name = camera_name(stream)
+        self.face_processor = FaceRecognitionProcessor(
+            user=stream.user,
+            camera_name=self.camera_name,
+            tracker_type=stream.tracker_type,
+            crop_source=self.main_frame if self.detection_url else None,
+        )
+        self._task = asyncio.get_running_loop().create_task(self.run())
+        logger.info(f"Stream session {self.stream_id} opened for camera {self.camera_name}")
+
+    def subscribe(self, frames=True, rate=None):
+        if self._linger is not None:
+            self._linger.cancel()
+            self._linger = None
+            logger.info(f"Stream session {self.stream_id} resumed within its grace period")
+        quality = None
+        if frames:
+            quality = self.output.adaptive_quality(upgrade_after=settings.FACE_STREAM_UPGRADE_SECONDS)
+        subscription = Subscription(self, self.max_pending, frames=frames, rate=rate, quality=quality)
+        self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscribers.discard(subscription)
+        if not self.subscribers and not self._closed and self._linger is None:
+            self._linger = asyncio.get_running_loop().call_later(
+                self.grace, lambda: asyncio.ensure_future(self.close())
+            )
+
+    async def main_frame(self):
+        """
+        The main stream's next full-resolution frame, or None.
+        """
+        if self.main_grabber is None:
+            return None
+        frame = await self.main_grabber.request(timeout=MAIN_FRAME_TIMEOUT)
+        return None if frame is None else frame.image
+
+    def publish(self, update, encoded=None):
+        for subscription in self.subscribers:
+            subscription.put(update, encoded)
+        self.updates_published += 1
+
+    async def run(self):
+        # Decides per frame between detection, tracking, display only and skipping
+        self.scheduler = FrameScheduler(
+            target_latency=settings.FACE_STREAM_TARGET_LATENCY_MS / 1000,
+            detection_fps=settings.FACE_STREAM_DETECTION_FPS,
+            keyframe_interval=settings.FACE_KEYFRAME_INTERVAL,
+        )
+        self.motion_gate = MotionGate(min_area=settings.FACE_MOTION_MIN_AREA, enabled=settings.FACE_MOTION_GATE)
+        last_log_time = time.monotonic()
+
+        try:
+            # Frames are decoded on their own thread; we always get the newest one
+            if self.detection_url:
+                self.grabber = FrameGrabber(self.detection_url, name=f'capture-{self.stream_id}')
+                self.main_grabber = FrameGrabber(self.stream_url, name=f'capture-{self.stream_id}-main', on_demand=True)
+                self.main_grabber.start()
+            else:
+                self.grabber = FrameGrabber(self.stream_url, name=f'capture-{self.stream_id}')
+            self.grabber.start()
+
+            while not self._closed:
+                async with pipeline_executor.stage('capture'):
+                    frame = await self.grabber.next_frame(timeout=1.0)
+                if frame is None:
+                    continue
+
+                self.frame_count += 1
+                # Between keyframes, tracks in view are moved by optical flow
+                tracks = len(self.face_processor.shadow_tracks) if settings.FACE_KEYFRAME_TRACKING else 0
+                action = self.scheduler.decide(frame.captured_at, tracks=tracks, motion=self.motion_gate.motion_area)
+                if action == SKIP:
+                    continue
+
+                # Static scene with nobody in view: no need to run the detector
+                if action == DETECT and not await pipeline_executor.run(
+                    'motion', self.motion_gate.should_detect, frame.image,
+                    active_tracks=self.face_processor.has_active_tracks(),
+                    detect_seconds=self.scheduler.cost[DETECT],
+                ):
+                    action = DISPLAY
+
+                processed_frame, detected_faces, tracks = frame.image, [], []
+                start = time.perf_counter()
+                if action == DETECT:
+                    processed_frame, detected_faces = await self.face_processor.process_frame(frame.image)
+                    tracks = self.face_processor.visible_tracks()
+                    self.scheduler.record(DETECT, time.perf_counter() - start)
+                elif action == TRACK:
+                    tracks = await self.face_processor.track_frame(frame.image)
+                    self.scheduler.record(TRACK, time.perf_counter() - start)
+
+                # Encoded once per profile viewers are sent, and not at all if they only want metadata
+                start = time.perf_counter()
+                levels = {subscription.level for subscription in self.subscribers if subscription.frames}
+                encoded = await self.output.encode(processed_frame, levels)
+                self.publish(StreamUpdate(frame.index, frame.captured_at, action, None, None, detected_faces, tracks), encoded)
+                self.scheduler.record(DISPLAY, time.perf_counter() - start)
+                self.scheduler.record_latency(frame.captured_at)
+
+                if self.frame_count % 30 == 0:
+                    now = time.monotonic()
+                    logger.info(
+                        f'Stream {self.stream_id}: FPS: {30 / (now - last_log_time):.2f}, viewers: {len(self.subscribers)}, '
+                        f'capture: {self.grabber.stats()}, '
+                        f'main capture: {self.main_grabber.stats() if self.main_grabber is not None else None}, scheduler: {self.scheduler.stats()}, motion: {self.motion_gate.stats()}, '
+                        f'output: {self.output.stats()}, '
+                        f'pipeline queue depth: {pipeline_executor.queue_depths()}'
+                    )
+                    last_log_time = now
+
+        except asyncio.CancelledError:
+            logger.info(f'Stream session {self.stream_id} was cancelled')
+        except Exception as e:
+            logger.error(f'Error in stream session {self.stream_id}: {str(e)}', exc_info=True)
+            self.error = str(e)
+        finally:
+            # Joining a capture thread blocks (up to STOP_TIMEOUT on a dead
+            # camera), so it happens on the executor, not the event loop
+            await asyncio.gather(*(
+                pipeline_executor.run('capture', grabber.stop)
+                for grabber in (self.grabber, self.main_grabber)
+                if grabber is not None
+            ), return_exceptions=True)
+            if not self._closed:
+                asyncio.ensure_future(self.close())
+
+    async def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self.hub.remove(self)
+        if self._linger is not None:
+            self._linger.cancel()
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+            # Wait for run() to stop its grabbers
+            await asyncio.gather(self._task, return_exceptions=True)
+
+        # Tell viewers the stream has ended
+        for subscription in self.subscribers:
+            subscription.put(None)
+
+        # Consolidate the faces still staged for tracks that were in view
+        if self.face_processor is not None:
+            await self.face_processor.flush()
+        logger.info(f"Stream session {self.stream_id} closed after {self.frame_count} frames")
+
+    def stats(self):
+        return {
+            'viewers': len(self.subscribers),
+            'frames': self.frame_count,
+            'updates_published': self.updates_published,
+            'updates_dropped': sum(subscription.updates_dropped for subscription in self.subscribers),
+            'viewer_profiles': [
+                self.output.profiles[subscription.level].name for subscription in self.subscribers if subscription.frames
+            ],
+            'output': self.output.stats(),
+            'lingering': self._linger is not None,
+        }
+
+
+class StreamHub:
+    """
+    Per-worker registry of StreamSessions keyed by CameraStream id, so every
+    viewer of a camera shares one capture and one pipeline.
+    """
+
+    def __init__(self, grace, max_pending):
+        self.grace = grace
+        self.max_pending = max_pending
+        self._sessions = {}
+        self._opening = {}
+
+    async def subscribe(self, stream_id, frames=True, rate=None):
+        """
+        Subscribe to a stream, opening its session if nobody is watching it.
+        Viewers arriving while a stream is being opened wait for that same
+        open; other streams are not held up by it.
+        """
+        stream_id = int(stream_id)
+        session = self._sessions.get(stream_id)
+        if session is None or session.closed:
+            opening = self._opening.get(stream_id)
+            if opening is None:
+                opening = self._opening[stream_id] = asyncio.ensure_future(self._open(stream_id))
+                opening.add_done_callback(lambda _: self._opening.pop(stream_id, None))
+            # A viewer that disconnects mid-open must not cancel it for the rest
+            session = await asyncio.shield(opening)
+        return session.subscribe(frames=frames, rate=rate)
+
+    async def _open(self, stream_id):
+        session = StreamSession(self, stream_id, self.grace, self.max_pending)
+        await session.open()
+        self._sessions[stream_id] = session
+        return session
+
+    def unsubscribe(self, subscription):
+        subscription.session.unsubscribe(subscription)
+
+    def remove(self, session):
+        if self._sessions.get(session.stream_id) is session:
+            del self._sessions[session.stream_id]
+
+    def get(self, stream_id):
+        return self._sessions.get(int(stream_id))
+
+    async def close_all(self):
+        await asyncio.gather(*(session.close() for session in list(self._sessions.values())), return_exceptions=True)
+
+    def stats(self):
+        return {stream_id: session.stats() for stream_id, session in self._sessions.items()}
+
+
+def detection_url(stream):
+    camera = stream.camera or stream.ddns_camera
+    return camera.detection_rtsp_url() if camera is not None else None
+
+
+def camera_name(stream):
+    if stream.camera is not None:
+        return stream.camera.name
+    if stream.ddns_camera is not None:
+        return stream.ddns_camera.name
+    return "Unknown Camera"
+
+
+# Sessions are only shared within a worker; each worker opens its own captures
+stream_hub = StreamHub(
+    grace=settings.FACE_STREAM_GRACE_SECONDS,
+    max_pending=settings.FACE_STREAM_VIEWER_QUEUE,
+)
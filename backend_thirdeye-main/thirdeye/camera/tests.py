@@ -1,3 +1,637 @@
-from django.test import TestCase
+from collections import namedtuple
+from datetime import date
+from types import SimpleNamespace
+from unittest import mock
+import json
+import tempfile
 
-# Create your tests here.
+import cv2
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from .ann_index import ExactIndex, IVFIndex, index_path
+from .consolidation import ConsolidationService
+from .detectors import NUM_LANDMARKS, PAD_VALUE, decode_yolo, letterbox
+from .embedders import ALIGNED_LANDMARKS, ALIGNED_SIZE, DlibEmbedder, align_face, face_location
+from .embeddings import pack_embedding, unpack_embedding, unpack_embeddings
+from .face_index import FaceGallery, FaceGalleryRegistry
+from .face_quality import FaceQualityEngine, score_face_crops
+from .frame_scheduler import FrameScheduler, DETECT, TRACK, DISPLAY, SKIP
+from .models import FaceVisit, NotificationLog, SelectedFace
+from .output_stage import EncodingProfile, parse_profiles
+from .persistence import (
+    CREATE, CREATE_VISIT, SELECTED_FACE_FIELDS, UPSERT_SELECTED_FACE, WRITE_RETRIES,
+    SelectedFaceKey, WriteBehindQueue,
+)
+from .protocol import HEADER_LENGTH, encode_binary, msgpack
+from .track_buffer import FaceCandidate, TrackBuffer
+from .trackers import ByteTracker
+
+
+class IndexTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        centres = rng.standard_normal((32, 16)).astype(np.float32) * 4
+        self.vectors = (centres[rng.integers(0, 32, 4000)] + rng.standard_normal((4000, 16))).astype(np.float32)
+        self.queries = self.vectors[rng.integers(0, 4000, 100)] + 0.1 * rng.standard_normal((100, 16)).astype(np.float32)
+
+    def build(self, index):
+        for vector_id, vector in enumerate(self.vectors):
+            index.add(vector_id, vector)
+        return index
+
+    def test_exact_search(self):
+        index = self.build(ExactIndex(16))
+        ids, distances = index.search(self.vectors[7], k=3)
+        self.assertEqual(ids[0], 7)
+        self.assertAlmostEqual(float(distances[0]), 0.0, places=3)
+        self.assertTrue(np.all(np.diff(distances) >= 0))
+
+        index.remove(7)
+        self.assertNotIn(7, index)
+        self.assertNotIn(7, index.search(self.vectors[7], k=3)[0])
+        self.assertEqual(len(index), len(self.vectors) - 1)
+
+    def test_ivf_recall(self):
+        exact = self.build(ExactIndex(16))
+        ivf = self.build(IVFIndex(16, nprobe=8, min_train_size=1000))
+        self.assertTrue(ivf.is_trained)
+
+        hits = sum(
+            set(ivf.search(query, k=5)[0].tolist()) == set(exact.search(query, k=5)[0].tolist())
+            for query in self.queries
+        )
+        self.assertGreaterEqual(hits / len(self.queries), 0.9)
+
+    def test_ivf_untrained_is_exact(self):
+        exact = self.build(ExactIndex(16))
+        ivf = self.build(IVFIndex(16, min_train_size=10000))
+        self.assertFalse(ivf.is_trained)
+        for query in self.queries[:10]:
+            np.testing.assert_array_equal(ivf.search(query, k=5)[0], exact.search(query, k=5)[0])
+
+    def test_ivf_manual_training(self):
+        ivf = self.build(IVFIndex(16, min_train_size=1000, auto_train=False))
+        self.assertFalse(ivf.is_trained)
+        self.assertTrue(ivf.needs_training)
+
+        ivf.train(IVFIndex.fit(ivf.vectors()[1]))
+        self.assertTrue(ivf.is_trained)
+        self.assertFalse(ivf.needs_training)
+        self.assertEqual(len(ivf), len(self.vectors))
+        self.assertEqual(ivf.search(self.vectors[42], k=1)[0][0], 42)
+
+
+class EmbeddingPackingTests(SimpleTestCase):
+    def setUp(self):
+        self.vector = np.random.default_rng(0).standard_normal(128).astype(np.float32)
+
+    def test_float32_round_trip(self):
+        data = pack_embedding(self.vector, 'float32')
+        np.testing.assert_array_equal(unpack_embedding(data), self.vector)
+
+    def test_int8_round_trip(self):
+        data = pack_embedding(self.vector, 'int8')
+        self.assertLess(len(data), len(pack_embedding(self.vector, 'float32')) / 3)
+        scale = np.abs(self.vector).max() / 127
+        np.testing.assert_allclose(unpack_embedding(data), self.vector, atol=scale)
+
+    def test_legacy_json(self):
+        text = json.dumps(self.vector.tolist())
+        np.testing.assert_allclose(unpack_embedding(text), self.vector)
+        np.testing.assert_allclose(unpack_embedding(text.encode('utf-8')), self.vector)
+        np.testing.assert_allclose(unpack_embedding(self.vector.tolist()), self.vector)
+
+    def test_memoryview(self):
+        data = memoryview(pack_embedding(self.vector, 'float32'))
+        np.testing.assert_array_equal(unpack_embedding(data), self.vector)
+        np.testing.assert_array_equal(unpack_embeddings([data, data], 128), np.stack([self.vector] * 2))
+
+    def test_none(self):
+        self.assertIsNone(unpack_embedding(None))
+
+    def test_unknown_storage(self):
+        with self.assertRaises(ValueError):
+            pack_embedding(self.vector, 'float64')
+
+    def test_model_accessors(self):
+        face = SelectedFace(face_id='unknown_001')
+        face.set_embedding(self.vector, 'float32')
+        vector = face.embedding_vector
+        np.testing.assert_array_equal(vector, self.vector)
+        # A read-only view over the column's bytes, not a copy
+        self.assertFalse(vector.flags.owndata)
+        self.assertFalse(vector.flags.writeable)
+
+        face.set_embedding(self.vector, 'int8')
+        self.assertEqual(len(face.embedding), 4 + 4 + 128)
+        face.embedding = None
+        self.assertIsNone(face.embedding_vector)
+
+    def test_unpack_many(self):
+        other = -self.vector
+        rows = [pack_embedding(self.vector), None, pack_embedding(other)]
+        np.testing.assert_array_equal(unpack_embeddings(rows, 128), np.stack([self.vector, other]))
+
+        # Mixed storage types fall back to decoding row by row
+        rows = [pack_embedding(self.vector), pack_embedding(other, 'int8'), json.dumps(self.vector.tolist()).encode('utf-8')]
+        matrix = unpack_embeddings(rows, 128)
+        self.assertEqual(matrix.shape, (3, 128))
+        np.testing.assert_allclose(matrix[1], other, atol=np.abs(other).max() / 127)
+        self.assertEqual(unpack_embeddings([], 128).shape, (0, 128))
+
+
+@override_settings(FACE_EMBEDDER_BACKEND='dlib', FACE_INDEX_DIR='')
+class FaceGalleryLoadTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('owner', 'owner@example.com', 'password')
+        cls.vectors = np.random.default_rng(0).standard_normal((300, 128)).astype(np.float32)
+        SelectedFace.objects.bulk_create([
+            SelectedFace(user=cls.user, face_id=f'unknown_{i:03d}', embedding=pack_embedding(vector), embedding_model=DlibEmbedder.spec.model_id)
+            for i, vector in enumerate(cls.vectors)
+        ])
+
+    def test_load(self):
+        for backend in ('exact', 'ivf'):
+            with self.subTest(backend=backend):
+                gallery = FaceGalleryRegistry(ttl=60, backend=backend).load(self.user.id)
+                self.assertEqual(len(gallery), len(self.vectors))
+                self.assertEqual(gallery.match(self.vectors[7]).face_id, 'unknown_007')
+
+    def test_load_into_trained_index(self):
+        with tempfile.TemporaryDirectory() as directory, self.settings(FACE_INDEX_DIR=directory):
+            index = IVFIndex(128)
+            index.train(IVFIndex.fit(self.vectors))
+            index.save_quantizer(index_path(directory, self.user.id))
+
+            gallery = FaceGalleryRegistry(ttl=60, backend='ivf').load(self.user.id)
+        self.assertTrue(gallery.index.is_trained)
+        self.assertEqual(len(gallery.index), len(self.vectors))
+        self.assertEqual(gallery.match(self.vectors[42]).face_id, 'unknown_042')
+
+    def test_load_mixed_rows(self):
+        # A legacy JSON row and one of another dimension force row-by-row decoding
+        SelectedFace.objects.filter(face_id='unknown_003').update(embedding=json.dumps(self.vectors[3].tolist()).encode('utf-8'))
+        SelectedFace.objects.create(user=self.user, face_id='other', embedding=pack_embedding(np.ones(64)), embedding_model=DlibEmbedder.spec.model_id)
+        with self.assertLogs('camera.face_index', 'WARNING'):
+            gallery = FaceGalleryRegistry(ttl=60, backend='exact').load(self.user.id)
+        self.assertEqual(len(gallery), len(self.vectors))
+        self.assertEqual(gallery.match(self.vectors[3]).face_id, 'unknown_003')
+
+    def test_add_many_matches_upserts(self):
+        keys = [(f'unknown_{i % 250:03d}', date.today()) for i in range(len(self.vectors))]
+        batched, upserted = FaceGallery(1, ExactIndex(128)), FaceGallery(1, ExactIndex(128))
+        batched.add_many(keys, self.vectors)
+        for key, vector in zip(keys, self.vectors):
+            upserted.upsert(*key, vector)
+
+        self.assertEqual(len(batched), 250)
+        self.assertEqual(len(batched.index), 250)
+        for vector in self.vectors[::10]:
+            expected, found = upserted.match(vector), batched.match(vector)
+            self.assertEqual(found.face_id, expected.face_id)
+            self.assertAlmostEqual(found.distance, expected.distance, delta=0.01)
+
+
+def face_landmarks(yaw_offset=0.0, roll=0.0, mouth=True):
+    # Frontal layout: eyes 32px apart, nose where a frontal face puts it
+    points = np.array([[-16, 0], [16, 0], [yaw_offset, 0.55 * 32], [-12, 32], [12, 32]], dtype=np.float32)
+    if not mouth:
+        points[2, 1] = 0.85 * 32
+        points[3:] = np.nan
+    angle = np.radians(roll)
+    rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]], dtype=np.float32)
+    return points @ rotation.T + np.array([56, 50], dtype=np.float32)
+
+
+class FaceQualityTests(SimpleTestCase):
+    def setUp(self):
+        self.engine = FaceQualityEngine()
+        rng = np.random.default_rng(0)
+        self.sharp = rng.integers(0, 255, (112, 112, 3), dtype=np.uint8)
+        self.blurred = cv2.GaussianBlur(self.sharp, (15, 15), 5)
+
+    def test_frontal_pose(self):
+        yaw, pitch = self.engine.estimate_pose([face_landmarks(), face_landmarks(mouth=False)])
+        np.testing.assert_allclose(yaw, 0.0, atol=1e-3)
+        np.testing.assert_allclose(pitch, 0.0, atol=1e-3)
+
+    def test_yaw(self):
+        yaw, _ = self.engine.estimate_pose([face_landmarks(yaw_offset=8), face_landmarks(yaw_offset=-8)])
+        np.testing.assert_allclose(yaw, [30.0, -30.0], atol=1e-3)
+
+    def test_roll_is_removed(self):
+        level = self.engine.estimate_pose(face_landmarks(yaw_offset=8))
+        rolled = self.engine.estimate_pose(face_landmarks(yaw_offset=8, roll=25))
+        np.testing.assert_allclose(rolled, level, atol=1e-3)
+
+    def test_sharpness(self):
+        sharp, blurred = self.engine.sharpness([self.sharp, self.blurred])
+        self.assertGreater(sharp, 10 * blurred)
+
+    def test_score_batch(self):
+        frontal, turned = face_landmarks(), face_landmarks(yaw_offset=14)
+        scores = self.engine.score_batch(
+            [self.sharp, self.blurred, self.sharp],
+            [frontal, frontal, turned],
+            [(0, 0, 112, 112), (0, 0, 112, 112), (0, 0, 56, 56)],
+        )
+        np.testing.assert_allclose(scores['size_score'], [1.0, 1.0, 0.5])
+        quality = scores['quality_score']
+        self.assertGreater(quality[0], quality[1])
+        self.assertGreater(quality[0], quality[2])
+        self.assertTrue(np.all((quality >= 0) & (quality <= 1)))
+
+    def test_score_face_crops(self):
+        scores = score_face_crops([self.sharp, self.blurred], [face_landmarks()] * 2, [(0, 0, 112, 112)] * 2)
+        self.assertEqual(set(scores[0]), {'blur_score', 'pose_score', 'size_score', 'quality_score'})
+        single = self.engine.score(self.sharp, face_landmarks(), (0, 0, 112, 112))
+        for name, value in scores[0].items():
+            self.assertAlmostEqual(value, single[name], places=4)
+
+
+def candidate(quality_score, face_id='unknown_001'):
+    return FaceCandidate(None, face_id, b'', b'', None, quality_score, 0.0, 0.0, 0.0)
+
+
+class TrackBufferTests(SimpleTestCase):
+    def test_keeps_best_candidates(self):
+        buffer = TrackBuffer(max_candidates=3, max_age=10)
+        for quality in (0.5, 0.2, 0.9, 0.7):
+            buffer.add(1, candidate(quality))
+
+        self.assertEqual([c.quality_score for c in buffer.flush(1)], [0.9, 0.7, 0.5])
+        self.assertNotIn(1, buffer)
+        self.assertEqual(buffer.flush(1), [])
+
+    def test_add_returns_evicted(self):
+        buffer = TrackBuffer(max_candidates=2, max_age=10)
+        self.assertIsNone(buffer.add(1, candidate(0.5)))
+        self.assertIsNone(buffer.add(1, candidate(0.6)))
+        self.assertEqual(buffer.add(1, candidate(0.8)).quality_score, 0.5)
+        self.assertEqual(buffer.add(1, candidate(0.1)).quality_score, 0.1)
+        self.assertEqual(buffer.stats()['candidates_evicted'], 2)
+
+    def test_accepts(self):
+        buffer = TrackBuffer(max_candidates=2, max_age=10)
+        self.assertTrue(buffer.accepts(1, 0.0))
+        buffer.add(1, candidate(0.5))
+        buffer.add(1, candidate(0.6))
+        self.assertFalse(buffer.accepts(1, 0.4))
+        self.assertTrue(buffer.accepts(1, 0.55))
+
+    def test_expired(self):
+        buffer = TrackBuffer(max_candidates=2, max_age=10)
+        buffer.add(1, candidate(0.5))
+        opened_at = buffer.open(1, 'unknown_001').opened_at
+        self.assertEqual(buffer.expired(opened_at + 5), [])
+        self.assertEqual(buffer.expired(opened_at + 10), [1])
+
+
+class FakeProcessor:
+    def __init__(self, user_id, camera_name, fail=False):
+        self.user = SimpleNamespace(id=user_id)
+        self.camera_name = camera_name
+        self.fail = fail
+        self.consolidated = []
+
+    async def consolidate_candidates(self, candidates):
+        if self.fail:
+            raise RuntimeError('consolidation failed')
+        self.consolidated.append(candidates)
+        return candidates[0]
+
+
+@override_settings(FACE_TRACK_BUFFER_DURABLE=False)
+class ConsolidationServiceTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch('camera.consolidation.face_galleries')
+        self.face_galleries = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def run_jobs(self, service, jobs):
+        futures = [service.submit(processor, candidates) for processor, candidates in jobs]
+        await service.drain()
+        service._task.cancel()
+        return futures
+
+    async def test_batches_jobs_and_loads_each_gallery_once(self):
+        service = ConsolidationService(max_latency=0.05, max_batch_size=10)
+        door, garage, other = FakeProcessor(1, 'door'), FakeProcessor(1, 'garage'), FakeProcessor(2, 'door')
+        futures = await self.run_jobs(service, [(door, ['a']), (other, ['b']), (door, ['c']), (garage, ['d'])])
+
+        self.assertEqual([future.result() for future in futures], ['a', 'b', 'c', 'd'])
+        self.assertEqual(door.consolidated, [['a'], ['c']])
+        self.assertEqual(service.batches_run, 1)
+        self.assertEqual(service.jobs_done, 4)
+        # Once per (user, camera) group
+        self.assertEqual(sorted(call.args for call in self.face_galleries.get.call_args_list), [(1,), (1,), (2,)])
+
+    async def test_batch_size(self):
+        service = ConsolidationService(max_latency=0.05, max_batch_size=2)
+        await self.run_jobs(service, [(FakeProcessor(1, 'door'), [i]) for i in range(5)])
+        self.assertEqual(service.batches_run, 3)
+        self.assertEqual(service.stats()['average_batch_size'], 5 / 3)
+
+    async def test_failure_only_affects_its_job(self):
+        service = ConsolidationService(max_latency=0.05, max_batch_size=10)
+        with self.assertLogs('camera.consolidation', 'ERROR'):
+            failing, working = await self.run_jobs(service, [(FakeProcessor(1, 'door', fail=True), ['a']), (FakeProcessor(1, 'door'), ['b'])])
+
+        with self.assertRaises(RuntimeError):
+            failing.result()
+        self.assertEqual(working.result(), 'b')
+        self.assertEqual(service.pending(), 0)
+
+
+class WriteBehindQueueTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('viewer', 'viewer@example.com', 'password')
+
+    def key(self, face_id='unknown_001'):
+        return SelectedFaceKey(self.user.id, face_id, date.today())
+
+    def upsert(self, face_id='unknown_001', quality_score=0.5):
+        fields = dict(zip(SELECTED_FACE_FIELDS, (b'jpeg', b'embedding', 'dlib', quality_score, timezone.now())))
+        return (UPSERT_SELECTED_FACE, (self.key(face_id), fields))
+
+    def visit(self, face_id='unknown_001'):
+        return (CREATE_VISIT, (self.key(face_id), b'visit', timezone.now()))
+
+    def notification(self, face_id, detected_time=None):
+        return (CREATE, NotificationLog(user=self.user, face_id=face_id, camera_name='door', detected_time=detected_time or timezone.now()))
+
+    async def test_batches(self):
+        queue = WriteBehindQueue(max_batch_size=3, max_delay=0.05, max_pending=100)
+        for i in range(7):
+            await queue.create(NotificationLog(user=self.user, face_id=f'unknown_{i:03d}', camera_name='door'))
+        await queue.drain()
+        queue._task.cancel()
+
+        self.assertEqual(queue.batches_run, 3)
+        self.assertEqual(queue.writes_done, 7)
+        self.assertEqual(await NotificationLog.objects.acount(), 7)
+
+    def test_upserts_applied_before_visits(self):
+        queue = WriteBehindQueue(max_batch_size=10, max_delay=0.05, max_pending=100)
+        # The visit is queued first but refers to a face created in the same batch
+        dropped = queue.write([self.visit(), self.upsert(quality_score=0.5), self.upsert(quality_score=0.8)])
+
+        self.assertEqual(dropped, 0)
+        face = SelectedFace.objects.get()
+        self.assertEqual(face.quality_score, 0.8)
+        self.assertEqual(face.face_visits.count(), 1)
+
+        queue.write([self.upsert(quality_score=0.9), self.visit()])
+        self.assertEqual(SelectedFace.objects.get().quality_score, 0.9)
+        self.assertEqual(FaceVisit.objects.count(), 2)
+
+    async def test_failing_batch_falls_back_to_single_writes(self):
+        queue = WriteBehindQueue(max_batch_size=10, max_delay=0.05, max_pending=100)
+        batch = [self.upsert(), self.visit(), self.notification('bad', detected_time='not a date'), self.notification('ok')]
+        with mock.patch('camera.persistence.RETRY_DELAY', 0), self.assertLogs('camera.persistence', 'WARNING') as logs:
+            await queue.flush(batch)
+
+        self.assertEqual(sum('attempt' in line for line in logs.output), WRITE_RETRIES + 1)
+        self.assertEqual((queue.batches_failed, queue.writes_done, queue.writes_failed), (1, 3, 1))
+        self.assertEqual(await FaceVisit.objects.acount(), 1)
+        self.assertEqual([face_id async for face_id in NotificationLog.objects.values_list('face_id', flat=True)], ['ok'])
+
+    async def test_visit_without_face_is_counted(self):
+        queue = WriteBehindQueue(max_batch_size=10, max_delay=0.05, max_pending=100)
+        with self.assertLogs('camera.persistence', 'ERROR'):
+            await queue.flush([self.upsert('unknown_001'), self.visit('unknown_001'), self.visit('unknown_002')])
+
+        self.assertEqual((queue.writes_done, queue.writes_failed), (2, 1))
+        self.assertEqual(await FaceVisit.objects.acount(), 1)
+
+
+class FrameSchedulerTests(SimpleTestCase):
+    def test_detects_at_detection_fps(self):
+        scheduler = FrameScheduler(target_latency=0.5, detection_fps=5)
+        actions = [scheduler.decide(captured_at=i / 25, now=i / 25) for i in range(25)]
+        self.assertEqual(actions.count(DETECT), 5)
+        self.assertEqual(actions[0], DETECT)
+
+    def test_tracks_between_keyframes(self):
+        scheduler = FrameScheduler(target_latency=0.5, detection_fps=5)
+        self.assertEqual(scheduler.decide(0.0, now=0.0, tracks=2), DETECT)
+        self.assertEqual(scheduler.decide(0.04, now=0.04, tracks=2), TRACK)
+        self.assertEqual(scheduler.decide(0.08, now=0.08), DISPLAY)
+
+    def test_skips_late_frames(self):
+        scheduler = FrameScheduler(target_latency=0.2, detection_fps=5)
+        scheduler.decide(0.0, now=0.0)
+        scheduler.record(DISPLAY, 0.05)
+        self.assertEqual(scheduler.decide(0.0, now=0.1), DISPLAY)
+        self.assertEqual(scheduler.decide(0.0, now=0.18), SKIP)
+
+    def test_fixed_keyframe_interval(self):
+        scheduler = FrameScheduler(target_latency=0.5, detection_fps=5, keyframe_interval=3)
+        actions = [scheduler.decide(i / 25, now=i / 25) for i in range(9)]
+        self.assertEqual([i for i, action in enumerate(actions) if action == DETECT], [2, 5, 8])
+
+    def test_calm_scene_stretches_interval(self):
+        scheduler = FrameScheduler(target_latency=0.5, detection_fps=5, max_stretch=3.0)
+        self.assertAlmostEqual(scheduler.detection_interval(), 0.2)
+        self.assertAlmostEqual(scheduler.detection_interval(tracks=1, motion=0.0), 0.6)
+        self.assertAlmostEqual(scheduler.detection_interval(tracks=1, motion=1.0), 0.2)
+
+    def test_detection_cost_bounds_interval(self):
+        scheduler = FrameScheduler(target_latency=0.5, detection_fps=5, detection_share=0.5)
+        scheduler.record(DETECT, 0.3)
+        self.assertAlmostEqual(scheduler.detection_interval(), 0.6)
+
+
+def detection(ltwh, confidence, feature=None):
+    from deep_sort_realtime.deep_sort.detection import Detection
+
+    return Detection(ltwh, confidence, np.ones(4, dtype=np.float32) if feature is None else feature)
+
+
+class ByteTrackerTests(SimpleTestCase):
+    def step(self, tracker, detections):
+        tracker.predict()
+        tracker.update(detections)
+
+    def confirm(self, tracker, feature=None):
+        # Tentative tracks are deleted on their first miss
+        for _ in range(tracker.n_init):
+            self.step(tracker, [detection([10, 10, 50, 50], 0.9, feature)])
+        self.assertTrue(tracker.tracks[0].is_confirmed())
+
+    def test_high_confidence_detections_start_and_follow_tracks(self):
+        tracker = ByteTracker(n_init=2)
+        self.step(tracker, [detection([10, 10, 50, 50], 0.9), detection([200, 10, 50, 50], 0.9)])
+        self.assertEqual(len(tracker.tracks), 2)
+
+        self.step(tracker, [detection([12, 10, 50, 50], 0.9), detection([202, 10, 50, 50], 0.9)])
+        self.assertEqual(sorted(track.track_id for track in tracker.tracks), ['1', '2'])
+        self.assertTrue(all(track.is_confirmed() for track in tracker.tracks))
+
+    def test_low_confidence_detection_keeps_track_alive(self):
+        tracker = ByteTracker(n_init=1)
+        self.step(tracker, [detection([10, 10, 50, 50], 0.9)])
+        self.step(tracker, [detection([11, 10, 50, 50], 0.3)])
+
+        track, = tracker.tracks
+        self.assertEqual(track.time_since_update, 0)
+        self.assertEqual(track.hits, 2)
+
+    def test_low_confidence_detection_does_not_start_track(self):
+        tracker = ByteTracker()
+        self.step(tracker, [detection([10, 10, 50, 50], 0.3)])
+        self.assertEqual(tracker.tracks, [])
+
+        # Nor is it matched loosely: it needs the stricter low-confidence IoU
+        self.confirm(tracker)
+        self.step(tracker, [detection([40, 40, 50, 50], 0.3)])
+        self.assertEqual(tracker.tracks[0].time_since_update, 1)
+
+    def test_lost_track_reattached_by_appearance(self):
+        feature = np.array([1, 0, 0, 0], dtype=np.float32)
+        tracker = ByteTracker(n_init=2, max_age=10)
+        self.confirm(tracker, feature)
+        self.step(tracker, [])
+        self.step(tracker, [])
+
+        # Reappears far from its predicted box with the same descriptor
+        self.step(tracker, [detection([400, 300, 50, 50], 0.9, feature)])
+        track, = tracker.tracks
+        self.assertEqual(track.track_id, '1')
+        self.assertEqual(track.time_since_update, 0)
+
+    def test_different_appearance_starts_new_track(self):
+        tracker = ByteTracker(n_init=2, max_age=10)
+        self.confirm(tracker, np.array([1, 0, 0, 0], dtype=np.float32))
+        self.step(tracker, [])
+        self.step(tracker, [])
+        self.step(tracker, [detection([400, 300, 50, 50], 0.9, np.array([0, 1, 0, 0], dtype=np.float32))])
+        self.assertEqual(sorted(track.track_id for track in tracker.tracks), ['1', '2'])
+
+
+def yolo_output(rows, anchors=100):
+    # (4 + 1 + 15, anchors) raw output from (cx, cy, w, h, score) rows, each
+    # with keypoints at the box centre; the other anchors score 0
+    output = np.zeros((20, anchors), dtype=np.float32)
+    for anchor, (cx, cy, w, h, score) in enumerate(rows):
+        output[:5, anchor] = cx, cy, w, h, score
+        output[5:, anchor] = np.tile([cx, cy, 1.0], NUM_LANDMARKS)
+    return output
+
+
+class DetectorDecodingTests(SimpleTestCase):
+    def test_letterbox(self):
+        canvas, scale, pad = letterbox(np.zeros((720, 1280, 3), dtype=np.uint8), 640)
+        self.assertEqual(canvas.shape, (640, 640, 3))
+        self.assertEqual((scale, pad), (0.5, (0, 140)))
+        self.assertEqual(canvas[0, 0, 0], PAD_VALUE)
+        self.assertEqual(canvas[320, 320, 0], 0)
+
+    def test_decode_yolo(self):
+        output = yolo_output([
+            (100, 240, 40, 40, 0.9),
+            (102, 242, 40, 40, 0.8),  # Overlaps the first: suppressed by NMS
+            (400, 300, 60, 80, 0.7),
+            (500, 500, 40, 40, 0.2),  # Below the confidence threshold
+        ])
+        detections = decode_yolo(output, confidence=0.5, scale=0.5, pad=(0, 140))
+
+        np.testing.assert_allclose(detections.scores, [0.9, 0.7])
+        # Boxes are mapped back out of the letterbox into frame pixels
+        np.testing.assert_allclose(detections.boxes, [[160, 160, 240, 240], [740, 240, 860, 400]])
+        self.assertEqual(detections.landmarks.shape, (2, NUM_LANDMARKS, 2))
+        np.testing.assert_allclose(detections.landmarks[0], np.tile([200, 200], (NUM_LANDMARKS, 1)))
+        np.testing.assert_allclose(detections.faces(), [[160, 160, 80, 80, 0.9], [740, 240, 120, 160, 0.7]], rtol=1e-6)
+
+    def test_decode_yolo_anchors_first(self):
+        output = yolo_output([(100, 240, 40, 40, 0.9), (400, 300, 60, 80, 0.7)])
+        np.testing.assert_allclose(
+            decode_yolo(output.T, 0.5, 1.0, (0, 0)).boxes, decode_yolo(output, 0.5, 1.0, (0, 0)).boxes
+        )
+
+    def test_decode_yolo_without_keypoints(self):
+        detections = decode_yolo(yolo_output([(100, 100, 40, 40, 0.9)])[:5], 0.5, 1.0, (0, 0))
+        self.assertIsNone(detections.landmarks)
+        np.testing.assert_allclose(detections.boxes, [[80, 80, 120, 120]])
+
+    def test_decode_yolo_nothing_found(self):
+        detections = decode_yolo(yolo_output([(100, 100, 40, 40, 0.2)]), 0.5, 1.0, (0, 0))
+        self.assertEqual(detections.boxes.shape, (0, 4))
+        self.assertEqual(detections.faces().shape, (0, 5))
+
+
+class FaceAlignmentTests(SimpleTestCase):
+    def test_align_to_template(self):
+        # Draw the template keypoints under a known similarity transform
+        angle, scale, offset = np.radians(20), 2.5, np.array([300, 150], dtype=np.float32)
+        rotation = scale * np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]], dtype=np.float32)
+        landmarks = ALIGNED_LANDMARKS @ rotation.T + offset
+        frame = np.zeros((600, 800, 3), dtype=np.uint8)
+        for x, y in landmarks:
+            cv2.circle(frame, (round(x), round(y)), 6, (255, 255, 255), -1)
+
+        aligned = align_face(frame, (0, 0, 800, 600), landmarks)
+        self.assertEqual(aligned.shape, (ALIGNED_SIZE, ALIGNED_SIZE, 3))
+        for x, y in ALIGNED_LANDMARKS:
+            self.assertGreater(aligned[round(y), round(x)].min(), 200)
+        self.assertEqual(aligned[5, 5].max(), 0)
+
+    def test_box_fallback(self):
+        frame = np.zeros((400, 400, 3), dtype=np.uint8)
+        frame[100:200, 150:250] = 255
+        aligned = align_face(frame, (150, 100, 250, 200))
+        self.assertEqual(aligned.shape, (ALIGNED_SIZE, ALIGNED_SIZE, 3))
+        self.assertGreater(aligned[2:-2, 2:-2].min(), 200)
+
+    def test_face_location(self):
+        self.assertEqual(face_location((-5, 10, 90, 500), (480, 640)), (10, 90, 480, 0))
+
+
+Update = namedtuple('Update', ['index', 'captured_at', 'jpeg', 'profile', 'detected_faces', 'tracks'])
+
+
+class BinaryProtocolTests(SimpleTestCase):
+    def test_encode_binary(self):
+        update = Update(
+            index=12,
+            captured_at=0.0,
+            jpeg=b'frame-jpeg',
+            profile='full',
+            detected_faces=[{'face_id': 'unknown_001', 'image_data': b'crop-1'}, {'face_id': 'unknown_002'}],
+            tracks=[{'track_id': '1', 'bbox': [1, 2, 3, 4]}],
+        )
+        message = encode_binary(update)
+
+        (length,) = HEADER_LENGTH.unpack_from(message)
+        raw = message[HEADER_LENGTH.size:HEADER_LENGTH.size + length]
+        header = msgpack.unpackb(raw) if msgpack is not None else json.loads(raw)
+        body = message[HEADER_LENGTH.size + length:]
+
+        self.assertEqual(header['seq'], 12)
+        self.assertEqual(header['profile'], 'full')
+        self.assertEqual(header['tracks'], update.tracks)
+        self.assertEqual(header['frame_size'], len(update.jpeg))
+        self.assertEqual([face['image_size'] for face in header['detected_faces']], [6, 0])
+        self.assertNotIn('image_data', header['detected_faces'][0])
+        self.assertEqual(body, b'frame-jpeg' + b'crop-1')
+        # The update's faces are not modified
+        self.assertEqual(update.detected_faces[0]['image_data'], b'crop-1')
+
+
+class EncodingProfileTests(SimpleTestCase):
+    def test_parse_profiles(self):
+        self.assertEqual(parse_profiles('full:0:80, medium:960:65,low:640:50,'), [
+            EncodingProfile('full', 0, 80),
+            EncodingProfile('medium', 960, 65),
+            EncodingProfile('low', 640, 50),
+        ])
+
+    def test_invalid_profiles(self):
+        for spec in ('', ',', 'full:0', 'full:wide:80', 'full:-1:80', 'full:0:0', 'full:0:101'):
+            with self.subTest(spec=spec), self.assertRaises(ValueError):
+                parse_profiles(spec)
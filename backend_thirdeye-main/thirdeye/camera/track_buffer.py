@@ -0,0 +1,120 @@
+# camera/track_buffer.py
+import time
+import heapq
+import itertools
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# One scored sighting of a tracked face. `id` is the TempFace primary key in
+# durable mode and a process-local sequence number otherwise.
+FaceCandidate = namedtuple('FaceCandidate', [
+    'id', 'face_id', 'image_data', 'embedding', 'last_seen',
+    'quality_score', 'blur_score', 'pose_score', 'size_score',
+])
+
+_candidate_ids = itertools.count(1)
+
+
+def next_candidate_id():
+    return next(_candidate_ids)
+
+
+class _TrackEntry:
+    __slots__ = ('face_id', 'heap', 'opened_at', 'updated_at', 'sightings')
+
+    def __init__(self, face_id, now):
+        self.face_id = face_id
+        self.heap = []
+        self.opened_at = now
+        self.updated_at = now
+        self.sightings = 0
+
+
+class TrackBuffer:
+    """
+    Staging area for the face crops of one stream's live tracks, kept in
+    memory instead of round-tripping through TempFace.
+
+    Each track holds only its best `max_candidates` crops by quality score
+    (a min-heap, so the worst one is evicted in O(log K)). A track is
+    flushed when it leaves the frame or after it has been open for
+    `max_age` seconds, and the caller persists only the best crop.
+    """
+
+    def __init__(self, max_candidates, max_age):
+        self.max_candidates = max_candidates
+        self.max_age = max_age
+        self._entries = {}
+        self._order = itertools.count()
+        self.candidates_added = 0
+        self.candidates_evicted = 0
+        self.tracks_flushed = 0
+
+    def __contains__(self, track_id):
+        return track_id in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def track_ids(self):
+        return list(self._entries)
+
+    def open(self, track_id, face_id):
+        entry = self._entries.get(track_id)
+        if entry is None:
+            entry = self._entries[track_id] = _TrackEntry(face_id, time.monotonic())
+        return entry
+
+    def accepts(self, track_id, quality_score):
+        """
+        Whether a crop of this quality would make the track's top-K, so the
+        caller can skip embedding and encoding crops that would be dropped.
+        """
+        entry = self._entries.get(track_id)
+        return entry is None or len(entry.heap) < self.max_candidates or quality_score > entry.heap[0][0]
+
+    def add(self, track_id, candidate):
+        """
+        Offer a candidate for a track. Returns the candidate that did not
+        make the top-K (the new one or the previous worst), or None.
+        """
+        entry = self.open(track_id, candidate.face_id)
+        entry.sightings += 1
+        entry.updated_at = time.monotonic()
+        self.candidates_added += 1
+
+        item = (candidate.quality_score, next(self._order), candidate)
+        if len(entry.heap) < self.max_candidates:
+            heapq.heappush(entry.heap, item)
+            return None
+
+        self.candidates_evicted += 1
+        return heapq.heappushpop(entry.heap, item)[2]
+
+    def flush(self, track_id):
+        """
+        Remove a track and return its candidates, best first.
+        """
+        entry = self._entries.pop(track_id, None)
+        if entry is None:
+            return []
+        self.tracks_flushed += 1
+        return [candidate for _, _, candidate in sorted(entry.heap, reverse=True)]
+
+    def expired(self, now=None):
+        """
+        Track ids that have been open for longer than max_age seconds.
+        """
+        now = time.monotonic() if now is None else now
+        return [track_id for track_id, entry in self._entries.items() if now - entry.opened_at >= self.max_age]
+
+    def stats(self):
+        return {
+            'tracks': len(self._entries),
+            'candidates': sum(len(entry.heap) for entry in self._entries.values()),
+            'candidates_added': self.candidates_added,
+            'candidates_evicted': self.candidates_evicted,
+            'tracks_flushed': self.tracks_flushed,
+        }
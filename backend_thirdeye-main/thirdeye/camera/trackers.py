@@ -0,0 +1,144 @@
+# camera/trackers.py
+from collections import deque
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from deep_sort_realtime.deep_sort import kalman_filter
+from deep_sort_realtime.deep_sort.track import Track
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """
+    Pairwise IoU of two (N, 4) and (M, 4) arrays of (x1, y1, x2, y2) boxes.
+    """
+    boxes_a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(boxes_a[:, 2:] - boxes_a[:, :2], axis=1)
+    area_b = np.prod(boxes_b[:, 2:] - boxes_b[:, :2], axis=1)
+    return intersection / np.maximum(area_a[:, None] + area_b[None, :] - intersection, 1e-6)
+
+
+def assign(cost, max_cost):
+    """
+    Minimum-cost assignment on a (tracks, detections) cost matrix, keeping
+    only pairs cheaper than max_cost. Returns (track_rows, detection_cols).
+    """
+    if cost.size == 0:
+        return [], []
+    rows, cols = linear_sum_assignment(cost)
+    keep = cost[rows, cols] <= max_cost
+    return list(rows[keep]), list(cols[keep])
+
+
+class ByteTracker:
+    """
+    Motion-only tracker in the style of ByteTrack: detections are
+    associated with Kalman-predicted track boxes by IoU alone, so no
+    appearance distance matrices are computed for tracks that are in view.
+
+    Association runs in stages:
+    1. high-confidence detections against every track, by IoU;
+    2. low-confidence detections against tracks still in view, by a
+       stricter IoU, which keeps tracks alive through blur and occlusion;
+    3. remaining high-confidence detections against lost tracks by
+       appearance (cosine distance to their last `budget` descriptors),
+       to re-attach faces that reappear away from their predicted box.
+
+    Exposes the same predict() / update() / tracks interface as the
+    DeepSORT Tracker and uses its Track objects, so FaceRecognitionProcessor
+    treats both alike.
+    """
+
+    def __init__(self, max_age=30, n_init=3, high_confidence=0.5, low_confidence=0.1,
+                 max_iou_distance=0.8, low_max_iou_distance=0.5, max_cosine_distance=0.3, budget=10):
+        self.max_age = max_age
+        self.n_init = n_init
+        self.high_confidence = high_confidence
+        self.low_confidence = low_confidence
+        self.max_iou_distance = max_iou_distance
+        self.low_max_iou_distance = low_max_iou_distance
+        self.max_cosine_distance = max_cosine_distance
+        self.budget = budget
+        self.kf = kalman_filter.KalmanFilter()
+        self.tracks = []
+        self.features = {}
+        self._next_id = 1
+
+    def predict(self):
+        for track in self.tracks:
+            track.predict(self.kf)
+
+    def update(self, detections):
+        high = [i for i, det in enumerate(detections) if det.confidence >= self.high_confidence]
+        low = [i for i, det in enumerate(detections) if self.low_confidence <= det.confidence < self.high_confidence]
+        det_boxes = np.array([det.to_tlbr() for det in detections], dtype=np.float32).reshape(-1, 4)
+        track_boxes = np.array([track.to_tlbr() for track in self.tracks], dtype=np.float32).reshape(-1, 4)
+
+        matches = []
+        # Stage 1: high-confidence detections against all tracks, by IoU
+        unmatched_tracks = list(range(len(self.tracks)))
+        rows, cols = assign(1.0 - iou_matrix(track_boxes, det_boxes[high]), self.max_iou_distance)
+        matches += [(unmatched_tracks[r], high[c]) for r, c in zip(rows, cols)]
+        unmatched_tracks = [t for i, t in enumerate(unmatched_tracks) if i not in rows]
+        unmatched_high = [d for i, d in enumerate(high) if i not in cols]
+
+        # Stage 2: low-confidence detections against tracks still in view
+        in_view = [t for t in unmatched_tracks if self.tracks[t].time_since_update <= 1]
+        rows, cols = assign(1.0 - iou_matrix(track_boxes[in_view], det_boxes[low]), self.low_max_iou_distance)
+        matches += [(in_view[r], low[c]) for r, c in zip(rows, cols)]
+        matched = {in_view[r] for r in rows}
+        unmatched_tracks = [t for t in unmatched_tracks if t not in matched]
+
+        # Stage 3: appearance only for confirmed tracks that were lost
+        lost = [t for t in unmatched_tracks if self.tracks[t].is_confirmed() and self.tracks[t].time_since_update > 1]
+        if lost and unmatched_high:
+            rows, cols = assign(self.appearance_cost(lost, [detections[d] for d in unmatched_high]), self.max_cosine_distance)
+            matches += [(lost[r], unmatched_high[c]) for r, c in zip(rows, cols)]
+            matched = {lost[r] for r in rows}
+            unmatched_tracks = [t for t in unmatched_tracks if t not in matched]
+            unmatched_high = [d for i, d in enumerate(unmatched_high) if i not in cols]
+
+        for track_idx, det_idx in matches:
+            track = self.tracks[track_idx]
+            track.update(self.kf, detections[det_idx])
+            self.features.setdefault(track.track_id, deque(maxlen=self.budget)).extend(track.features)
+            track.features = []
+        for track_idx in unmatched_tracks:
+            self.tracks[track_idx].mark_missed()
+        for det_idx in unmatched_high:
+            self._initiate_track(detections[det_idx])
+
+        for track in self.tracks:
+            if track.is_deleted():
+                self.features.pop(track.track_id, None)
+        self.tracks = [track for track in self.tracks if not track.is_deleted()]
+
+    def appearance_cost(self, track_indices, detections):
+        """
+        Smallest cosine distance between each lost track's stored descriptors
+        and each detection's descriptor.
+        """
+        queries = np.array([det.feature for det in detections], dtype=np.float32)
+        queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-6)
+        cost = np.ones((len(track_indices), len(detections)), dtype=np.float32)
+        for row, track_idx in enumerate(track_indices):
+            samples = self.features.get(self.tracks[track_idx].track_id)
+            if samples:
+                samples = np.array(samples, dtype=np.float32)
+                samples /= np.maximum(np.linalg.norm(samples, axis=1, keepdims=True), 1e-6)
+                cost[row] = (1.0 - samples @ queries.T).min(axis=0)
+        return cost
+
+    def _initiate_track(self, detection):
+        mean, covariance = self.kf.initiate(detection.to_xyah())
+        track = Track(
+            mean, covariance, str(self._next_id), self.n_init, self.max_age,
+            original_ltwh=detection.get_ltwh(),
+            det_conf=detection.confidence,
+            others=detection.others,
+        )
+        self.tracks.append(track)
+        self.features[track.track_id] = deque([detection.feature], maxlen=self.budget)
+        self._next_id += 1
@@ -10,10 +10,21 @@ from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 from channels.security.websocket import AllowedHostsOriginValidator
 import camera.routing
+from camera.lifecycle import LifespanApp, install_reactor_shutdown
+from django.conf import settings
+
+if settings.FACE_MODELS_WARMUP:
+    # Load the face models before the first WebSocket connects
+    from camera.model_registry import model_registry
+    model_registry.warm_up()
+
+# Flush open streams and queued database writes when the worker stops
+install_reactor_shutdown()
 
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
     "websocket": AllowedHostsOriginValidator(
         AuthMiddlewareStack(URLRouter(camera.routing.websocket_urlpatterns))
     ),
-})
\ No newline at end of file
+    "lifespan": LifespanApp(),
+})
@@ -214,3 +214,102 @@ EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD')
 
 USE_TZ = True
 TIME_ZONE = 'Asia/Kolkata'
+
+# Face recognition models (shared per worker by camera.model_registry)
+FACE_DETECTOR_WEIGHTS = config('FACE_DETECTOR_WEIGHTS', default=os.path.join(BASE_DIR, 'yolov8m-face.pt'))
+FACE_MODELS_WARMUP = config('FACE_MODELS_WARMUP', default=False, cast=bool)
+
+# Face detector backend (camera.detectors): 'ultralytics' runs the weights
+# above through torch; 'onnx' (needs onnxruntime) and 'opencv' run the
+# exported ONNX model on the CPU. INT8 quantises the ONNX model on first
+# use; THREADS caps ONNX Runtime's intra-op threads (0 = runtime default).
+FACE_DETECTOR_BACKEND = config('FACE_DETECTOR_BACKEND', default='ultralytics')
+FACE_DETECTOR_ONNX = config('FACE_DETECTOR_ONNX', default=os.path.join(BASE_DIR, 'yolov8m-face.onnx'))
+FACE_DETECTOR_INPUT_SIZE = config('FACE_DETECTOR_INPUT_SIZE', default=640, cast=int)
+FACE_DETECTOR_THREADS = config('FACE_DETECTOR_THREADS', default=0, cast=int)
+FACE_DETECTOR_INT8 = config('FACE_DETECTOR_INT8', default=False, cast=bool)
+
+# Cross-camera batched face detection (camera.inference_scheduler)
+FACE_DETECTION_BATCH_SIZE = config('FACE_DETECTION_BATCH_SIZE', default=8, cast=int)
+FACE_DETECTION_BATCH_WAIT_MS = config('FACE_DETECTION_BATCH_WAIT_MS', default=15, cast=float)
+
+# Cross-camera batched face embedding (camera.inference_scheduler). Faces
+# whose detected box is smaller than MIN_SIZE pixels are not embedded.
+FACE_EMBEDDING_BATCH_SIZE = config('FACE_EMBEDDING_BATCH_SIZE', default=8, cast=int)
+FACE_EMBEDDING_BATCH_WAIT_MS = config('FACE_EMBEDDING_BATCH_WAIT_MS', default=10, cast=float)
+FACE_EMBEDDING_MIN_SIZE = config('FACE_EMBEDDING_MIN_SIZE', default=40, cast=int)
+
+# Face embedder backend (camera.embedders): 'dlib' (128-d, face_recognition)
+# or 'onnx', an ArcFace-style network run by onnxruntime. DIM and THRESHOLD
+# (Euclidean, on L2-normalised vectors) describe the ONNX model. Run
+# reembed_faces after switching so stored faces stay comparable.
+FACE_EMBEDDER_BACKEND = config('FACE_EMBEDDER_BACKEND', default='dlib')
+FACE_EMBEDDER_ONNX = config('FACE_EMBEDDER_ONNX', default=os.path.join(BASE_DIR, 'arcface.onnx'))
+FACE_EMBEDDER_DIM = config('FACE_EMBEDDER_DIM', default=512, cast=int)
+FACE_EMBEDDER_THRESHOLD = config('FACE_EMBEDDER_THRESHOLD', default=1.1, cast=float)
+FACE_EMBEDDER_THREADS = config('FACE_EMBEDDER_THREADS', default=0, cast=int)
+
+# Executor for the blocking per-frame pipeline stages (camera.pipeline).
+# 'process' only applies to stateless stages (embedding, JPEG encoding).
+FACE_PIPELINE_EXECUTOR = config('FACE_PIPELINE_EXECUTOR', default='thread')
+FACE_PIPELINE_WORKERS = config('FACE_PIPELINE_WORKERS', default=4, cast=int)
+
+# Seconds before a worker reloads a user's in-memory face gallery (camera.face_index)
+FACE_GALLERY_TTL = config('FACE_GALLERY_TTL', default=300, cast=int)
+
+# Face gallery search backend: 'exact' scan or 'ivf' approximate search (camera.ann_index)
+FACE_INDEX_BACKEND = config('FACE_INDEX_BACKEND', default='exact')
+FACE_INDEX_NPROBE = config('FACE_INDEX_NPROBE', default=8, cast=int)
+# Trained IVF centroids are kept per user under FACE_INDEX_DIR (not in git)
+FACE_INDEX_DIR = config('FACE_INDEX_DIR', default=os.path.join(BASE_DIR, 'face_index'))
+
+# On-disk format of face embeddings: 'float32', 'float16' or 'int8' (camera.embeddings)
+FACE_EMBEDDING_STORAGE = config('FACE_EMBEDDING_STORAGE', default='float32')
+
+# In-memory staging of each track's best face crops (camera.track_buffer).
+# Tracks are flushed when they leave the frame or after MAX_AGE seconds;
+# DURABLE also mirrors staged crops to TempFace for crash recovery.
+FACE_TRACK_BUFFER_MAX_AGE = config('FACE_TRACK_BUFFER_MAX_AGE', default=30, cast=int)
+FACE_TRACK_BUFFER_DURABLE = config('FACE_TRACK_BUFFER_DURABLE', default=False, cast=bool)
+
+# Per-worker consolidation of finished tracks (camera.consolidation): a batch
+# is processed at most LATENCY_MS after its first track was flushed.
+FACE_CONSOLIDATION_LATENCY_MS = config('FACE_CONSOLIDATION_LATENCY_MS', default=500, cast=float)
+FACE_CONSOLIDATION_BATCH_SIZE = config('FACE_CONSOLIDATION_BATCH_SIZE', default=32, cast=int)
+
+# Write-behind batching of face, visit and notification rows (camera.persistence)
+FACE_WRITE_BATCH_SIZE = config('FACE_WRITE_BATCH_SIZE', default=200, cast=int)
+FACE_WRITE_MAX_DELAY_MS = config('FACE_WRITE_MAX_DELAY_MS', default=1000, cast=float)
+FACE_WRITE_MAX_PENDING = config('FACE_WRITE_MAX_PENDING', default=2000, cast=int)
+
+# Per-stream frame scheduling (camera.frame_scheduler): end-to-end latency
+# target and the maximum rate at which frames go through face detection
+FACE_STREAM_TARGET_LATENCY_MS = config('FACE_STREAM_TARGET_LATENCY_MS', default=300, cast=float)
+FACE_STREAM_DETECTION_FPS = config('FACE_STREAM_DETECTION_FPS', default=10, cast=float)
+
+# Viewers of a camera share one capture and pipeline (camera.stream_hub),
+# kept alive GRACE_SECONDS after the last viewer leaves. VIEWER_QUEUE is
+# how many frames a slow viewer may fall behind before frames are dropped.
+FACE_STREAM_GRACE_SECONDS = config('FACE_STREAM_GRACE_SECONDS', default=10, cast=float)
+FACE_STREAM_VIEWER_QUEUE = config('FACE_STREAM_VIEWER_QUEUE', default=2, cast=int)
+
+# Resolution/quality profiles video is sent at (camera.output_stage), best
+# first, as name:max_width:jpeg_quality (width 0 keeps the camera's). Each
+# frame is encoded once per profile in use; a viewer that falls behind is
+# moved down a profile, and back up after UPGRADE_SECONDS keeping up.
+FACE_STREAM_PROFILES = config('FACE_STREAM_PROFILES', default='full:0:80,medium:960:65,low:640:50')
+FACE_STREAM_UPGRADE_SECONDS = config('FACE_STREAM_UPGRADE_SECONDS', default=5, cast=float)
+
+# Default updates per second sent to metadata-only viewers (?mode=metadata);
+# 0 sends every frame whose tracks were refreshed
+FACE_METADATA_RATE = config('FACE_METADATA_RATE', default=5, cast=float)
+
+# Skip face detection on static scenes (camera.motion). MIN_AREA is the
+# fraction of the downscaled frame that must change to count as motion.
+FACE_MOTION_GATE = config('FACE_MOTION_GATE', default=True, cast=bool)
+FACE_MOTION_MIN_AREA = config('FACE_MOTION_MIN_AREA', default=0.002, cast=float)
+
+# Keyframe mode: detect every N frames (0 = adaptive to track count and
+# motion) and move the boxes of tracks in view by optical flow in between
+FACE_KEYFRAME_INTERVAL = config('FACE_KEYFRAME_INTERVAL', default=0, cast=int)
+FACE_KEYFRAME_TRACKING = config('FACE_KEYFRAME_TRACKING', default=True, cast=bool)